@@ -0,0 +1,33 @@
+"""Retry schedule and dead letter state for crypto operations
+
+Revision ID: 1c9e4a7b3d52
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1c9e4a7b3d52'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('crypto_operation', sa.Column('next_attempt_at', websauna.system.model.columns.UTCDateTime(), nullable=True))
+
+    # PostgreSQL does not allow adding enum values inside a transaction block
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE operation_state ADD VALUE IF NOT EXISTS 'dead_letter'")
+
+
+def downgrade():
+    # Enum values cannot be dropped. Put dead letter operations back to failed and leave the value unused.
+    op.execute("UPDATE crypto_operation SET state = 'failed' WHERE state = 'dead_letter'")
+    op.drop_column('crypto_operation', 'next_attempt_at')
@@ -0,0 +1,54 @@
+"""Persist asset slugs
+
+Revision ID: 2e8b5d1f7c46
+Revises: a61c4f8e2d93
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2e8b5d1f7c46'
+down_revision = 'a61c4f8e2d93'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from slugify import slugify
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('asset', sa.Column('slug', sa.String(length=256), nullable=True))
+
+    # Same rules as Asset.get_default_slug(). Before this, of the assets with colliding slugs only the first one was reachable, the others get a numbered persistent slug.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, network_id, name, other_data->>'slug' FROM asset ORDER BY created_at")).fetchall()
+    taken = set()
+    for asset_id, network_id, name, persistent_slug in rows:
+        slug = persistent_slug or (slugify(name) if name else None)
+        if not slug:
+            continue
+
+        candidate = slug
+        counter = 2
+        while (network_id, candidate) in taken:
+            candidate = "{}-{}".format(slug, counter)
+            counter += 1
+
+        taken.add((network_id, candidate))
+        conn.execute(sa.text("UPDATE asset SET slug = :slug WHERE id = :id"), {"slug": candidate, "id": asset_id})
+
+        if candidate != slug:
+            # Make the suffix persistent, so that it is not lost when the asset is saved next time
+            conn.execute(sa.text("UPDATE asset SET other_data = jsonb_set(coalesce(other_data, '{}'), '{slug}', to_jsonb(CAST(:slug AS text))) WHERE id = :id"), {"slug": candidate, "id": asset_id})
+
+    op.create_unique_constraint('slug_per_network', 'asset', ['network_id', 'slug'])
+
+
+def downgrade():
+    op.drop_constraint('slug_per_network', 'asset', type_='unique')
+    op.drop_column('asset', 'slug')
@@ -0,0 +1,45 @@
+"""Integer base unit columns for assets, accounts and transactions
+
+Revision ID: 3f1c2a9d8b01
+Revises: 1c9e4a7b3d52
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d8b01'
+down_revision = '1c9e4a7b3d52'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('asset', sa.Column('decimals', sa.Integer(), nullable=True))
+    op.add_column('asset', sa.Column('supply_raw', sa.Numeric(precision=78, scale=0), nullable=True))
+    op.add_column('account', sa.Column('balance_raw', sa.Numeric(precision=78, scale=0), nullable=True))
+    op.add_column('account_transaction', sa.Column('amount_raw', sa.Numeric(precision=78, scale=0), nullable=True))
+
+    # Ether is always tracked in wei
+    op.execute("UPDATE asset SET decimals = 18 WHERE asset_class = 'ether'")
+    op.execute("UPDATE asset SET supply_raw = trunc(supply * power(10::numeric, decimals)) WHERE decimals IS NOT NULL AND supply IS NOT NULL")
+    op.execute("""
+        UPDATE account SET balance_raw = trunc(account.denormalized_balance * power(10::numeric, asset.decimals))
+        FROM asset WHERE account.asset_id = asset.id AND asset.decimals IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE account_transaction SET amount_raw = trunc(account_transaction.amount * power(10::numeric, asset.decimals))
+        FROM account, asset WHERE account_transaction.account_id = account.id AND account.asset_id = asset.id AND asset.decimals IS NOT NULL
+    """)
+
+
+def downgrade():
+    op.drop_column('account_transaction', 'amount_raw')
+    op.drop_column('account', 'balance_raw')
+    op.drop_column('asset', 'supply_raw')
+    op.drop_column('asset', 'decimals')
@@ -0,0 +1,103 @@
+"""Partition account_transaction by month
+
+Revision ID: 5b2f8e3c9a14
+Revises: e4b19c7d5a60
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b2f8e3c9a14'
+down_revision = 'e4b19c7d5a60'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    # The existing table becomes the first partition as is, without copying rows. It covers everything until the end of the current month and wallet.maintain_transaction_partitions task creates monthly partitions after it.
+    today = datetime.datetime.utcnow()
+    if today.month == 12:
+        legacy_end = datetime.datetime(today.year + 1, 1, 1)
+    else:
+        legacy_end = datetime.datetime(today.year, today.month + 1, 1)
+
+    bound = "'{}+00'".format(legacy_end.isoformat(" "))
+
+    # Steps which scan the whole table run first in their own transactions, which do not block reads and writes of the table. A validated CHECK matching the partition bound lets ATTACH skip its scan, and the primary key of a partition must include the partition key.
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE account_transaction ADD CONSTRAINT ck_account_transaction_legacy_bound CHECK (created_at < {}) NOT VALID".format(bound))
+        op.execute("ALTER TABLE account_transaction VALIDATE CONSTRAINT ck_account_transaction_legacy_bound")
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS pk_account_transaction_legacy ON account_transaction (id, created_at)")
+
+    # Partitions cannot have foreign keys pointing to them by id alone. Other foreign keys are cloned from the parent when the partition is attached.
+    op.drop_constraint('fk_account_transaction_counterparty_id_account_transaction', 'account_transaction', type_='foreignkey')
+    op.drop_constraint('fk_account_transaction_account_id_account', 'account_transaction', type_='foreignkey')
+    op.drop_constraint('fk_account_transaction_operation_id_crypto_operation', 'account_transaction', type_='foreignkey')
+
+    op.rename_table('account_transaction', 'account_transaction_legacy')
+    op.drop_constraint('pk_account_transaction', 'account_transaction_legacy', type_='primary')
+    op.execute("ALTER TABLE account_transaction_legacy ADD CONSTRAINT pk_account_transaction_legacy PRIMARY KEY USING INDEX pk_account_transaction_legacy")
+    op.execute("ALTER INDEX ix_account_transaction_account_created_at RENAME TO ix_account_transaction_legacy_account_created_at")
+    op.execute("ALTER INDEX ix_account_transaction_operation_id RENAME TO ix_account_transaction_legacy_operation_id")
+
+    op.create_table('account_transaction',
+        sa.Column('id', postgresql.UUID(as_uuid=True), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+        sa.Column('created_at', websauna.system.model.columns.UTCDateTime(), nullable=False),
+        sa.Column('updated_at', websauna.system.model.columns.UTCDateTime(), nullable=True),
+        sa.Column('account_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('amount', sa.Numeric(precision=60, scale=20), server_default='0', nullable=False),
+        sa.Column('amount_raw', sa.Numeric(precision=78, scale=0), nullable=True),
+        sa.Column('message', sa.String(length=256), nullable=True),
+        sa.Column('counterparty_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('operation_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['account.id'], name=op.f('fk_account_transaction_account_id_account')),
+        sa.ForeignKeyConstraint(['operation_id'], ['crypto_operation.id'], name=op.f('fk_account_transaction_operation_id_crypto_operation')),
+        sa.PrimaryKeyConstraint('id', 'created_at', name=op.f('pk_account_transaction')),
+        postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index('ix_account_transaction_account_created_at', 'account_transaction', ['account_id', 'created_at'], unique=False)
+    op.create_index('ix_account_transaction_operation_id', 'account_transaction', ['operation_id'], unique=False)
+
+    # Matching indexes and the primary key of the legacy table are attached to the parent indexes
+    op.execute("ALTER TABLE account_transaction ATTACH PARTITION account_transaction_legacy FOR VALUES FROM (MINVALUE) TO ({})".format(bound))
+    op.drop_constraint('ck_account_transaction_legacy_bound', 'account_transaction_legacy', type_='check')
+    op.execute("CREATE TABLE account_transaction_default PARTITION OF account_transaction DEFAULT")
+
+    op.create_table('account_transaction_archive',
+        sa.Column('id', postgresql.UUID(as_uuid=True), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+        sa.Column('partition_name', sa.String(length=64), nullable=False),
+        sa.Column('range_start', websauna.system.model.columns.UTCDateTime(), nullable=True),
+        sa.Column('range_end', websauna.system.model.columns.UTCDateTime(), nullable=False),
+        sa.Column('archived_at', websauna.system.model.columns.UTCDateTime(), nullable=False),
+        sa.Column('transaction_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_account_transaction_archive')),
+        sa.UniqueConstraint('partition_name', name=op.f('uq_account_transaction_archive_partition_name'))
+    )
+
+
+def downgrade():
+    # Copies live rows back to a plain table. Archived partitions are not restored.
+    op.drop_table('account_transaction_archive')
+
+    op.rename_table('account_transaction', 'account_transaction_partitioned')
+    op.execute("ALTER TABLE account_transaction_partitioned RENAME CONSTRAINT pk_account_transaction TO pk_account_transaction_partitioned")
+    op.execute("ALTER INDEX ix_account_transaction_account_created_at RENAME TO ix_account_transaction_partitioned_account_created_at")
+    op.execute("ALTER INDEX ix_account_transaction_operation_id RENAME TO ix_account_transaction_partitioned_operation_id")
+
+    op.execute("CREATE TABLE account_transaction (LIKE account_transaction_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO account_transaction SELECT * FROM account_transaction_partitioned")
+    op.drop_table('account_transaction_partitioned')
+
+    op.create_primary_key(op.f('pk_account_transaction'), 'account_transaction', ['id'])
+    op.create_index('ix_account_transaction_account_created_at', 'account_transaction', ['account_id', 'created_at'], unique=False)
+    op.create_index('ix_account_transaction_operation_id', 'account_transaction', ['operation_id'], unique=False)
+    op.create_foreign_key(op.f('fk_account_transaction_account_id_account'), 'account_transaction', 'account', ['account_id'], ['id'])
+    op.create_foreign_key(op.f('fk_account_transaction_operation_id_crypto_operation'), 'account_transaction', 'crypto_operation', ['operation_id'], ['id'])
+    op.create_foreign_key(op.f('fk_account_transaction_counterparty_id_account_transaction'), 'account_transaction', 'account_transaction', ['counterparty_id'], ['id'])
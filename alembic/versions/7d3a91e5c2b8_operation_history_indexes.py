@@ -0,0 +1,30 @@
+"""Indexes for paginated transaction history
+
+Revision ID: 7d3a91e5c2b8
+Revises: 5b2f8e3c9a14
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d3a91e5c2b8'
+down_revision = '5b2f8e3c9a14'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_index('ix_user_crypto_operation_user_id', 'user_crypto_operation', ['user_id'], unique=False)
+    op.create_index('ix_crypto_operation_created_at_id', 'crypto_operation', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_crypto_operation_created_at_id', table_name='crypto_operation')
+    op.drop_index('ix_user_crypto_operation_user_id', table_name='user_crypto_operation')
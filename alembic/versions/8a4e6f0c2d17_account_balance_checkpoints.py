@@ -0,0 +1,38 @@
+"""Account balance checkpoints
+
+Revision ID: 8a4e6f0c2d17
+Revises: 3f1c2a9d8b01
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6f0c2d17'
+down_revision = '3f1c2a9d8b01'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('account_balance_checkpoint',
+        sa.Column('id', postgresql.UUID(as_uuid=True), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+        sa.Column('account_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('taken_at', websauna.system.model.columns.UTCDateTime(), nullable=False),
+        sa.Column('balance', sa.Numeric(precision=60, scale=20), nullable=False),
+        sa.ForeignKeyConstraint(['account_id'], ['account.id'], name=op.f('fk_account_balance_checkpoint_account_id_account')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_account_balance_checkpoint')),
+        sa.UniqueConstraint('account_id', 'taken_at', name='one_checkpoint_per_time')
+    )
+    op.create_index('ix_account_transaction_account_created_at', 'account_transaction', ['account_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_account_transaction_account_created_at', table_name='account_transaction')
+    op.drop_table('account_balance_checkpoint')
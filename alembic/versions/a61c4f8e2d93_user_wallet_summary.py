@@ -0,0 +1,56 @@
+"""Per user wallet summary
+
+Revision ID: a61c4f8e2d93
+Revises: 7d3a91e5c2b8
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a61c4f8e2d93'
+down_revision = '7d3a91e5c2b8'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('user_wallet_summary',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('pending_operation_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('balances', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+        sa.Column('last_activity_at', websauna.system.model.columns.UTCDateTime(), nullable=True),
+        sa.Column('updated_at', websauna.system.model.columns.UTCDateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], name=op.f('fk_user_wallet_summary_user_id_users')),
+        sa.PrimaryKeyConstraint('user_id', name=op.f('pk_user_wallet_summary'))
+    )
+
+    # Existing users, same calculation as UserWalletSummary.refresh()
+    op.execute("""
+        INSERT INTO user_wallet_summary (user_id, pending_operation_count, balances, last_activity_at, updated_at)
+        SELECT
+            u.user_id,
+            (SELECT count(*) FROM user_crypto_operation uo JOIN crypto_operation o ON o.id = uo.crypto_operation_id
+             WHERE uo.user_id = u.user_id AND CAST(o.state AS text) IN ('confirmation_required', 'waiting', 'broadcasted', 'pending', 'dead_letter')),
+            (SELECT coalesce(jsonb_object_agg(b.asset_id, b.balance), '{}') FROM (
+                SELECT CAST(a.asset_id AS text) AS asset_id, CAST(sum(coalesce(a.denormalized_balance, 0)) AS text) AS balance
+                FROM user_owned_crypto_address uca
+                JOIN crypto_address_account caa ON caa.address_id = uca.address_id
+                JOIN account a ON a.id = caa.account_id
+                WHERE uca.user_id = u.user_id
+                GROUP BY a.asset_id) b),
+            (SELECT max(greatest(o.created_at, o.updated_at)) FROM user_crypto_operation uo JOIN crypto_operation o ON o.id = uo.crypto_operation_id
+             WHERE uo.user_id = u.user_id),
+            now()
+        FROM (SELECT user_id FROM user_owned_crypto_address UNION SELECT user_id FROM user_crypto_operation) u
+    """)
+
+
+def downgrade():
+    op.drop_table('user_wallet_summary')
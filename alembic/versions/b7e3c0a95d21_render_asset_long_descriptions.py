@@ -0,0 +1,39 @@
+"""Render asset long descriptions stored before the HTML cache
+
+Revision ID: b7e3c0a95d21
+Revises: 2e8b5d1f7c46
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3c0a95d21'
+down_revision = '2e8b5d1f7c46'
+branch_labels = None
+depends_on = None
+
+import datetime
+import hashlib
+import websauna.system.model.columns
+
+from alembic import op
+import markdown
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Same as Asset.render_long_description(). Public pages only read the stored HTML and render stale descriptions on the fly without saving them.
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, other_data->>'long_description', other_data->>'long_description_hash' FROM asset WHERE other_data->>'long_description' IS NOT NULL")).fetchall()
+    for asset_id, source, stored_hash in rows:
+        source_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        if stored_hash == source_hash:
+            continue
+
+        html = markdown.markdown(source) if source else ""
+        conn.execute(sa.text("UPDATE asset SET other_data = other_data || jsonb_build_object('long_description_hash', CAST(:hash AS text), 'long_description_html', CAST(:html AS text)) WHERE id = :id"), {"hash": source_hash, "html": html, "id": asset_id})
+
+
+def downgrade():
+    # The stored HTML is only a cache, leave it in place
+    pass
@@ -0,0 +1,61 @@
+"""Per asset liability totals
+
+Revision ID: c52d7e91a3f4
+Revises: 8a4e6f0c2d17
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c52d7e91a3f4'
+down_revision = '8a4e6f0c2d17'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    liability_class = postgresql.ENUM('user', 'holding', 'house', name='liability_class')
+    liability_class.create(op.get_bind())
+
+    op.add_column('account', sa.Column('liability_class', postgresql.ENUM('user', 'holding', 'house', name='liability_class', create_type=False), server_default='user', nullable=False))
+
+    op.create_table('asset_liability',
+        sa.Column('asset_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('liability_class', postgresql.ENUM('user', 'holding', 'house', name='liability_class', create_type=False), nullable=False),
+        sa.Column('stripe', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('total', sa.Numeric(precision=60, scale=20), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['asset_id'], ['asset.id'], name=op.f('fk_asset_liability_asset_id_asset')),
+        sa.PrimaryKeyConstraint('asset_id', 'liability_class', 'stripe', name=op.f('pk_asset_liability'))
+    )
+
+    # Classify existing accounts
+    op.execute("""
+        UPDATE account SET liability_class = 'holding'
+        WHERE id IN (SELECT holding_account_id FROM crypto_operation WHERE holding_account_id IS NOT NULL)
+    """)
+    op.execute("""
+        UPDATE account SET liability_class = 'house'
+        FROM crypto_address_account, crypto_address, asset_network
+        WHERE crypto_address_account.account_id = account.id
+        AND crypto_address_account.address_id = crypto_address.id
+        AND crypto_address.network_id = asset_network.id
+        AND asset_network.other_data->>'house_address' = CAST(crypto_address.id AS text)
+    """)
+
+    op.execute("""
+        INSERT INTO asset_liability (asset_id, liability_class, stripe, total)
+        SELECT asset_id, liability_class, 0, sum(denormalized_balance) FROM account GROUP BY asset_id, liability_class
+    """)
+
+
+def downgrade():
+    op.drop_table('asset_liability')
+    op.drop_column('account', 'liability_class')
+    postgresql.ENUM(name='liability_class').drop(op.get_bind())
@@ -0,0 +1,51 @@
+"""Pooled escrow accounts for crypto operations
+
+Revision ID: e4b19c7d5a60
+Revises: c52d7e91a3f4
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4b19c7d5a60'
+down_revision = 'c52d7e91a3f4'
+branch_labels = None
+depends_on = None
+
+import datetime
+import websauna.system.model.columns
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('account', sa.Column('escrow_stripe', sa.Integer(), nullable=True))
+    op.create_unique_constraint('escrow_stripe_per_asset', 'account', ['asset_id', 'escrow_stripe'])
+
+    op.add_column('account_transaction', sa.Column('operation_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key(op.f('fk_account_transaction_operation_id_crypto_operation'), 'account_transaction', 'crypto_operation', ['operation_id'], ['id'])
+    op.create_index('ix_account_transaction_operation_id', 'account_transaction', ['operation_id'])
+
+    # Existing operations keep their own holding accounts. Tag their transactions, so that escrow lookups work the same way for old and new operations.
+    op.execute("""
+        UPDATE account_transaction SET operation_id = crypto_operation.id
+        FROM crypto_operation
+        WHERE account_transaction.account_id = crypto_operation.holding_account_id
+    """)
+
+    # The other leg of the transfers, on user accounts
+    op.execute("""
+        UPDATE account_transaction SET operation_id = c.operation_id
+        FROM account_transaction c
+        WHERE account_transaction.counterparty_id = c.id AND c.operation_id IS NOT NULL AND account_transaction.operation_id IS NULL
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_account_transaction_operation_id', table_name='account_transaction')
+    op.drop_constraint(op.f('fk_account_transaction_operation_id_crypto_operation'), 'account_transaction', type_='foreignkey')
+    op.drop_column('account_transaction', 'operation_id')
+    op.drop_constraint('escrow_stripe_per_asset', 'account', type_='unique')
+    op.drop_column('account', 'escrow_stripe')
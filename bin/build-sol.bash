@@ -2,11 +2,19 @@
 #
 # Compile sol contracts
 #
+# contracts/ are compiled by populus with solc 0.4.8.
+#
+# contracts-create2/ use CREATE2, which needs solc 0.5.17 targeting Constantinople.
+# Point SOLC_CREATE2 to that binary if it is not called solc-0.5.17 in PATH.
+#
 
 set -e
 set -u
 
+SOLC_CREATE2=${SOLC_CREATE2:-solc-0.5.17}
+
 pushd `pwd`
 cd websauna/wallet/ethereum
 populus compile
-popd
\ No newline at end of file
+$SOLC_CREATE2 --optimize --evm-version constantinople --combined-json abi,bin,bin-runtime,metadata contracts-create2/*.sol | python -m websauna.wallet.ethereum.compiler > build/contracts-create2.json
+popd
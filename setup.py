@@ -60,5 +60,8 @@ setup(name='websauna.wallet',
       wallet-bootstrap = websauna.wallet.bin.bootstrap:main
       ethereum-unlock = websauna.wallet.bin.unlock:main
       ethereum-clear-service-locks = websauna.wallet.bin.clearlocks:main
+      wallet-verify-liabilities = websauna.wallet.bin.liabilities:main
+      wallet-verify-ledger = websauna.wallet.bin.verifyledger:main
+      wallet-rebuild-summaries = websauna.wallet.bin.walletsummary:main
       """,
       )
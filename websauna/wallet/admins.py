@@ -9,6 +9,7 @@ from .models import Asset
 from .models import CryptoAddress
 from .models import Account
 from .models import     AssetNetwork
+from .models import CryptoOperation
 
 
 @model_admin(traverse_id="user-accounts")
@@ -122,3 +123,27 @@ class CryptoAccounts(ModelAdmin):
         crypto_account_ids = dbsession.query(CryptoAddressAccount.account_id).all()
         return dbsession.query(Account).filter(Account.id.in_(crypto_account_ids))
 
+
+@model_admin(traverse_id="crypto-operations")
+class CryptoOperationAdmin(ModelAdmin):
+    """Follow the progress of operations run by the Ethereum service."""
+
+    __acl__ = {
+        (Deny, Everyone, 'add'),
+        (Allow, 'group:admin', 'view'),
+        (Deny, Everyone, 'edit'),
+    }
+
+    #: Traverse title
+    title = "Crypto operations"
+
+    singular_name = "crypto-operation"
+    plural_name = "crypto-operations"
+    model = CryptoOperation
+
+    mapper = Base64UUIDMapper(mapping_attribute="id")
+
+    class Resource(ModelAdmin.Resource):
+
+        def get_title(self):
+            return self.get_object().human_friendly_type
@@ -18,7 +18,7 @@ from websauna.system.admin import views as adminbaseviews
 from websauna.wallet import admins
 from websauna.wallet.ethereum.utils import bin_to_eth_address, eth_address_to_bin
 from websauna.wallet.models import AssetClass
-from websauna.wallet.models.account import AssetState, Asset, AssetNetwork
+from websauna.wallet.models.account import AssetState, Asset, AssetNetwork, LONG_DESCRIPTION_CACHE_KEYS
 from websauna.wallet.views.schemas import validate_ethereum_address
 
 
@@ -101,6 +101,9 @@ class AssetSchema(colander.Schema):
         # Convert between binary storage and human readable hex presentation
         appstruct["long_description"] = obj.other_data.pop("long_description", "")
 
+        # Rendered HTML is not edited by hand
+        appstruct["other_data"] = {key: value for key, value in (appstruct.get("other_data") or {}).items() if key not in LONG_DESCRIPTION_CACHE_KEYS}
+
         if obj.external_id:
             appstruct["external_id"] = bin_to_eth_address(obj.external_id)
         else:
@@ -120,6 +123,7 @@ class AssetSchema(colander.Schema):
 
         # Special case of field stored inside JSON bag
         obj.other_data["long_description"] = appstruct["long_description"]
+        obj.render_long_description()
 
         # Convert between binary storage and human readable hex presentation
         if appstruct["external_id"]:
@@ -11,6 +11,8 @@ from websauna.wallet.models import UserOwnedAccount
 from websauna.wallet.models import UserCryptoAddress
 from websauna.wallet.models import CryptoAddressAccount
 from websauna.wallet.models import CryptoAddress
+from websauna.wallet.models import CryptoOperation
+from websauna.wallet.models import CryptoTokenImport
 from websauna.wallet.utils import get_asset_formatter, format_asset_amount
 
 from .. import admins
@@ -155,3 +157,32 @@ class AssetNetworkListing(DefaultListing):
             listing.ControlsColumn()
         ]
     )
+
+
+def get_operation_progress(view, column, op: CryptoOperation):
+    """Show how far a long running operation, like token import, has proceeded."""
+    if isinstance(op, CryptoTokenImport):
+        progress = op.get_import_progress()
+        if progress:
+            processed, total = progress
+            return "{}/{} addresses".format(processed, total)
+    return "-"
+
+
+@view_overrides(context=admins.CryptoOperationAdmin)
+class CryptoOperationListing(DefaultListing):
+    """List crypto operations, newest first."""
+
+    table = listing.Table(
+        columns = [
+            listing.Column("type", "Type", getter=lambda v, c, op: op.human_friendly_type),
+            listing.Column("state", "State", getter=lambda v, c, op: op.state.value),
+            listing.Column("network", "Network", getter=lambda v, c, op: op.network.name),
+            listing.Column("created_at", "Created"),
+            listing.Column("progress", "Progress", getter=get_operation_progress),
+            listing.ControlsColumn()
+        ]
+    )
+
+    def order_query(self, query):
+        return query.order_by(CryptoOperation.created_at.desc())
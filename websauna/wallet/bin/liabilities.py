@@ -0,0 +1,45 @@
+"""Verify and rebuild per asset liability totals."""
+import os
+import sys
+
+import transaction
+
+from websauna.wallet.models import Asset
+from websauna.wallet.models.account import verify_asset_liabilities
+
+
+def main(argv=sys.argv):
+
+    def usage(argv):
+        cmd = os.path.basename(argv[0])
+        print('usage: %s <config_uri> [--rebuild]\n'
+              '(example: "%s conf/production.ini")' % (cmd, cmd))
+        sys.exit(1)
+
+    if len(argv) < 2:
+        usage(argv)
+
+    config_uri = argv[1]
+    rebuild = "--rebuild" in argv[2:]
+
+    # console_app sets up colored log output
+    from websauna.system.devop.cmdline import init_websauna
+    request = init_websauna(config_uri, sanity_check=True)
+    dbsession = request.dbsession
+
+    with transaction.manager:
+        mismatches = verify_asset_liabilities(dbsession, rebuild=rebuild)
+        for asset_id, liability_class, aggregated, actual in mismatches:
+            asset = dbsession.query(Asset).get(asset_id)
+            print("{} {}: total {}, accounts sum {}".format(asset, liability_class.value, aggregated, actual))
+
+    if not mismatches:
+        print("Liability totals match account balances")
+        sys.exit(0)
+
+    if rebuild:
+        print("Rebuilt liability totals")
+        sys.exit(0)
+
+    print("Run with --rebuild to fix")
+    sys.exit(1)
@@ -0,0 +1,28 @@
+"""Verify ledger integrity."""
+import argparse
+import sys
+
+from websauna.wallet.ledgerverify import verify_ledger, DEFAULT_CHUNK_SIZE
+
+
+def main(argv=sys.argv):
+
+    parser = argparse.ArgumentParser(description="Verify account balances, transfer counterparties and holding accounts. Problems are written as JSON lines.")
+    parser.add_argument("config_uri", help="INI file, e.g. conf/production.ini")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes. Defaults to CPU count.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Accounts per verified range")
+    parser.add_argument("--report", default=None, help="Report file. Defaults to stdout.")
+    args = parser.parse_args(argv[1:])
+
+    # console_app sets up colored log output
+    from websauna.system.devop.cmdline import init_websauna
+    request = init_websauna(args.config_uri, sanity_check=True)
+    settings = dict(request.registry.settings)
+
+    if args.report:
+        with open(args.report, "wt") as report:
+            summary = verify_ledger(settings, report, workers=args.workers, chunk_size=args.chunk_size)
+    else:
+        summary = verify_ledger(settings, sys.stdout, workers=args.workers, chunk_size=args.chunk_size)
+
+    sys.exit(1 if summary["problems"] else 0)
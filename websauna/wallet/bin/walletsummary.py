@@ -0,0 +1,44 @@
+"""Rebuild per user wallet summaries."""
+import os
+import sys
+
+import transaction
+
+from websauna.wallet.models import UserCryptoAddress
+from websauna.wallet.models import UserCryptoOperation
+from websauna.wallet.models import UserWalletSummary
+
+
+#: Users recalculated per transaction
+CHUNK_SIZE = 500
+
+
+def main(argv=sys.argv):
+
+    def usage(argv):
+        cmd = os.path.basename(argv[0])
+        print('usage: %s <config_uri>\n'
+              '(example: "%s conf/production.ini")' % (cmd, cmd))
+        sys.exit(1)
+
+    if len(argv) < 2:
+        usage(argv)
+
+    config_uri = argv[1]
+
+    # console_app sets up colored log output
+    from websauna.system.devop.cmdline import init_websauna
+    request = init_websauna(config_uri, sanity_check=True)
+    dbsession = request.dbsession
+
+    with transaction.manager:
+        user_ids = dbsession.query(UserCryptoAddress.user_id).union(dbsession.query(UserCryptoOperation.user_id))
+        user_ids = sorted(row[0] for row in user_ids)
+
+    for i in range(0, len(user_ids), CHUNK_SIZE):
+        with transaction.manager:
+            for user_id in user_ids[i:i + CHUNK_SIZE]:
+                UserWalletSummary.refresh_by_id(dbsession, user_id)
+
+    print("Rebuilt wallet summaries of {} users".format(len(user_ids)))
+    sys.exit(0)
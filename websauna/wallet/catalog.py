@@ -0,0 +1,139 @@
+"""In-process catalog of publicly listed assets.
+
+Public asset listings and next/previous navigation on asset pages need all public assets of all visible networks in name order. The catalog keeps their ids in that order in process memory, so a listing page or a neighbour lookup loads only the assets it shows.
+
+The catalog is rebuilt when a session of this process commits changes to assets or networks, e.g. admin edits. Changes made by other processes, like token imports by the Ethereum service, are noticed by comparing :func:`get_catalog_version` every :data:`CATALOG_CHECK_SECONDS`.
+"""
+import bisect
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from websauna.wallet.models import Asset
+from websauna.wallet.models import AssetNetwork
+from websauna.wallet.models import AssetState
+
+
+#: How often we check if other processes have changed assets, seconds
+CATALOG_CHECK_SECONDS = 30
+
+
+#: sort_key is the lowercased title ``Name (SYMBOL)``, ties broken by asset id
+CatalogEntry = namedtuple("CatalogEntry", ["sort_key", "asset_id", "network_id"])
+
+
+_VERSION_SQL = """
+    SELECT
+        (SELECT count(*) FROM asset),
+        (SELECT max(coalesce(updated_at, created_at)) FROM asset),
+        (SELECT md5(coalesce(string_agg(name || CAST(other_data AS text), ',' ORDER BY id), '')) FROM asset_network)
+"""
+
+
+class AssetCatalog:
+    """Immutable snapshot of public assets in name order."""
+
+    def __init__(self, entries: List[CatalogEntry], version: str):
+        self.entries = sorted(entries, key=lambda e: (e.sort_key, str(e.asset_id)))
+        self.keys = [(e.sort_key, str(e.asset_id)) for e in self.entries]
+        self.sort_keys = {e.asset_id: e.sort_key for e in self.entries}
+        self.version = version
+
+    def __len__(self):
+        return len(self.entries)
+
+    def index(self, asset_id: UUID) -> Optional[int]:
+        """Position of an asset in name order or None if it is not listed."""
+        sort_key = self.sort_keys.get(asset_id)
+        if sort_key is None:
+            return None
+        return bisect.bisect_left(self.keys, (sort_key, str(asset_id)))
+
+    def get_neighbours(self, asset_id: UUID) -> Tuple[Optional[CatalogEntry], Optional[CatalogEntry]]:
+        """Get (next, previous) entries of an asset in name order."""
+        idx = self.index(asset_id)
+        if idx is None:
+            return None, None
+
+        prev = self.entries[idx - 1] if idx > 0 else None
+        next = self.entries[idx + 1] if idx + 1 < len(self.entries) else None
+        return next, prev
+
+    def get_page(self, offset: int, limit: int) -> List[CatalogEntry]:
+        return self.entries[offset:offset + limit]
+
+
+def get_catalog_version(dbsession: Session) -> str:
+    """Fingerprint of asset and network data which changes when the catalog must be rebuilt."""
+    row = dbsession.execute(_VERSION_SQL).fetchone()
+    return hashlib.md5(repr(tuple(row)).encode("utf-8")).hexdigest()
+
+
+def build_catalog(dbsession: Session) -> AssetCatalog:
+    """Read public assets of visible networks from the database."""
+    version = get_catalog_version(dbsession)
+
+    rows = dbsession.query(Asset.id, Asset.name, Asset.symbol, AssetNetwork.id, AssetNetwork.other_data).join(AssetNetwork).filter(Asset.state == AssetState.public)
+
+    entries = []
+    for asset_id, name, symbol, network_id, network_data in rows:
+        if not (network_data or {}).get("visible", True):
+            continue
+        # Same as AssetDescription.get_title()
+        sort_key = "{} ({})".format(name, symbol).lower()
+        entries.append(CatalogEntry(sort_key, asset_id, network_id))
+
+    return AssetCatalog(entries, version)
+
+
+_lock = threading.Lock()
+_catalog = None  # type: Optional[AssetCatalog]
+_checked_at = 0.0
+
+
+def get_catalog(dbsession: Session) -> AssetCatalog:
+    """Get the current catalog, rebuilding it if assets or networks have changed."""
+    global _catalog, _checked_at
+
+    with _lock:
+        current = time.monotonic()
+        if _catalog and current < _checked_at + CATALOG_CHECK_SECONDS:
+            return _catalog
+
+        if not _catalog or get_catalog_version(dbsession) != _catalog.version:
+            _catalog = build_catalog(dbsession)
+
+        _checked_at = current
+        return _catalog
+
+
+def invalidate_catalog():
+    """Rebuild the catalog on next access."""
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_catalog_changes(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, (Asset, AssetNetwork)):
+            session.info["wallet_catalog_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("wallet_catalog_changed", False):
+        invalidate_catalog()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_on_rollback(session):
+    session.info.pop("wallet_catalog_changed", None)
@@ -22,7 +22,6 @@ def get_eth_network(dbsession: Session, asset_network_name="ethereum") -> AssetN
     if not network:
         network = AssetNetwork(name=asset_network_name)
         dbsession.add(network)
-        dbsession.flush()  # Gives us network.id
     return network
 
 
@@ -38,9 +37,8 @@ def get_ether_asset(dbsession, network=None) -> Asset:
 
     # Ethereum supply is not stable
     # https://etherscan.io/stats/supply
-    asset = Asset(name="Ether", symbol="ETH", asset_class=AssetClass.ether, supply=0)
+    asset = Asset(name="Ether", symbol="ETH", asset_class=AssetClass.ether, supply=0, decimals=18)
     network.assets.append(asset)
-    dbsession.flush()
     return asset
 
 
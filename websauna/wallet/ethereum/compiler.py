@@ -3,17 +3,25 @@
 #: Compiled contracts in in-process memory
 import json
 import os
+import sys
 
 
 _compile_data = None
 
+#: Compiled contracts, in populus format. contracts-create2.json is built separately with a newer solc and is optional.
+BUILD_FILES = ["contracts.json", "contracts-create2.json"]
+
 
 def compile():
     """Compile all project .sol files and store in-process cache."""
     global _compile_data
     project_dir = os.path.dirname(__file__)  # ASssume appeneded /contracts
-    data_file = os.path.join(project_dir, "build", "contracts.json")
-    _compile_data = json.load(open(data_file, "rt"))
+    _compile_data = {}
+    for build_file in BUILD_FILES:
+        data_file = os.path.join(project_dir, "build", build_file)
+        if build_file != BUILD_FILES[0] and not os.path.exists(data_file):
+            continue
+        _compile_data.update(json.load(open(data_file, "rt")))
     return _compile_data
 
 
@@ -24,6 +32,28 @@ def get_compiled_contract_cached(name: str) -> dict:
     if not _compile_data:
         compile()
 
-    assert name in _compile_data, "No contract {}. Available: {}".format(name, _compile_data.keys())
+    assert name in _compile_data, "No contract {}, run bin/build-sol.bash to compile it. Available: {}".format(name, sorted(_compile_data.keys()))
 
     return _compile_data[name]
+
+
+def convert_combined_json(data: dict) -> dict:
+    """Convert ``solc --combined-json abi,bin,bin-runtime,metadata`` output to populus contracts.json format."""
+    contracts = {}
+    for key, compiled in data["contracts"].items():
+        if not compiled["bin"]:
+            # Interface
+            continue
+        name = key.split(":")[-1]
+        contracts[name] = {
+            "abi": json.loads(compiled["abi"]) if isinstance(compiled["abi"], str) else compiled["abi"],
+            "bytecode": "0x" + compiled["bin"],
+            "bytecode_runtime": "0x" + compiled["bin-runtime"],
+            "metadata": json.loads(compiled["metadata"]) if compiled.get("metadata") else {},
+        }
+    return contracts
+
+
+if __name__ == "__main__":
+    # Used by bin/build-sol.bash
+    json.dump(convert_combined_json(json.load(sys.stdin)), sys.stdout, indent=2, sort_keys=True)
@@ -0,0 +1,82 @@
+pragma solidity ^0.5.0;
+
+/**
+ * Deploy CloneableWallet minimal proxies to addresses known before the deployment is mined.
+ *
+ * Uses CREATE2 (EIP-1014), which needs a Constantinople chain and solc 0.5,
+ * so this is compiled separately from contracts/. See bin/build-sol.bash.
+ *
+ * The salt is bound to the calling account. Somebody watching the mempool
+ * cannot deploy a wallet to an address we have reserved for a user
+ * and become its owner.
+ */
+
+
+interface ICloneableWallet {
+    function init(address _owner) external;
+}
+
+
+contract DeterministicWalletFactory {
+
+    event WalletCreated(address wallet, bytes32 salt);
+
+    // CloneableWallet all proxies delegate to
+    address public implementation;
+
+    constructor(address _implementation) public {
+        implementation = _implementation;
+    }
+
+    /**
+     * Create a wallet to an address known beforehand.
+     */
+    function createWalletDeterministic(bytes32 _salt) external {
+        address wallet = clone(_salt);
+        ICloneableWallet(wallet).init(msg.sender);
+        emit WalletCreated(wallet, _salt);
+    }
+
+    /**
+     * Create a number of wallets to addresses known beforehand.
+     */
+    function createWalletsDeterministic(bytes32[] calldata _salts) external {
+        for(uint i = 0; i < _salts.length; i++) {
+            address wallet = clone(_salts[i]);
+            ICloneableWallet(wallet).init(msg.sender);
+            emit WalletCreated(wallet, _salts[i]);
+        }
+    }
+
+    /**
+     * CREATE2 salt used when _sender asks a wallet for _salt.
+     */
+    function getEffectiveSalt(address _sender, bytes32 _salt) public pure returns (bytes32) {
+        return keccak256(abi.encodePacked(_sender, _salt));
+    }
+
+    /**
+     * Where createWalletDeterministic() called by _sender will place a wallet for a given salt.
+     */
+    function computeAddress(address _sender, bytes32 _salt) external view returns (address) {
+        bytes32 codeHash = keccak256(abi.encodePacked(
+            hex"3d602d80600a3d3981f3363d3d373d3d3d363d73",
+            implementation,
+            hex"5af43d82803e903d91602b57fd5bf3"));
+        bytes32 digest = keccak256(abi.encodePacked(byte(0xff), address(this), getEffectiveSalt(_sender, _salt), codeHash));
+        return address(uint160(uint256(digest)));
+    }
+
+    function clone(bytes32 _salt) internal returns (address result) {
+        bytes32 salt = getEffectiveSalt(msg.sender, _salt);
+        address target = implementation;
+        assembly {
+            let code := mload(0x40)
+            mstore(code, 0x3d602d80600a3d3981f3363d3d373d3d3d363d73000000000000000000000000)
+            mstore(add(code, 0x14), mul(target, 0x1000000000000000000000000))
+            mstore(add(code, 0x28), 0x5af43d82803e903d91602b57fd5bf30000000000000000000000000000000000)
+            result := create2(0, code, 0x37, salt)
+        }
+        require(result != address(0), "Salt already used");
+    }
+}
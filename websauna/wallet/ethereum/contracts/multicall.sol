@@ -0,0 +1,76 @@
+/**
+ * Aggregate results from many constant function calls into one eth_call.
+ *
+ * Used to read token balances, wallet owners and ETH balances of all hosted
+ * addresses without doing one JSON-RPC roundtrip per address.
+ *
+ * Based on https://github.com/makerdao/multicall but written for the same
+ * compiler as the other contracts, which has neither ABI encoder v2 nor
+ * returndatasize. Call data of all calls is passed concatenated and the
+ * caller tells how many bytes of output it reserves for each call. Results
+ * are copied back to back to these reserved slots in returnData.
+ */
+contract Multicall {
+
+    /**
+     * Perform all calls and return their raw ABI encoded results.
+     *
+     * Throws if any of the calls fails or goes to an address without code,
+     * so the caller never gets partial results.
+     */
+    function aggregate(address[] targets, bytes callData, uint256[] callDataLengths, uint256[] returnSizes) constant returns (uint256 blockNumber, bytes returnData) {
+        uint256 i;
+        uint256 inPtr;
+        uint256 outPtr;
+
+        if(targets.length != callDataLengths.length || targets.length != returnSizes.length) {
+            throw;
+        }
+
+        for(i = 0; i < targets.length; i++) {
+            inPtr += callDataLengths[i];
+            outPtr += returnSizes[i];
+        }
+
+        if(inPtr != callData.length) {
+            throw;
+        }
+
+        blockNumber = block.number;
+        returnData = new bytes(outPtr);
+
+        // Point to the contents of the byte arrays
+        assembly {
+            inPtr := add(callData, 0x20)
+            outPtr := add(returnData, 0x20)
+        }
+
+        for(i = 0; i < targets.length; i++) {
+            if(!callInto(targets[i], inPtr, callDataLengths[i], outPtr, returnSizes[i])) {
+                throw;
+            }
+            inPtr += callDataLengths[i];
+            outPtr += returnSizes[i];
+        }
+    }
+
+    /**
+     * Call target and write at most outSize bytes of its return data to outPtr.
+     */
+    function callInto(address target, uint256 inPtr, uint256 inSize, uint256 outPtr, uint256 outSize) internal returns (bool success) {
+        assembly {
+            success := and(gt(extcodesize(target), 0), call(gas, target, 0, inPtr, inSize, outPtr, outSize))
+        }
+    }
+
+    /**
+     * Read ETH balance of an address as a call, so it can be part of aggregate().
+     */
+    function getEthBalance(address addr) constant returns (uint256 balance) {
+        balance = addr.balance;
+    }
+
+    function getBlockNumber() constant returns (uint256 blockNumber) {
+        blockNumber = block.number;
+    }
+}
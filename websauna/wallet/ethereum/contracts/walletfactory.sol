@@ -0,0 +1,200 @@
+/**
+ * Cheap hosted wallet deployment using EIP-1167 minimal proxies.
+ *
+ * Instead of deploying the full wallet bytecode for every user, we deploy
+ * one CloneableWallet implementation and then stamp out 45 byte proxy
+ * contracts pointing to it. Proxies delegatecall everything to the implementation,
+ * so events are emitted with the proxy address and the existing
+ * wallet listeners pick them up unchanged.
+ *
+ * https://eips.ethereum.org/EIPS/eip-1167
+ */
+
+
+/**
+ * Wallet2 compatible hosted wallet that can live behind a minimal proxy.
+ *
+ * Proxies do not run constructors, so the owner is set by init().
+ */
+contract CloneableWallet {
+
+    // Withdraw events
+    event Deposit(address from, uint value);
+    event Withdraw(address to, uint value);
+    event ExceededWithdraw(address to, uint value);
+    event OutOfGasWithdraw(address to, uint value);
+
+    // Smart contract call events
+    event Execute(address to, uint value);
+    event ExceededExecuteWithValue(address to, uint value);
+    event FailedExecute(address to, uint value);
+    event NoMatchingFunction();
+
+    // Transaction fee settlement log keeping
+    event ClaimFee(bytes32 txid, uint value);
+    event ExceededClaimFee(bytes32 txid, uint value);
+
+    // Who is the owner of this hosted wallet. This is the (coinbase) address or geth node
+    // that your server speaks to via RPC
+    address public owner;
+
+    function CloneableWallet() {
+        // Lock down the implementation contract itself,
+        // so nobody can claim it by calling init()
+        owner = msg.sender;
+    }
+
+    /**
+     * Set the owner of a freshly cloned wallet. Can be called only once.
+     */
+    function init(address _owner) external {
+        if(owner != 0) {
+            throw;
+        }
+        owner = _owner;
+    }
+
+    /**
+     * Proxy storage is empty, so version cannot be a storage variable.
+     */
+    function version() constant returns (string) {
+        return "2.0";
+    }
+
+    /**
+     * Simple withdrawal operation.
+     */
+    function withdraw(address _to, uint _value, uint _gas) external {
+        bool success;
+
+        if(msg.sender != owner) {
+            throw;
+        }
+
+        if(_value > this.balance) {
+            ExceededWithdraw(_to, _value);
+            return;
+        }
+
+        if(_gas > 0) {
+            success = _to.call.value(_value)();
+        } else {
+            success = _to.send(_value);
+        }
+
+        if(success) {
+            Withdraw(_to, _value);
+        } else {
+            OutOfGasWithdraw(_to, _value);
+        }
+    }
+
+    /**
+     * Executes a transaction from this wallet.
+     */
+    function execute(address _to, uint _value, uint _gas, bytes _data) payable external {
+        bool success;
+
+        if(msg.sender != owner) {
+            throw;
+        }
+
+        if(_value > this.balance) {
+            ExceededExecuteWithValue(_to, _value);
+            return;
+        }
+
+        if(_value > 0) {
+            success = _to.call.value(_value)(_data);
+        } else {
+            success = _to.call(_data);
+        }
+
+        if(success) {
+            Execute(_to, _value);
+        } else {
+            FailedExecute(_to, _value);
+        }
+    }
+
+    /**
+     * Claim transaction fees from the previous execute().
+     */
+    function claimFees(bytes32 txid, uint _value) {
+        bool success;
+
+        if(msg.sender != owner) {
+            throw;
+        }
+
+        if(_value > this.balance) {
+            ExceededClaimFee(txid, _value);
+            return;
+        }
+
+        success = owner.send(_value);
+
+        if(success) {
+            ClaimFee(txid, _value);
+        } else {
+            ExceededClaimFee(txid, _value);
+        }
+    }
+
+    /**
+     * Somebody sends ETH to this contract address
+     */
+    function() external payable {
+        if (msg.value > 0) {
+            Deposit(msg.sender, msg.value);
+        } else {
+            NoMatchingFunction();
+        }
+    }
+}
+
+
+/**
+ * Deploy minimal proxies pointing to a CloneableWallet.
+ *
+ * Every created wallet is owned by the account calling the factory (geth coinbase).
+ *
+ * Deterministic (CREATE2) deployment needs a newer compiler and lives in
+ * contracts-create2/deterministicwalletfactory.sol.
+ */
+contract WalletFactory {
+
+    event WalletCreated(address wallet, bytes32 salt);
+
+    // CloneableWallet all proxies delegate to
+    address public implementation;
+
+    function WalletFactory(address _implementation) {
+        implementation = _implementation;
+    }
+
+    /**
+     * Create a number of wallets in one transaction.
+     */
+    function createWallets(uint _count) external {
+        for(uint i = 0; i < _count; i++) {
+            address wallet = clone();
+            CloneableWallet(wallet).init(msg.sender);
+            WalletCreated(wallet, 0);
+        }
+    }
+
+    function clone() internal returns (address result) {
+        address target = implementation;
+        assembly {
+            let code := mload(0x40)
+            mstore(code, 0x3d602d80600a3d3981f3363d3d373d3d3d363d73000000000000000000000000)
+            mstore(add(code, 0x14), mul(target, 0x1000000000000000000000000))
+            mstore(add(code, 0x28), 0x5af43d82803e903d91602b57fd5bf30000000000000000000000000000000000)
+            result := create(0, code, 0x37)
+        }
+        if(result == 0) {
+            throw;
+        }
+    }
+}
@@ -1,5 +1,5 @@
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List
 
 from web3 import Web3
 from web3.contract import construct_contract_factory
@@ -56,15 +56,23 @@ class ContractWrapper:
         return cls(instance)
 
     @classmethod
-    def create(cls, web3: Web3, wait_for_tx_seconds=180, gas=1500000, args=None, contract_name=None) -> "ContractWrapper":
+    def create(cls, web3: Web3, wait_for_tx_seconds=180, gas=1500000, args=None, contract_name=None, factory=None, salt: Optional[bytes]=None) -> "ContractWrapper":
         """Creates a new hosted wallet.
 
         The cost of deployment is paid from coinbase account.
 
         :param contract_factory: Which contract we deploy as Populus Contract class. Function that retunrns new Contract instance.
 
+        :param factory: Optional :py:class:`websauna.wallet.ethereum.walletfactory.WalletFactory`. If given, deploy a cheap minimal proxy clone instead of the full contract bytecode.
+
+        :param salt: 32 bytes. If given, factory must be :py:class:`websauna.wallet.ethereum.walletfactory.DeterministicWalletFactory` and the clone is deployed to a deterministic address.
+
         :return: Populus Contract proxy object for new contract
         """
+
+        if factory:
+            return cls.create_clones(web3, factory, salts=[salt] if salt else None, count=1, wait_for_tx_seconds=wait_for_tx_seconds, contract_name=contract_name)[0]
+
         abi_data = cls.abi_factory(contract_name)
 
         if not args:
@@ -75,6 +83,27 @@ class ContractWrapper:
         # Use hardcoded version for now
         return cls(contract, version=2, initial_txid=txid)
 
+    @classmethod
+    def create_clones(cls, web3: Web3, factory, count=1, salts: Optional[List[bytes]]=None, wait_for_tx_seconds=180, contract_name=None) -> List["ContractWrapper"]:
+        """Deploy many minimal proxy clones in one transaction.
+
+        :param factory: :py:class:`websauna.wallet.ethereum.walletfactory.WalletFactory` used to deploy
+        :param count: How many clones to create
+        :param salts: Deploy to deterministic addresses through :py:class:`websauna.wallet.ethereum.walletfactory.DeterministicWalletFactory`, one clone per salt. Overrides count.
+        :return: List of wrappers, sharing the same initial_txid
+        :raise websauna.wallet.ethereum.walletfactory.WalletFactoryError: If the factory transaction failed
+        """
+
+        if salts:
+            txid, addresses = factory.create_wallets_deterministic(salts, wait_for_tx_seconds=wait_for_tx_seconds)
+        else:
+            txid, addresses = factory.create_wallets(count, wait_for_tx_seconds=wait_for_tx_seconds)
+
+        contract_class = cls.contract_class(web3, contract_name)
+
+        # Use hardcoded version for now
+        return [cls(contract_class(address=address), version=2, initial_txid=txid) for address in addresses]
+
     @property
     def address(self) -> str:
         """Get wallet address as 0x hex string."""
@@ -89,6 +118,16 @@ class ContractWrapper:
         """Gets the balance on this contract address over RPC and converts to ETH."""
         return wei_to_eth(self.web3.eth.getBalance(self.address))
 
+    @classmethod
+    def get_balances(cls, wrappers: List["ContractWrapper"], multicall=None) -> List[Decimal]:
+        """Get ETH balances of many contracts.
+
+        :param multicall: :class:`websauna.wallet.ethereum.multicall.Multicall` to read all balances with as few eth_calls as possible. Without it we do one getBalance() per contract.
+        """
+        if multicall:
+            return [wei_to_eth(b) for b in multicall.get_eth_balances([w.address for w in wrappers])]
+        return [w.get_balance() for w in wrappers]
+
     def get_all_events(self):
         """Helper to map getTransactionReceipt() logs to human readable."""
         events = get_contract_events(self.contract)
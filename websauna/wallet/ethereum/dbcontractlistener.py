@@ -15,7 +15,6 @@ from websauna.wallet.events import IncomingCryptoDeposit
 from websauna.wallet.models import CryptoAddress
 from websauna.wallet.models import CryptoOperation
 from websauna.wallet.models import CryptoAddressDeposit
-from websauna.wallet.models import Account
 from websauna.wallet.models import AssetNetwork
 from websauna.wallet.models import Asset
 from websauna.wallet.models.blockchain import CryptoOperationType
@@ -246,7 +245,7 @@ class EthWalletListener(DatabaseContractListener):
     def on_deposit(self, address: CryptoAddress, opid, log_data, log_entry) -> CryptoAddressDeposit:
         """Handle Hosted Wallet Deposit event.
 
-        Create incoming holding account holding the ETH assets until we receive enough confirmations.
+        Hold the incoming ETH assets in escrow until we receive enough confirmations.
         """
 
         op = CryptoAddressDeposit(address.network)
@@ -257,16 +256,12 @@ class EthWalletListener(DatabaseContractListener):
         op.crypto_account = crypto_account
 
         op.external_address = eth_address_to_bin(log_data["from"])
+        self.dbsession.add(op)
 
-        # Create holding account that keeps the value until we receive N amount of confirmations
-        acc = Account(asset=asset)
-        self.dbsession.add(acc)
-        self.dbsession.flush()
-
+        # Keep the value in escrow until we receive N amount of confirmations
         value = wei_to_eth(log_data["value"])
-        acc.do_withdraw_or_deposit(value, "ETH deposit from {} in tx {}".format(log_data["from"], log_entry["transactionHash"]))
+        op.hold(asset, value, "ETH deposit from {} in tx {}".format(log_data["from"], log_entry["transactionHash"]))
 
-        op.holding_account = acc
         return op
 
     def on_failedeexcute(self, address: CryptoAddress, opid, log_data, log_entry) -> CryptoAddressDeposit:
@@ -325,16 +320,11 @@ class EthTokenListener(DatabaseContractListener):
             op.block = int(log_entry["blockNumber"], 16)
             op.required_confirmation_count = self.confirmation_count
             op.crypto_account = address.get_or_create_account(asset)
-
-            # Create holding account that keeps the value until we receive N amount of confirmations
-            acc = Account(asset=asset)
-            self.dbsession.add(acc)
-            self.dbsession.flush()
-
-            acc.do_withdraw_or_deposit(value, "Token {} deposit from {} in tx {}".format(asset.symbol, log_data["from"], log_entry["transactionHash"]))
-            op.holding_account = acc
             self.dbsession.add(op)
 
+            # Keep the value in escrow until we receive N amount of confirmations
+            op.hold(asset, value, "Token {} deposit from {} in tx {}".format(asset.symbol, log_data["from"], log_entry["transactionHash"]))
+
             self.notify_deposit(op)
 
             return True
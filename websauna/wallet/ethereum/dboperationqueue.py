@@ -1,11 +1,13 @@
 import logging
 import threading
-from typing import List, Tuple
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from uuid import UUID
 
 import transaction
 from pyramid import registry
 from pyramid.registry import Registry
+from sqlalchemy import func, or_
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.instrumentation import instance_state
 from web3 import Web3
@@ -13,7 +15,7 @@ from web3 import Web3
 from websauna.system.model.retry import retryable
 from websauna.utils.time import now
 from websauna.wallet.ethereum.interfaces import IOperationPerformer
-from websauna.wallet.ethereum.ops import get_eth_operations
+from websauna.wallet.ethereum.ops import get_eth_operations, RESUMABLE_OPERATIONS
 from websauna.wallet.events import CryptoOperationPerformed
 from websauna.wallet.models import CryptoOperation
 from websauna.wallet.models import CryptoOperationState
@@ -22,6 +24,83 @@ from websauna.wallet.models.blockchain import CryptoOperationType
 logger = logging.getLogger(__name__)
 
 
+#: How many times we try to perform an operation before giving up and moving it to dead letter state
+DEFAULT_MAX_ATTEMPTS = 8
+
+#: Retry delay after the first failure, seconds. Doubles on every failed attempt.
+DEFAULT_RETRY_BASE_SECONDS = 10
+
+#: Upper bound for retry delay, seconds
+DEFAULT_RETRY_MAX_SECONDS = 3600
+
+#: How long we may start new operations from time limited lanes in one event cycle, seconds
+DEFAULT_CYCLE_SECONDS = 20
+
+#: Operations which count against their lane budget: started, but not yet confirmed by the network
+IN_FLIGHT_OPERATION_STATES = (CryptoOperationState.pending, CryptoOperationState.broadcasted)
+
+
+class OperationLane:
+    """A priority class of operations.
+
+    Lanes are run in priority order and the next operation is picked again after every performed operation, so latency sensitive operations queued in the middle of a cycle do not wait behind bulk work queued earlier. Each lane has a budget of how many of its operations may be in flight at the same time.
+    """
+
+    def __init__(self, name: str, operation_types: Tuple[CryptoOperationType], budget: int, time_limited=True):
+        """
+        :param budget: Max operations of this lane started, but not yet confirmed by the network
+        :param time_limited: Stop starting operations from this lane when the cycle time budget is spent
+        """
+        self.name = name
+        self.operation_types = tuple(operation_types)
+        self.budget = budget
+        self.time_limited = time_limited
+
+    def __str__(self):
+        return "<Lane {} budget:{}>".format(self.name, self.budget)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def get_default_lanes() -> List[OperationLane]:
+    """User facing money movement first, address creation next, bulk jobs last."""
+    return [
+        OperationLane("urgent", (CryptoOperationType.withdraw, CryptoOperationType.deposit, CryptoOperationType.transaction), budget=50, time_limited=False),
+        OperationLane("normal", (CryptoOperationType.create_address, CryptoOperationType.address, CryptoOperationType.create_token), budget=10),
+        OperationLane("bulk", (CryptoOperationType.import_token,), budget=1),
+    ]
+
+
+def _parse_pairs(value: str) -> Dict[str, str]:
+    """Parse ``key:value key:value`` setting."""
+    if not value:
+        return {}
+    return dict(pair.split(":", 1) for pair in value.split())
+
+
+def get_configured_lanes(settings: dict) -> List[OperationLane]:
+    """Build lanes from INI settings.
+
+    * ``ethereum.operation_lanes`` moves operation types to other lanes, e.g. ``create_address:urgent import_token:bulk``
+
+    * ``ethereum.operation_lane_budgets`` overrides lane budgets, e.g. ``urgent:100 bulk:2``
+    """
+    lanes = get_default_lanes()
+    lanes_by_name = {lane.name: lane for lane in lanes}
+
+    for op_type_name, lane_name in _parse_pairs(settings.get("ethereum.operation_lanes")).items():
+        op_type = CryptoOperationType(op_type_name)
+        for lane in lanes:
+            lane.operation_types = tuple(t for t in lane.operation_types if t != op_type)
+        lanes_by_name[lane_name].operation_types += (op_type,)
+
+    for lane_name, budget in _parse_pairs(settings.get("ethereum.operation_lane_budgets")).items():
+        lanes_by_name[lane_name].budget = int(budget)
+
+    return lanes
+
+
 class OperationQueueManager:
     """Run waiting operatins created in a web interface in a separate proces."""
 
@@ -34,24 +113,77 @@ class OperationQueueManager:
         self.registry = registry
         self.tm = self.dbsession.transaction_manager
 
+        settings = registry.settings or {}
+        self.max_attempts = int(settings.get("ethereum.operation_max_attempts", DEFAULT_MAX_ATTEMPTS))
+        self.retry_base_seconds = float(settings.get("ethereum.operation_retry_base_seconds", DEFAULT_RETRY_BASE_SECONDS))
+        self.retry_max_seconds = float(settings.get("ethereum.operation_retry_max_seconds", DEFAULT_RETRY_MAX_SECONDS))
+        self.cycle_seconds = float(settings.get("ethereum.operation_cycle_seconds", DEFAULT_CYCLE_SECONDS))
+        self.lanes = get_configured_lanes(settings)
+
     def _get_tm(*args, **kargs):
         """Get transaction manager needed to transaction retry."""
         self = args[0]
         return self.tm
 
+    def get_in_flight_counts(self) -> Dict[str, int]:
+        """How many operations each lane has started, but which are not yet confirmed by the network.
+
+        Must be called inside a transaction.
+        """
+        q = self.dbsession.query(CryptoOperation.operation_type, func.count(CryptoOperation.id)).filter_by(network_id=self.asset_network_id)
+        q = q.filter(CryptoOperation.state.in_(IN_FLIGHT_OPERATION_STATES))
+        q = q.group_by(CryptoOperation.operation_type)
+
+        counts = {}
+        for op_type, count in q:
+            for lane in self.lanes:
+                if op_type in lane.operation_types:
+                    counts[lane.name] = counts.get(lane.name, 0) + count
+        return counts
+
     @retryable(get_tm=_get_tm)
-    def get_waiting_operation_ids(self) -> List[Tuple[UUID, CryptoOperationType]]:
+    def get_waiting_operation_ids(self, lanes: Optional[List[OperationLane]]=None, exclude: Iterable[UUID]=(), first=False) -> List[Tuple[UUID, CryptoOperationType]]:
         """Get list of operations we need to attempt to perform.
 
+        Operations come in lane priority order, oldest first within a lane. A lane gives out only as many operations as it has budget left after its operations already in flight. Operations which failed earlier are skipped until their retry time is due.
+
         Perform as one transaction.
+
+        :param lanes: Only look into these lanes. Default to all lanes.
+        :param exclude: Operation ids not to return, e.g. the ones already attempted in this cycle
+        :param first: Return only the operation that should be run next
         """
 
-        wait_list = self.dbsession.query(CryptoOperation, CryptoOperation.id, CryptoOperation.state, CryptoOperation.operation_type).filter_by(network_id=self.asset_network_id, state=CryptoOperationState.waiting)
+        wait_list = []
+        exclude = list(exclude)
+        in_flight = self.get_in_flight_counts()
+
+        for lane in lanes if lanes is not None else self.lanes:
+            slots = lane.budget - in_flight.get(lane.name, 0)
+            if not lane.operation_types or slots <= 0:
+                continue
+
+            q = self.dbsession.query(CryptoOperation.id, CryptoOperation.operation_type).filter_by(network_id=self.asset_network_id, state=CryptoOperationState.waiting)
+            q = q.filter(CryptoOperation.operation_type.in_(lane.operation_types))
+            q = q.filter(or_(CryptoOperation.next_attempt_at == None, CryptoOperation.next_attempt_at <= now()))
+            if exclude:
+                q = q.filter(~CryptoOperation.id.in_(exclude))
+            q = q.order_by(CryptoOperation.created_at).limit(1 if first else slots)
+
+            # Flatten
+            wait_list += [(o.id, o.operation_type) for o in q]
+
+            if first and wait_list:
+                break
 
-        # Flatten
-        wait_list = [(o.id, o.operation_type) for o in wait_list]
         return wait_list
 
+    def get_lane(self, op_type: CryptoOperationType) -> OperationLane:
+        for lane in self.lanes:
+            if op_type in lane.operation_types:
+                return lane
+        raise RuntimeError("Operation type {} not in any lane".format(op_type))
+
     @retryable(get_tm=_get_tm)
     def notify_op_performed(self, opid):
         # Post the event completion info
@@ -59,12 +191,39 @@ class OperationQueueManager:
         self.registry.notify(CryptoOperationPerformed(op, self.registry, self.web3))
         logger.info("Operationg success: %s", op)
 
+    @retryable(get_tm=_get_tm)
+    def schedule_retry(self, opid: UUID, e: Exception):
+        """Record a failed attempt to perform an operation."""
+        op = self.dbsession.query(CryptoOperation).get(opid)
+
+        if op.state != CryptoOperationState.waiting:
+            # The performer got the operation past the point of no return (e.g. broadcasted) or marked it failed itself. Don't run it again.
+            logger.warning("Operation %s failed in state %s, not rescheduling", opid, op.state)
+            return
+
+        op.schedule_retry(str(e), self.max_attempts, self.retry_base_seconds, self.retry_max_seconds)
+
+        if op.state == CryptoOperationState.dead_letter:
+            logger.error("Operation %s gave up after %d attempts", opid, op.attempts)
+        else:
+            logger.info("Operation %s attempt %d failed, retrying at %s", opid, op.attempts, op.next_attempt_at)
+
     def get_eth_operations(self, registry):
         op_map = get_eth_operations(self.registry)
         return op_map
 
-    def run_op(self, op_type: CryptoOperationType, opid: UUID):
-        """Run a performer for a single operation."""
+    @retryable(get_tm=_get_tm)
+    def is_waiting(self, opid: UUID) -> bool:
+        op = self.dbsession.query(CryptoOperation).get(opid)
+        return op.state == CryptoOperationState.waiting
+
+    def run_op(self, op_type: CryptoOperationType, opid: UUID, should_yield: Optional[Callable[[], bool]]=None) -> bool:
+        """Run a performer for a single operation.
+
+        :param should_yield: Passed to performers of :data:`websauna.wallet.ethereum.ops.RESUMABLE_OPERATIONS`. They call it between their steps and stop early, leaving the operation waiting, when it returns true.
+
+        :return: False if the performer yielded before finishing the operation
+        """
 
         # Get a function to perform the op using adapters
         op_map = self.get_eth_operations(self.registry)
@@ -74,32 +233,72 @@ class OperationQueueManager:
 
         logger.info("Running op: %s %s", op_type, opid)
         # Do the actual operation
-        performer(self.web3, self.dbsession, opid)
+        if op_type in RESUMABLE_OPERATIONS and should_yield:
+            performer(self.web3, self.dbsession, opid, should_yield=should_yield)
+            if self.is_waiting(opid):
+                logger.info("Operation %s yielded, continuing later", opid)
+                return False
+        else:
+            performer(self.web3, self.dbsession, opid)
 
         self.notify_op_performed(opid)
+        return True
 
     def run_waiting_operations(self) -> Tuple[int, int]:
         """Run all operations that are waiting to be executed.
 
+        After every operation we pick the next one again in lane priority order, so an operation queued to a higher priority lane during the cycle is run before the rest of the lower priority work. Each operation is attempted at most once per cycle.
+
+        A failing operation does not stop the queue. It is rescheduled with :meth:`schedule_retry` and we continue with the next one.
+
+        Once the cycle time budget ``ethereum.operation_cycle_seconds`` is spent we stop starting operations from time limited lanes. They are picked up on the next cycle. Resumable operations, like a long token import, stop between their chunks when the time budget is spent or when a higher priority lane has work.
+
         :return: Number of operations (performed successfully, failed)
         """
 
         success_count = 0
         failure_count = 0
 
-        ops = self.get_waiting_operation_ids()
+        deadline = time.time() + self.cycle_seconds
+        attempted = set()
+
+        while True:
+
+            if time.time() > deadline:
+                lanes = [lane for lane in self.lanes if not lane.time_limited]
+            else:
+                lanes = self.lanes
+
+            ops = self.get_waiting_operation_ids(lanes, exclude=attempted, first=True)
+            if not ops:
+                break
 
-        if ops:
-            logger.info("%s operations in the queue", len(ops))
+            opid, op_type = ops[0]
+            attempted.add(opid)
+
+            lane = self.get_lane(op_type)
+            higher_lanes = self.lanes[:self.lanes.index(lane)]
+
+            def should_yield():
+                if lane.time_limited and time.time() > deadline:
+                    return True
+                return bool(higher_lanes and self.get_waiting_operation_ids(higher_lanes, exclude=attempted, first=True))
 
-        for opid, op_type in ops:
             try:
-                self.run_op(op_type, opid)
-                success_count += 1
+                if self.run_op(op_type, opid, should_yield):
+                    success_count += 1
+                else:
+                    # Let the yielded operation continue later in this cycle, after the higher priority work
+                    attempted.discard(opid)
             except Exception as e:
                 failure_count += 1
                 logger.error("Crypto operation failure %s", e)
                 logger.exception(e)
-                raise
+                self.schedule_retry(opid, e)
+
+        if time.time() > deadline:
+            deferred = self.get_waiting_operation_ids([lane for lane in self.lanes if lane.time_limited], exclude=attempted)
+            if deferred:
+                logger.info("Cycle time budget spent, deferred %d operations to the next cycle", len(deferred))
 
-        return success_count, failure_count
\ No newline at end of file
+        return success_count, failure_count
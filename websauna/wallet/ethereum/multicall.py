@@ -0,0 +1,201 @@
+"""Batch many constant contract calls into one eth_call.
+
+Reading token balances, wallet owners and ETH balances of all hosted addresses one ``eth_call`` at a time is slow. ``Multicall`` contract (``contracts/multicall.sol``) performs a list of calls inside one ``eth_call`` and returns their raw results, which we decode with the contract ABIs we already have.
+
+The contract is built with the same old compiler as the other contracts, so it cannot return a ``bytes[]`` or read the size of the return data. Instead every call reserves a fixed number of output bytes (:attr:`Call.return_size`) and ``aggregate()`` returns all results back to back in one ``bytes``. Static outputs take 32 bytes each. A string, bytes or array output reserves :data:`MAX_DYNAMIC_RETURN` bytes for its content and longer results are reported as errors instead of being silently cut.
+"""
+import binascii
+import logging
+from typing import List, Iterable, Optional
+
+from web3.contract import Contract
+from web3.exceptions import BadFunctionCallOutput
+
+from websauna.wallet.ethereum.compiler import get_compiled_contract_cached
+from websauna.wallet.ethereum.contractwrapper import ContractWrapper
+from websauna.wallet.ethereum.decodeutils import decode_multi
+from websauna.wallet.ethereum.utils import bin_to_uint256
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Gas we assume a simple getter (balanceOf, owner) costs inside multicall
+DEFAULT_CALL_GAS = 30000
+
+#: Gas limit we give for one aggregate() eth_call. Calls are split to several eth_calls to stay under it.
+MAX_BATCH_GAS = 8000000
+
+#: Bytes reserved for the content of a dynamic output, like token name()
+MAX_DYNAMIC_RETURN = 256
+
+
+def is_dynamic_type(abi_type: str) -> bool:
+    return abi_type in ("string", "bytes") or abi_type.endswith("[]")
+
+
+class Call:
+    """One constant function call in a multicall batch."""
+
+    def __init__(self, contract: Contract, func: str, args: Optional[list]=None, gas=DEFAULT_CALL_GAS, return_size: Optional[int]=None):
+        """
+        :param contract: Address bound Populus contract we are calling
+        :param func: Function name
+        :param args: Function arguments
+        :param gas: Estimated gas usage, used to split batches
+        :param return_size: Bytes reserved for the return data. Calculated from the function outputs if not given.
+        """
+        args = args or []
+        self.target = contract.address
+        self.func = func
+        self.gas = gas
+
+        call_data = contract.encodeABI(func, args=args)
+        self.data = binascii.unhexlify(call_data[2:])
+
+        function_abi = [m for m in contract.abi if m["type"] == "function" and m["name"] == func and len(m["inputs"]) == len(args)]
+        assert len(function_abi) == 1, "Could not resolve ABI for {}({})".format(func, args)
+        self.output_types = [o["type"] for o in function_abi[0]["outputs"]]
+
+        if return_size is None:
+            # Head word of each output, plus length word and content of dynamic outputs
+            return_size = sum(32 + 32 + MAX_DYNAMIC_RETURN if is_dynamic_type(t) else 32 for t in self.output_types)
+        self.return_size = return_size
+
+    def __str__(self):
+        return "<Call {} on {}>".format(self.func, self.target)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def check_fits(self, data: bytes):
+        """Check that dynamic outputs were not cut to the reserved return size.
+
+        :raise BadFunctionCallOutput: If a result is longer than what we reserved for it
+        """
+        for i, abi_type in enumerate(self.output_types):
+            if not is_dynamic_type(abi_type):
+                continue
+
+            offset = bin_to_uint256(data[i * 32:i * 32 + 32])
+            length = bin_to_uint256(data[offset:offset + 32]) if offset + 32 <= len(data) else 0
+            size = length * 32 if abi_type.endswith("[]") else length
+            if offset + 32 + size > len(data):
+                raise BadFunctionCallOutput("{} returned more than {} bytes reserved for it".format(self, self.return_size))
+
+    def decode(self, data: bytes):
+        """Decode raw return data using the function ABI.
+
+        :return: Single value if function has one output, otherwise a list
+        """
+        if not data:
+            raise BadFunctionCallOutput("{} returned no data".format(self))
+
+        self.check_fits(data)
+
+        result = decode_multi(self.output_types, "0x" + binascii.hexlify(data).decode("ascii"))
+        if len(self.output_types) == 1:
+            return result[0]
+        return result
+
+
+def encode_aggregate(contract: Contract, calls: List[Call]) -> str:
+    """ABI encode aggregate(address[],bytes,uint256[],uint256[]) call data.
+
+    :return: 0x hex string
+    """
+    return contract.encodeABI("aggregate", args=[
+        [call.target for call in calls],
+        b"".join(call.data for call in calls),
+        [len(call.data) for call in calls],
+        [call.return_size for call in calls],
+    ])
+
+
+def decode_aggregate(data: bytes, calls: List[Call]) -> tuple:
+    """Decode (uint256 blockNumber, bytes returnData) returned by aggregate().
+
+    :return: tuple(block number, list of raw return data bytes, one per call)
+    """
+    block_number, return_data = decode_multi(["uint256", "bytes"], "0x" + binascii.hexlify(data).decode("ascii"))
+
+    results = []
+    pos = 0
+    for call in calls:
+        results.append(return_data[pos:pos + call.return_size])
+        pos += call.return_size
+
+    if pos != len(return_data):
+        raise BadFunctionCallOutput("Multicall returned {} bytes, expected {}".format(len(return_data), pos))
+
+    return block_number, results
+
+
+def split_by_gas(calls: List[Call], gas_limit=MAX_BATCH_GAS) -> Iterable[List[Call]]:
+    """Split calls to chunks that each fit in one eth_call gas limit."""
+    chunk = []
+    gas = 0
+    for call in calls:
+        if chunk and gas + call.gas > gas_limit:
+            yield chunk
+            chunk = []
+            gas = 0
+        chunk.append(call)
+        gas += call.gas
+
+    if chunk:
+        yield chunk
+
+
+class Multicall(ContractWrapper):
+    """Proxy object for a deployed Multicall aggregator contract."""
+
+    @classmethod
+    def abi_factory(cls, contract_name=None):
+        contract_name = contract_name or "Multicall"
+        contract_meta = get_compiled_contract_cached(contract_name)
+        return contract_meta
+
+    def aggregate(self, calls: List[Call], gas_limit=MAX_BATCH_GAS) -> list:
+        """Perform all calls using as few eth_calls as gas limit allows.
+
+        :return: Decoded results in the same order as calls
+        :raise BadFunctionCallOutput: If any of the calls failed
+        """
+        results = []
+
+        for chunk in split_by_gas(calls, gas_limit):
+            raw = self.web3.eth.call({"to": self.address, "data": encode_aggregate(self.contract, chunk), "gas": gas_limit})
+
+            if raw in ("0x", "", None):
+                # aggregate() throws if any of the calls throws
+                raise BadFunctionCallOutput("Multicall failed for a batch of {} calls starting {}".format(len(chunk), chunk[0]))
+
+            block_number, return_data = decode_aggregate(binascii.unhexlify(raw[2:]), chunk)
+            for call, data in zip(chunk, return_data):
+                results.append(call.decode(data))
+
+        return results
+
+    def get_eth_balance_call(self, address: str) -> Call:
+        return Call(self.contract, "getEthBalance", [address])
+
+    def get_eth_balances(self, addresses: List[str]) -> List[int]:
+        """Read ETH balances in wei for many addresses."""
+        return self.aggregate([self.get_eth_balance_call(a) for a in addresses])
+
+    def get_token_balances(self, token: Contract, addresses: List[str]) -> List[int]:
+        """Read raw token balanceOf() for many addresses."""
+        return self.aggregate([Call(token, "balanceOf", [a]) for a in addresses])
+
+    def get_owners(self, wallets: List[Contract]) -> List[str]:
+        """Read owner() of many hosted wallets."""
+        return self.aggregate([Call(w, "owner") for w in wallets])
+
+    def get_token_details(self, token: Contract) -> tuple:
+        """Read name, symbol and total supply of a token in one go.
+
+        :return: tuple(name, symbol, total supply)
+        """
+        name, symbol, supply = self.aggregate([Call(token, "name"), Call(token, "symbol"), Call(token, "totalSupply")])
+        return name, symbol, supply
@@ -1,6 +1,7 @@
 """Interaction between geth and database."""
 from decimal import Decimal
 import logging
+from typing import Callable, List, Tuple, Optional
 from uuid import UUID
 
 from pyramid.registry import Registry
@@ -11,34 +12,65 @@ from web3.exceptions import BadFunctionCallOutput
 from websauna.system.model.retry import retryable
 
 from websauna.wallet.ethereum.asset import get_ether_asset
+from websauna.wallet.ethereum.multicall import Multicall
 from websauna.wallet.ethereum.token import Token
 from websauna.wallet.ethereum.utils import txid_to_bin, eth_address_to_bin, bin_to_eth_address, to_wei
 from websauna.wallet.ethereum.wallet import HostedWallet
-from websauna.wallet.models import AssetClass, CryptoAddress, CryptoOperation
+from websauna.wallet.ethereum.walletfactory import WalletFactory, DeterministicWalletFactory, uuid_to_salt, supports_create2
+from websauna.wallet.models import Account, Asset, AssetClass, CryptoAddress, CryptoOperation
 from websauna.wallet.models.blockchain import CryptoOperationType
 
 
 logger = logging.getLogger(__name__)
 
 
+#: How many hosted addresses we process per transaction when importing a token
+IMPORT_CHUNK_SIZE = 200
+
+#: Performers of these operations take ``should_yield`` callback and can stop in the middle, to be continued later
+RESUMABLE_OPERATIONS = (CryptoOperationType.import_token,)
+
+
 def create_address(web3: Web3, dbsession: Session, opid: UUID):
     """User requests new hosted address.
 
     We create a hosted wallet contract. The contract id is associated with the user in the database. We hold the the only owner address of the wallet.
 
     The wallet code is based on https://github.com/ethereum/meteor-dapp-wallet/blob/master/Wallet.sol
+
+    If the network has ``wallet_factory`` address set in its ``other_data``, we deploy a cheap minimal proxy clone through the factory instead of the full wallet contract. If ``wallet_factory_deterministic`` address is set and the chain supports CREATE2, the wallet address is calculated and stored before the deployment transaction is mined, so it can be shown to the user right away.
     """
 
     assert isinstance(opid, UUID)
 
+    @retryable(tm=dbsession.transaction_manager)
+    def get_factory_config():
+        op = dbsession.query(CryptoOperation).get(opid)
+        return op.network.other_data.get("wallet_factory"), op.network.other_data.get("wallet_factory_deterministic"), uuid_to_salt(op.address.id)
+
+    @retryable(tm=dbsession.transaction_manager)
+    def reserve_address(address: str):
+        op = dbsession.query(CryptoOperation).get(opid)
+        op.address.address = eth_address_to_bin(address)
+        op.external_address = op.address.address
+
     @retryable(tm=dbsession.transaction_manager)
     def finish_op():
         op = dbsession.query(CryptoOperation).get(opid)
         txid = wallet.initial_txid
-        receipt = web3.eth.getTransactionReceipt(txid)
 
-        op.txid = txid_to_bin(txid)
-        op.block = receipt["blockNumber"]
+        if op.address.address:
+            # Deterministic address was reserved beforehand
+            assert op.address.address == eth_address_to_bin(wallet.address), "CREATE2 address mismatch for {}".format(op)
+
+        if txid:
+            receipt = web3.eth.getTransactionReceipt(txid)
+            op.txid = txid_to_bin(txid)
+            op.block = receipt["blockNumber"]
+        else:
+            # An earlier attempt deployed the wallet, but did not get to store the transaction
+            op.block = web3.eth.blockNumber
+
         op.address.address = eth_address_to_bin(wallet.address)
         op.external_address = op.address.address
 
@@ -48,7 +80,29 @@ def create_address(web3: Web3, dbsession: Session, opid: UUID):
         op.mark_complete()
 
     logger.info("Starting wallet creation for %s", opid)
-    wallet = HostedWallet.create(web3)
+
+    factory_address, deterministic_factory_address, salt = get_factory_config()
+
+    if deterministic_factory_address and not supports_create2(web3):
+        logger.warning("Chain does not support CREATE2, cannot reserve address for %s", opid)
+        deterministic_factory_address = None
+
+    if deterministic_factory_address:
+        factory = DeterministicWalletFactory.get(web3, deterministic_factory_address)
+        address = factory.compute_address(salt)
+        reserve_address(address)
+        if factory.is_deployed(address):
+            # The factory refuses to use the same salt twice
+            logger.info("Wallet %s for %s was deployed by an earlier attempt", address, opid)
+            wallet = HostedWallet.get(web3, address)
+        else:
+            wallet = HostedWallet.create(web3, factory=factory, salt=salt)
+    elif factory_address:
+        factory = WalletFactory.get(web3, factory_address)
+        wallet = HostedWallet.create(web3, factory=factory)
+    else:
+        wallet = HostedWallet.create(web3)
+
     logger.info("Updating db for wallet creation for %s", opid)
     finish_op()
 
@@ -77,14 +131,14 @@ def withdraw_eth(web3: Web3, dbsession: Session, opid: UUID):
         assert op.crypto_account.id
         assert op.crypto_account.account.id
         assert op.holding_account.id
-        assert op.holding_account.get_balance() > 0
+        assert op.get_escrow_balance() > 0
         assert op.external_address
         assert op.required_confirmation_count  # Should be set by the creator
 
         address = bin_to_eth_address(op.crypto_account.address.address)
 
         # How much we are withdrawing
-        amount = op.holding_account.transactions.one().amount
+        amount = op.get_escrow_transactions().one().amount
         op.mark_performed()  # Don't pick this to action list anymore
 
         gas = op.other_data.get("gas")
@@ -119,7 +173,7 @@ def withdraw_token(web3: Web3, dbsession: Session, opid: UUID):
         assert op.crypto_account.id
         assert op.crypto_account.account.id
         assert op.holding_account.id
-        assert op.holding_account.get_balance() > 0
+        assert op.get_escrow_balance() > 0
         assert op.external_address
         assert op.required_confirmation_count  # Should be set by the creator
         asset = op.holding_account.asset
@@ -130,7 +184,7 @@ def withdraw_token(web3: Web3, dbsession: Session, opid: UUID):
         asset_address = bin_to_eth_address(asset.external_id)
 
         # How much we are withdrawing
-        amount = op.holding_account.transactions.one().amount
+        amount = op.get_escrow_transactions().one().amount
         op.mark_performed()  # Don't try to pick this op automatically again
         return from_address, to_address, asset_address, amount
 
@@ -214,61 +268,134 @@ def create_token(web3: Web3, dbsession: Session, opid: UUID):
 
     perform_tx()
 
-def import_token(web3: Web3, dbsession: Session, opid: UUID):
-    """Import existing token smart contract as asset."""
 
-    # TODO: split to smaller transactions
-    @retryable(tm=dbsession.transaction_manager)
-    def perform_tx():
-        op = dbsession.query(CryptoOperation).get(opid)
-        address = bin_to_eth_address(op.external_address)
-        token = Token.get(web3, address)
+def import_token(web3: Web3, dbsession: Session, opid: UUID, chunk_size=IMPORT_CHUNK_SIZE, should_yield: Optional[Callable[[], bool]]=None):
+    """Import existing token smart contract as asset.
 
-        network = op.network
+    Hosted address balances are read in chunks with batched ``balanceOf()`` calls and each chunk is committed in its own transaction. Progress is stored in ``op.other_data["import"]``, so if the service dies in the middle of the import the next run continues from the last committed chunk.
 
-        def gen_error(e: Exception):
-            # Set operation as impossible to complete
-            # Set user readable and technical error explanation
-            op.mark_failed()
-            op.other_data["error"] = "Address did not provide EIP-20 token API:" + address
-            op.other_data["exception"] = str(e)
-            logger.exception(e)
+    If ``should_yield`` returns true after a chunk we return and leave the operation waiting. The operation queue runs it again later and it continues from the last committed chunk.
 
-        try:
-            name = token.contract.call().name()
-            symbol = token.contract.call().symbol()
-            supply = Decimal(token.contract.call().totalSupply())
-        except BadFunctionCallOutput as e:
-            # When we try to access a contract attrib which is not supported by underlying code
-            gen_error(e)
-            return
+    If the network has a Multicall contract configured in ``other_data["multicall"]`` reads go through it, otherwise we use JSON-RPC batches.
+    """
 
+    @retryable(tm=dbsession.transaction_manager)
+    def get_progress() -> Tuple[str, dict, Optional[str]]:
+        op = dbsession.query(CryptoOperation).get(opid)
+        return bin_to_eth_address(op.external_address), dict(op.other_data.get("import") or {}), op.network.other_data.get("multicall")
+
+    @retryable(tm=dbsession.transaction_manager)
+    def gen_error(e: Exception):
+        # Set operation as impossible to complete
+        # Set user readable and technical error explanation
+        op = dbsession.query(CryptoOperation).get(opid)
+        op.mark_failed("Address did not provide EIP-20 token API:" + address)
+        op.other_data["exception"] = str(e)
+        logger.exception(e)
+
+    @retryable(tm=dbsession.transaction_manager)
+    def create_asset() -> dict:
+        op = dbsession.query(CryptoOperation).get(opid)
+        network = op.network
         asset = network.create_asset(name=name, symbol=symbol, supply=supply, asset_class=AssetClass.token)
         asset.external_id = op.external_address
 
-        # Fill in balances for the addresses we host
-        # TODO: Too much for one transaction
-        for caddress in dbsession.query(CryptoAddress).all():
+        total = dbsession.query(CryptoAddress).filter(CryptoAddress.network_id == network.id, CryptoAddress.address != None).count()
+
+        progress = {
+            "asset_id": str(asset.id),
+            "last_address_id": None,
+            "processed": 0,
+            "total": total,
+        }
+        op.other_data["import"] = progress
+        return dict(progress)
 
-            # Returns 0 for unknown addresses
-            try:
-                amount = token.contract.call().balanceOf(bin_to_eth_address(caddress.address))
-            except BadFunctionCallOutput as e:
-                # Bad contract doesn't define balanceOf()
-                # This leaves badly imported asset
-                gen_error(e)
-                return
+    @retryable(tm=dbsession.transaction_manager)
+    def fetch_chunk() -> List[Tuple[UUID, bytes]]:
+        op = dbsession.query(CryptoOperation).get(opid)
+        q = dbsession.query(CryptoAddress.id, CryptoAddress.address).filter(CryptoAddress.network_id == op.network_id, CryptoAddress.address != None)
+        if progress["last_address_id"]:
+            q = q.filter(CryptoAddress.id > UUID(progress["last_address_id"]))
+        return [(a.id, a.address) for a in q.order_by(CryptoAddress.id).limit(chunk_size)]
+
+    @retryable(tm=dbsession.transaction_manager)
+    def commit_chunk(chunk: List[Tuple[UUID, bytes]], balances: List[int]) -> dict:
+        op = dbsession.query(CryptoOperation).get(opid)
+        asset = dbsession.query(Asset).get(UUID(progress["asset_id"]))
 
+        legs = []
+        for (address_id, _), amount in zip(chunk, balances):
             if amount > 0:
+                caddress = dbsession.query(CryptoAddress).get(address_id)
                 account = caddress.get_or_create_account(asset)
-                account.account.do_withdraw_or_deposit(Decimal(amount), "Token contract import")
+                legs.append((None, account.account, Decimal(amount), "Token contract import"))
+
+        Account.post_batch(dbsession, legs)
+
+        # Progress is updated in the same transaction as balances, so we never import a chunk twice
+        updated = dict(progress)
+        updated["last_address_id"] = str(chunk[-1][0])
+        updated["processed"] = progress["processed"] + len(chunk)
+        op.other_data["import"] = updated
+        return updated
 
+    @retryable(tm=dbsession.transaction_manager)
+    def finish_op():
+        op = dbsession.query(CryptoOperation).get(opid)
         # This operation immediately closes
         op.mark_performed()
         op.mark_broadcasted()
         op.mark_complete()
 
-    perform_tx()
+    address, progress, multicall_address = get_progress()
+    token = Token.get(web3, address)
+    multicall = Multicall.get(web3, multicall_address) if multicall_address else None
+
+    if not progress:
+        try:
+            if multicall:
+                name, symbol, supply = multicall.get_token_details(token.contract)
+                supply = Decimal(supply)
+            else:
+                name = token.contract.call().name()
+                symbol = token.contract.call().symbol()
+                supply = Decimal(token.contract.call().totalSupply())
+        except BadFunctionCallOutput as e:
+            # When we try to access a contract attrib which is not supported by underlying code
+            gen_error(e)
+            return
+
+        progress = create_asset()
+    else:
+        logger.info("Resuming token import %s at %d/%d", opid, progress["processed"], progress["total"])
+
+    # Fill in balances for the addresses we host
+    while True:
+        chunk = fetch_chunk()
+        if not chunk:
+            break
+
+        # Read balances outside the database transaction
+        try:
+            addresses = [bin_to_eth_address(a) for _, a in chunk]
+            if multicall:
+                balances = multicall.get_token_balances(token.contract, addresses)
+            else:
+                balances = token.get_balances(addresses)
+        except BadFunctionCallOutput as e:
+            # Bad contract doesn't define balanceOf()
+            # This leaves badly imported asset
+            gen_error(e)
+            return
+
+        progress = commit_chunk(chunk, balances)
+        logger.info("Token import %s progress %d/%d", opid, progress["processed"], progress["total"])
+
+        if should_yield and should_yield():
+            return
+
+    finish_op()
 
 
 def get_eth_operations(registry: Registry):
@@ -1,11 +1,14 @@
 """Populus-related helper functions."""
+import contextlib
 import json
+from typing import List, Tuple
 
 from web3.utils.compat import Timeout
 from eth_client_utils import JSONRPCBaseClient
 
 from eth_rpc_client import Client
 from web3 import Web3
+from web3.providers.rpc import KeepAliveRPCProvider, RPCProvider
 from web3.utils.transactions import wait_for_transaction_receipt as _wait_for_transaction_receipt
 
 
@@ -52,4 +55,60 @@ def wait_for_transaction_receipt(web3, txn_hash, timeout=120):
         return _wait_for_transaction_receipt(web3, txn_hash, timeout)
     except Timeout as e:
         rpc = web3._requestManager.provider
-        raise RuntimeError("Transaction wait timeout: {}:{}".format(rpc.host, rpc.port)) from e
\ No newline at end of file
+        raise RuntimeError("Transaction wait timeout: {}:{}".format(rpc.host, rpc.port)) from e
+
+
+def _post_batch(provider: RPCProvider, body: bytes) -> bytes:
+    """Post a raw JSON-RPC payload using the HTTP connection settings of a provider."""
+    client = getattr(provider, "client", None)
+    if client is not None:
+        # KeepAliveRPCProvider pooled connection
+        return client.post(provider.path, body=body).read()
+
+    from geventhttpclient import HTTPClient
+    client = HTTPClient(host=provider.host, port=provider.port, ssl=provider.ssl, connection_timeout=provider.connection_timeout, network_timeout=provider.network_timeout, headers={"Content-Type": "application/json"})
+    with contextlib.closing(client):
+        return client.post(provider.path, body=body).read()
+
+
+def _decode_reply(reply) -> dict:
+    if isinstance(reply, bytes):
+        reply = reply.decode("utf-8")
+    if isinstance(reply, str):
+        reply = json.loads(reply)
+    return reply
+
+
+def make_batch_request(web3: Web3, calls: List[Tuple[str, list]]) -> list:
+    """Perform many JSON-RPC calls in a single HTTP request.
+
+    https://www.jsonrpc.org/specification#batch
+
+    The batch is posted with the host, TLS and timeout settings of the web3 HTTP provider. Other providers, like IPC, get the calls one by one.
+
+    :param calls: List of (method, params) tuples
+    :return: Results in the same order as calls
+    :raise RuntimeError: If any of the calls returned an error
+    """
+
+    if not calls:
+        return []
+
+    provider = web3.currentProvider
+
+    if isinstance(provider, (RPCProvider, KeepAliveRPCProvider)):
+        payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": idx} for idx, (method, params) in enumerate(calls)]
+        # Servers are free to answer batch in any order
+        replies = sorted(_decode_reply(_post_batch(provider, json.dumps(payload).encode("utf-8"))), key=lambda r: r["id"])
+    else:
+        replies = [_decode_reply(provider.make_request(method, params)) for method, params in calls]
+        for idx, reply in enumerate(replies):
+            reply["id"] = idx
+
+    results = []
+    for reply in replies:
+        if "error" in reply:
+            raise RuntimeError("JSON-RPC batch call {} failed: {}".format(calls[reply["id"]], reply["error"]))
+        results.append(reply["result"])
+
+    return results
@@ -2,10 +2,14 @@
 from decimal import Decimal
 from math import floor
 import logging
+from typing import List
+
 from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
 
 from websauna.wallet.ethereum.compiler import get_compiled_contract_cached
 from websauna.wallet.ethereum.contractwrapper import ContractWrapper
+from websauna.wallet.ethereum.populusutils import make_batch_request
 
 
 logger = logging.getLogger(__name__)
@@ -35,6 +39,26 @@ class Token(ContractWrapper):
         amount = self.validate_transfer_amount(amount)
         return self.contract.transact().transfer(to_address, amount)
 
+    def get_balances(self, addresses: List[str]) -> List[int]:
+        """Read balanceOf() for many addresses using one JSON-RPC batch request.
+
+        :param addresses: List of 0x hex addresses
+        :return: Raw token balances in the same order as addresses
+        :raise BadFunctionCallOutput: If the contract does not implement balanceOf()
+        """
+        calls = []
+        for address in addresses:
+            data = self.contract.encodeABI("balanceOf", args=[address])
+            calls.append(("eth_call", [{"to": self.address, "data": data}, "latest"]))
+
+        balances = []
+        for address, result in zip(addresses, make_batch_request(self.web3, calls)):
+            if result in ("0x", "", None):
+                raise BadFunctionCallOutput("balanceOf() returned no data for {} on {}".format(address, self.address))
+            balances.append(int(result, 16))
+
+        return balances
+
     @classmethod
     def validate_transfer_amount(cls, amount):
         assert isinstance(amount, Decimal)
@@ -1,7 +1,7 @@
-from typing import List
+from typing import List, Optional
 
 from Crypto.Hash import keccak
-from decimal import Decimal
+from decimal import Decimal, Context
 
 sha3_256 = lambda x: keccak.new(digest_bits=256, data=x).digest()
 
@@ -74,3 +74,43 @@ def to_wei(amount_in_ether: Decimal):
 
 def wei_to_eth(amount_in_wei: int):
     return Decimal(amount_in_wei) / Decimal(10**18)
+
+
+#: Enough precision for uint256 values, so base unit conversions never round
+UNIT_CONTEXT = Context(prec=80)
+
+
+def to_base_units(amount: Decimal, decimals: int) -> int:
+    """Convert a human readable asset amount to integer base units (e.g. ETH to wei).
+
+    :raise ValueError: If the amount has more decimal places than the asset
+    """
+    assert isinstance(amount, Decimal)
+    raw = amount.scaleb(decimals, context=UNIT_CONTEXT)
+    integral = raw.to_integral_value(context=UNIT_CONTEXT)
+    if raw != integral:
+        raise ValueError("{} has more than {} decimal places".format(amount, decimals))
+    return int(integral)
+
+
+def from_base_units(raw: int, decimals: int) -> Decimal:
+    """Convert integer base units to a human readable asset amount (e.g. wei to ETH)."""
+    return Decimal(raw).scaleb(-decimals, context=UNIT_CONTEXT)
+
+
+def get_create2_address(deployer: str, salt: bytes, init_code: bytes, sender: Optional[str]=None) -> str:
+    """Calculate the address CREATE2 opcode deploys a contract to.
+
+    https://eips.ethereum.org/EIPS/eip-1014
+
+    :param deployer: 0x hex address of the contract executing CREATE2
+    :param salt: 32 bytes salt
+    :param init_code: Contract creation code
+    :param sender: 0x hex address of the account calling a factory which binds salts to the caller as ``keccak256(sender, salt)``, like ``DeterministicWalletFactory``
+    :return: 0x hex address
+    """
+    assert len(salt) == 32
+    if sender:
+        salt = sha3_256(eth_address_to_bin(sender) + salt)
+    digest = sha3_256(b"\xff" + eth_address_to_bin(deployer) + salt + sha3_256(init_code))
+    return bin_to_eth_address(digest[12:])
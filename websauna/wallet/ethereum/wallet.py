@@ -27,12 +27,13 @@ class HostedWallet(ContractWrapper):
         contract_meta = get_compiled_contract_cached(contract_name)
         return contract_meta
 
-    def withdraw(self, to_address: str, amount_in_eth: Decimal, from_account=None, max_gas=0, data=None) -> str:
+    def withdraw(self, to_address: str, amount_in_eth: Decimal, from_account=None, max_gas=0, data=None, owner=None) -> str:
         """Withdraw funds from a wallet contract.
 
         :param amount_in_eth: How much as ETH
         :param to_address: Destination address we are withdrawing to
         :param from_account: Which Geth account pays the gas
+        :param owner: Wallet owner if already known, e.g. read with :meth:`Multicall.get_owners` for a batch of withdraws. Otherwise we read it from the contract.
         :return: Transaction hash as 0x string
         """
 
@@ -55,7 +56,8 @@ class HostedWallet(ContractWrapper):
             max_gas = 0
 
         # Sanity check that we own this wallet
-        owner = self.contract.call().owner()
+        if not owner:
+            owner = self.contract.call().owner()
 
         # TODO: parent ABI not stable
         owner = ensure_0x_prefixed_hex(owner)
@@ -0,0 +1,197 @@
+"""Minimal proxy (clone) hosted wallet deployment.
+
+Deploying the full wallet bytecode for every user is slow and expensive. Instead we deploy one ``CloneableWallet`` implementation and a ``WalletFactory`` which creates EIP-1167 minimal proxies pointing to it. See ``contracts/walletfactory.sol``.
+
+``DeterministicWalletFactory`` deploys to addresses known beforehand using CREATE2, so that we know the deposit address before the deployment transaction is mined. CREATE2 needs a Constantinople chain and a newer compiler than the rest of the contracts, see ``contracts-create2/deterministicwalletfactory.sol``. Use :func:`supports_create2` before relying on it.
+"""
+import binascii
+import logging
+import weakref
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from web3 import Web3
+
+from websauna.wallet.ethereum.compiler import get_compiled_contract_cached
+from websauna.wallet.ethereum.contract import confirm_transaction
+from websauna.wallet.ethereum.contractwrapper import ContractWrapper
+from websauna.wallet.ethereum.populuslistener import get_contract_events
+from websauna.wallet.ethereum.utils import eth_address_to_bin, get_create2_address, ensure_0x_prefixed_hex
+
+
+logger = logging.getLogger(__name__)
+
+
+#: EIP-1167 creation code before the implementation address
+CLONE_CODE_PREFIX = bytes.fromhex("3d602d80600a3d3981f3363d3d373d3d3d363d73")
+
+#: EIP-1167 creation code after the implementation address
+CLONE_CODE_SUFFIX = bytes.fromhex("5af43d82803e903d91602b57fd5bf3")
+
+#: Gas we reserve for creating and initializing one clone
+CLONE_GAS = 120000
+
+#: Base gas for a factory transaction
+FACTORY_BASE_GAS = 60000
+
+#: Creation code which runs CREATE2 and returns the created address. Executed with eth_call to see if the chain knows the opcode.
+CREATE2_PROBE_CODE = "0x6000600060006000f560005260206000f3"
+
+_create2_support = weakref.WeakKeyDictionary()
+
+
+class WalletFactoryError(Exception):
+    """Factory transaction did not create the wallets we asked for."""
+
+
+def get_clone_init_code(implementation: str) -> bytes:
+    """Get EIP-1167 minimal proxy creation code for an implementation contract."""
+    return CLONE_CODE_PREFIX + eth_address_to_bin(implementation) + CLONE_CODE_SUFFIX
+
+
+def uuid_to_salt(uuid: UUID) -> bytes:
+    """Derive CREATE2 salt from a database id, so that every address row maps to one deterministic wallet address."""
+    return uuid.bytes.rjust(32, b"\x00")
+
+
+def estimate_factory_gas(count: int) -> int:
+    """How much gas we give to a factory transaction creating ``count`` wallets."""
+    return FACTORY_BASE_GAS + CLONE_GAS * count
+
+
+def supports_create2(web3: Web3) -> bool:
+    """Does the chain we are connected to have CREATE2 opcode (Constantinople)."""
+    if web3 not in _create2_support:
+        try:
+            result = web3.eth.call({"data": CREATE2_PROBE_CODE, "gas": 100000})
+        except ValueError:
+            # Invalid opcode
+            result = None
+        _create2_support[web3] = bool(result and int(result, 16))
+    return _create2_support[web3]
+
+
+class WalletFactory(ContractWrapper):
+    """Proxy object for a deployed wallet factory contract."""
+
+    def __init__(self, *args, **kwargs):
+        super(WalletFactory, self).__init__(*args, **kwargs)
+        self._implementation = None
+
+    @classmethod
+    def abi_factory(cls, contract_name=None):
+        contract_name = contract_name or "WalletFactory"
+        contract_meta = get_compiled_contract_cached(contract_name)
+        return contract_meta
+
+    @classmethod
+    def create_factory(cls, web3: Web3, implementation: Optional[str]=None, wait_for_tx_seconds=180) -> "WalletFactory":
+        """Deploy a new factory.
+
+        :param implementation: Address of existing CloneableWallet. If not given deploy a new one.
+        """
+
+        if not implementation:
+            # Deploy the implementation all clones delegate to
+            from websauna.wallet.ethereum.wallet import HostedWallet
+            implementation = HostedWallet.create(web3, wait_for_tx_seconds=wait_for_tx_seconds, contract_name="CloneableWallet").address
+
+        logger.info("Creating wallet factory for implementation %s", implementation)
+        return cls.create(web3, wait_for_tx_seconds=wait_for_tx_seconds, args=[implementation])
+
+    @property
+    def implementation(self) -> str:
+        """Address of the wallet implementation as 0x hex string."""
+        if not self._implementation:
+            self._implementation = ensure_0x_prefixed_hex(self.contract.call().implementation())
+        return self._implementation
+
+    def create_wallets(self, count: int, wait_for_tx_seconds=180) -> Tuple[str, List[str]]:
+        """Create many wallets in a single transaction.
+
+        :return: tuple(txid, list of new wallet addresses)
+        :raise WalletFactoryError: If the transaction failed
+        """
+        assert count > 0
+        tx_info = {
+            "from": self.web3.eth.coinbase,
+            "gas": estimate_factory_gas(count),
+        }
+        txid = self.contract.transact(tx_info).createWallets(count)
+        return txid, self.get_created_wallets(txid, count, timeout=wait_for_tx_seconds)
+
+    def get_created_wallets(self, txid: str, count: int, timeout=180) -> List[str]:
+        """Wait factory transaction to be mined and read created wallet addresses from its WalletCreated events.
+
+        :raise WalletFactoryError: If the transaction did not create ``count`` wallets, e.g. it ran out of gas or reverted
+        """
+
+        receipt = confirm_transaction(self.web3, txid, timeout=timeout)
+
+        events = {signature: event for signature, event in get_contract_events(self.contract)}
+
+        addresses = []
+        for log in receipt["logs"]:
+            if log["address"].lower() != self.address.lower():
+                # Event from a created wallet
+                continue
+
+            event = events.get(int(log["topics"][0], 16))
+            if event and event.name == "WalletCreated":
+                log_data = event.get_log_data(log)
+                addresses.append(ensure_0x_prefixed_hex(log_data["wallet"]))
+
+        if len(addresses) != count:
+            raise WalletFactoryError("Factory transaction {} created {} wallets, expected {}".format(txid, len(addresses), count))
+
+        return addresses
+
+
+class DeterministicWalletFactory(WalletFactory):
+    """Proxy object for a deployed CREATE2 wallet factory.
+
+    The factory binds salts to the calling account, so addresses are calculated for our coinbase.
+    """
+
+    @classmethod
+    def abi_factory(cls, contract_name=None):
+        return super(DeterministicWalletFactory, cls).abi_factory(contract_name or "DeterministicWalletFactory")
+
+    def compute_address(self, salt: bytes, sender: Optional[str]=None) -> str:
+        """Calculate where a deterministic wallet for a salt is going to be deployed.
+
+        This is done locally without RPC calls besides fetching the implementation address once.
+
+        :param sender: Account calling the factory, coinbase by default
+        """
+        sender = sender or self.web3.eth.coinbase
+        return get_create2_address(self.address, salt, get_clone_init_code(self.implementation), sender=sender)
+
+    def is_deployed(self, address: str) -> bool:
+        """Has a wallet already been created to an address.
+
+        Retried operations use this to skip deployment, as the factory refuses to use the same salt twice.
+        """
+        code = self.web3.eth.getCode(address)
+        if isinstance(code, bytes):
+            code = binascii.hexlify(code).decode("ascii")
+        return code not in ("", "0x", "0x0", None)
+
+    def create_wallets_deterministic(self, salts: List[bytes], wait_for_tx_seconds=180) -> Tuple[str, List[str]]:
+        """Create wallets to addresses we know beforehand.
+
+        See :meth:`compute_address`.
+
+        :return: tuple(txid, list of new wallet addresses in the order of salts)
+        :raise WalletFactoryError: If the transaction failed, e.g. a salt had been used already
+        """
+        assert salts
+        tx_info = {
+            "from": self.web3.eth.coinbase,
+            "gas": estimate_factory_gas(len(salts)),
+        }
+        if len(salts) == 1:
+            txid = self.contract.transact(tx_info).createWalletDeterministic(salts[0])
+        else:
+            txid = self.contract.transact(tx_info).createWalletsDeterministic(salts)
+        return txid, self.get_created_wallets(txid, len(salts), timeout=wait_for_tx_seconds)
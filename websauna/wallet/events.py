@@ -100,3 +100,15 @@ class NetworkStats:
         self.request = request
         self.network_name = network_name
         self.stats_dump = stats_dump
+
+
+class BalanceDriftDetected:
+    """Fired by Celery when cached account balances do not match transaction sums.
+    """
+
+    def __init__(self, request, drift: list):
+        """
+        :param drift: List of (account id, cached balance, transaction sum)
+        """
+        self.request = request
+        self.drift = drift
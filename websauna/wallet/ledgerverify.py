@@ -0,0 +1,148 @@
+"""Ledger integrity verification.
+
+Checks invariants the accounting code relies on:
+
+* Cached ``denormalized_balance`` equals the sum of account transactions. If old transaction partitions have been archived, the sum starts from the opening balance checkpoint at the archive horizon.
+
+* Transfer counterparty links point to each other and the amounts cancel out
+
+* Escrowed funds of settled deposits and cancelled operations have been released. Completed withdraws keep the withdrawn amount in escrow, so they are not checked. Neither are operations older than the archive horizon.
+
+Accounts are split to key ranges streamed from a server side cursor and ranges are verified in a process pool, each worker with its own database connection. Memory use depends on the chunk size only, not on the size of the ledger.
+"""
+import json
+import logging
+import multiprocessing
+from typing import Iterable, List, Tuple, Optional
+
+from sqlalchemy import engine_from_config
+from sqlalchemy.engine import Connection
+
+from websauna.wallet.models.account import get_opening_checkpoint_time
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Accounts per verified range
+DEFAULT_CHUNK_SIZE = 10000
+
+
+BALANCE_SQL = """
+    SELECT a.id, a.denormalized_balance, coalesce(min(o.balance), 0) + coalesce(sum(t.amount), 0) AS actual
+    FROM account a
+    LEFT JOIN account_balance_checkpoint o ON o.account_id = a.id AND o.taken_at = :opening_at
+    LEFT JOIN account_transaction t ON t.account_id = a.id AND (:horizon IS NULL OR t.created_at >= :horizon)
+    WHERE a.id >= :lo AND a.id <= :hi
+    GROUP BY a.id
+    HAVING a.denormalized_balance <> coalesce(min(o.balance), 0) + coalesce(sum(t.amount), 0)
+"""
+
+#: Counterparty of a transfer made right at the archive horizon may have been archived
+COUNTERPARTY_SQL = """
+    SELECT t.id, t.account_id, t.counterparty_id, c.counterparty_id AS back_id, t.amount, c.amount AS counter_amount
+    FROM account_transaction t LEFT JOIN account_transaction c ON c.id = t.counterparty_id
+    WHERE t.account_id >= :lo AND t.account_id <= :hi AND t.counterparty_id IS NOT NULL
+    AND CASE WHEN c.id IS NULL THEN (:horizon IS NULL OR t.created_at > :horizon + interval '1 minute')
+        ELSE (c.counterparty_id IS DISTINCT FROM t.id OR c.amount <> -t.amount) END
+"""
+
+HOLDING_SQL = """
+    SELECT o.id, o.operation_type, o.state, o.holding_account_id AS account_id, sum(t.amount) AS escrowed
+    FROM crypto_operation o JOIN account_transaction t ON t.account_id = o.holding_account_id AND t.operation_id = o.id
+    WHERE o.holding_account_id >= :lo AND o.holding_account_id <= :hi
+    AND (o.state = 'cancelled' OR (o.state = 'success' AND o.operation_type IN ('deposit', 'create_token')))
+    AND (:horizon IS NULL OR o.created_at >= :horizon)
+    GROUP BY o.id
+    HAVING sum(t.amount) <> 0
+"""
+
+
+def iter_account_ranges(connection: Connection, chunk_size=DEFAULT_CHUNK_SIZE) -> Iterable[Tuple[str, str]]:
+    """Split accounts to (first id, last id) ranges in key order.
+
+    Ids are streamed with a server side cursor, so only the current range is kept in memory.
+    """
+    result = connection.execution_options(stream_results=True).execute("SELECT id FROM account ORDER BY id")
+
+    lo = hi = None
+    count = 0
+    for row in result:
+        hi = str(row[0])
+        if lo is None:
+            lo = hi
+        count += 1
+        if count == chunk_size:
+            yield lo, hi
+            lo = None
+            count = 0
+
+    if lo is not None:
+        yield lo, hi
+
+
+def verify_range(connection: Connection, lo: str, hi: str) -> List[dict]:
+    """Verify all invariants for accounts in a key range.
+
+    :return: List of problems as JSON serializable dicts
+    """
+    horizon = connection.execute("SELECT max(range_end) FROM account_transaction_archive").scalar()
+    params = {"lo": lo, "hi": hi, "horizon": horizon, "opening_at": get_opening_checkpoint_time(horizon) if horizon else None}
+    problems = []
+
+    for row in connection.execute(BALANCE_SQL, params):
+        problems.append(dict(check="balance", account_id=str(row.id), cached=str(row.denormalized_balance), actual=str(row.actual)))
+
+    for row in connection.execute(COUNTERPARTY_SQL, params):
+        problems.append(dict(check="counterparty", transaction_id=str(row.id), account_id=str(row.account_id), counterparty_id=str(row.counterparty_id), back_id=str(row.back_id) if row.back_id else None, amount=str(row.amount), counter_amount=str(row.counter_amount) if row.counter_amount is not None else None))
+
+    for row in connection.execute(HOLDING_SQL, params):
+        problems.append(dict(check="holding", operation_id=str(row.id), operation_type=row.operation_type, state=row.state, account_id=str(row.account_id), balance=str(row.escrowed)))
+
+    return problems
+
+
+#: Database engine of a worker process
+_engine = None
+
+
+def _init_worker(settings: dict):
+    global _engine
+    _engine = engine_from_config(settings, "sqlalchemy.")
+
+
+def _verify_range_worker(key_range: Tuple[str, str]) -> Tuple[Tuple[str, str], List[dict]]:
+    with _engine.connect() as connection:
+        # One consistent snapshot for all checks of a range
+        with connection.begin():
+            connection.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            return key_range, verify_range(connection, *key_range)
+
+
+def verify_ledger(settings: dict, report, workers: Optional[int]=None, chunk_size=DEFAULT_CHUNK_SIZE) -> dict:
+    """Verify the whole ledger and write problems as JSON lines.
+
+    :param settings: INI settings with ``sqlalchemy.url``
+    :param report: Writable text file. Each problem is written on its own line as JSON, followed by a summary line.
+    :return: Summary dict
+    """
+    engine = engine_from_config(settings, "sqlalchemy.")
+    workers = workers or multiprocessing.cpu_count()
+
+    summary = dict(check="summary", ranges=0, problems=0, balance=0, counterparty=0, holding=0)
+
+    with engine.connect() as connection:
+        ranges = iter_account_ranges(connection, chunk_size)
+
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(settings,)) as pool:
+            for key_range, problems in pool.imap_unordered(_verify_range_worker, ranges):
+                summary["ranges"] += 1
+                for p in problems:
+                    summary["problems"] += 1
+                    summary[p["check"]] += 1
+                    report.write(json.dumps(p) + "\n")
+
+                logger.info("Verified accounts %s - %s, %d problems", key_range[0], key_range[1], len(problems))
+
+    report.write(json.dumps(summary) + "\n")
+    return summary
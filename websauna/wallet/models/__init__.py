@@ -5,6 +5,10 @@ from .account import Asset
 from .account import AssetNetwork
 from .account import UserOwnedAccount
 from .account import AccountTransaction
+from .account import AccountBalanceCheckpoint
+from .account import AccountTransactionArchive
+from .account import AssetLiability
+from .account import LiabilityClass
 
 from .blockchain import CryptoAddress
 from .blockchain import CryptoOperationState
@@ -18,6 +22,7 @@ from .blockchain import CryptoTokenCreation
 from .blockchain import CryptoTokenImport
 from .blockchain import UserCryptoAddress
 from .blockchain import UserCryptoOperation
+from .blockchain import UserWalletSummary
 from .blockchain import CryptoNetworkStatus
 from .blockchain import UserWithdrawConfirmation
 
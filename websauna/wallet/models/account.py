@@ -1,24 +1,42 @@
 """Core accounting primitivtes."""
 import datetime
+import hashlib
+import logging
+import threading
+import time
+import uuid
 from decimal import Decimal
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List, Dict
 import enum
 
 import sqlalchemy
 from sqlalchemy import Enum
+from sqlalchemy import event
+from sqlalchemy import DDL
+from sqlalchemy.exc import OperationalError
 from sqlalchemy import LargeBinary
 from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index
 from sqlalchemy import Column, Integer, Numeric, ForeignKey, func, String
+from sqlalchemy import inspect
 import sqlalchemy.dialects.postgresql as psql
 from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.dialects.postgresql import UUID
 
+import markdown
 from slugify import slugify
+from transaction.interfaces import TransientError
 from websauna.system.model.columns import UTCDateTime
 from websauna.system.model.json import NestedMutationDict
 from websauna.system.user.models import User
 from websauna.utils.time import now
 from websauna.system.model.meta import Base
+from websauna.wallet.ethereum.utils import to_base_units, from_base_units
+from websauna.wallet.models.ids import client_side_id, uuid7
+
+
+logger = logging.getLogger(__name__)
 
 
 class AssetState(enum.Enum):
@@ -37,10 +55,11 @@ class AssetState(enum.Enum):
     frozen = "frozen"
 
 
+@client_side_id
 class AssetNetwork(Base):
     __tablename__ = "asset_network"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: Internal string identifier for this network
 
@@ -53,6 +72,9 @@ class AssetNetwork(Base):
     #: * house_address
     #: * initial_assets.toybox
     #: * initial_assets.eth_amount
+    #: * wallet_factory - deploy hosted wallets as minimal proxies through this factory contract
+    #: * wallet_factory_deterministic - deploy through this CREATE2 factory contract to know wallet addresses before deployment
+    #: * multicall - Multicall contract address used to batch contract reads
     other_data = Column(NestedMutationDict.as_mutable(psql.JSONB), default=dict)
 
     def __str__(self):
@@ -71,10 +93,8 @@ class AssetNetwork(Base):
     def create_asset(self, name: str, symbol: str, supply: Decimal, asset_class: "AssetClass") -> "Asset":
         """Instiate the asset."""
         assert isinstance(supply, Decimal)
-        dbsession = Session.object_session(self)
         asset = Asset(name=name, symbol=symbol, asset_class=asset_class, supply=supply)
         self.assets.append(asset)
-        dbsession.flush()
         return asset
 
     def get_asset(self, id: UUID) -> "Asset":
@@ -126,15 +146,36 @@ class AssetClass(enum.Enum):
     ether = "ether"
 
 
+class LiabilityClass(enum.Enum):
+    """Whose money an account is holding, for liability reporting."""
+
+    #: Funds belonging to users
+    user = "user"
+
+    #: Funds held by an operation until it completes
+    holding = "holding"
+
+    #: Funds of the house address
+    house = "house"
+
+
+#: Each (asset, liability class) total is split over this many rows, so that concurrent postings rarely update the same row
+LIABILITY_STRIPES = 16
+
+#: Funds of crypto operations in flight are pooled over this many escrow accounts per asset, so that concurrent operations rarely lock the same account row
+ESCROW_STRIPES = 16
+
+
 class AssetFrozen(Exception):
     """A frozen asset was transferred."""
 
 
+@client_side_id
 class Asset(Base):
 
     __tablename__ = "asset"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: When this was created
     created_at = Column(UTCDateTime, default=now, nullable=False)
@@ -160,6 +201,12 @@ class Asset(Base):
     #: Total amount os assets in the distribution
     supply = Column(Numeric(60, 20), nullable=True)
 
+    #: Number of decimal places in the integer base unit of this asset, e.g. 18 for ETH wei. If set, balances and transactions of this asset are also stored as exact integers in ``*_raw`` columns. None if the asset is tracked only as Decimals.
+    decimals = Column(Integer, nullable=True, default=None)
+
+    #: Supply in base units. Kept in sync with supply when decimals is set.
+    supply_raw = Column(Numeric(78, 0), nullable=True)
+
     #: What kind of asset
     #  is this
     asset_class = Column(Enum(AssetClass), nullable=False)
@@ -170,10 +217,14 @@ class Asset(Base):
     #: Misc parameters we can set
     other_data = Column(NestedMutationDict.as_mutable(psql.JSONB), default=dict)
 
+    #: URL path component of the asset within its network. Persistent ``other_data["slug"]`` or generated from the name, kept in sync on save.
+    slug = Column(String(256), nullable=True)
+
     __table_args__ = (
         UniqueConstraint('network_id', 'symbol', name='symbol_per_network'),
         UniqueConstraint('network_id', 'name', name='name_per_network'),
         UniqueConstraint('network_id', 'external_id', name='contract_per_network'),
+        UniqueConstraint('network_id', 'slug', name='slug_per_network'),
     )
 
     def __str__(self):
@@ -182,11 +233,33 @@ class Asset(Base):
     def __repr__(self):
         return self.__str__()
 
-    def get_local_liabilities(self):
-        """Get sum how much assets we are holding on all of our accounts."""
+    def get_local_liabilities(self) -> Decimal:
+        """Get sum how much of this asset we are holding on all of our accounts."""
+        return sum(self.get_liabilities().values(), Decimal(0))
+
+    def get_liabilities(self) -> Dict[LiabilityClass, Decimal]:
+        """Get how much of this asset we are holding for users, operations and the house.
+
+        Read from the :class:`AssetLiability` aggregate, so this does not scan accounts.
+        """
         dbsession = Session.object_session(self)
-        asset_total = dbsession.query(func.sum(Account.denormalized_balance)).join(Asset).scalar()
-        return asset_total
+        totals = dbsession.query(AssetLiability.liability_class, func.sum(AssetLiability.total)).filter(AssetLiability.asset_id == self.id).group_by(AssetLiability.liability_class)
+        result = {c: Decimal(0) for c in LiabilityClass}
+        result.update({c: total for c, total in totals})
+        return result
+
+    def to_raw(self, amount: Decimal) -> int:
+        """Convert amount to integer base units of this asset.
+
+        :raise ValueError: If the amount is more precise than the base unit
+        """
+        assert self.decimals is not None, "Asset {} does not have base units".format(self)
+        return to_base_units(amount, self.decimals)
+
+    def from_raw(self, raw: int) -> Decimal:
+        """Convert integer base units of this asset to a Decimal amount."""
+        assert self.decimals is not None, "Asset {} does not have base units".format(self)
+        return from_base_units(raw, self.decimals)
 
     def ensure_not_frozen(self):
         """Is the transfer of this asset blocked.
@@ -202,13 +275,32 @@ class Asset(Base):
         """Optional long description (Markdown)."""
         return self.other_data.get("long_description")
 
-    @property
-    def slug(self):
+    def render_long_description(self) -> str:
+        """Render long description to HTML and store it with the hash of the Markdown source."""
+        source = self.other_data.get("long_description") or ""
+        html = markdown.markdown(source) if source else ""
+        self.other_data["long_description_hash"] = get_markdown_hash(source)
+        self.other_data["long_description_html"] = html
+        return html
+
+    def get_long_description_html(self) -> str:
+        """Get rendered long description.
+
+        Use the HTML stored by :meth:`render_long_description` while the Markdown source is unchanged. Otherwise render it, but do not store it, so that reading an asset never modifies it.
+        """
+        other_data = self.other_data or {}
+        source = other_data.get("long_description") or ""
+        if other_data.get("long_description_hash") == get_markdown_hash(source):
+            return other_data.get("long_description_html", "")
+
+        return markdown.markdown(source) if source else ""
+
+    def get_default_slug(self) -> Optional[str]:
         """Automatic or persistent slug for URLs."""
-        slug = self.other_data.get("slug")
+        slug = (self.other_data or {}).get("slug")
         if slug:
             return slug
-        return slugify(self.name)
+        return slugify(self.name) if self.name else None
 
     @property
     def archived_at(self) -> datetime.datetime:
@@ -227,6 +319,77 @@ class Asset(Base):
         return self.state == AssetState.public and not self.archived_at
 
 
+#: other_data keys where the rendered long description is cached
+LONG_DESCRIPTION_CACHE_KEYS = ("long_description_hash", "long_description_html")
+
+
+def get_markdown_hash(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+@event.listens_for(Asset, "before_insert")
+@event.listens_for(Asset, "before_update")
+def _sync_supply_raw(mapper, connection, asset: Asset):
+    """Keep supply_raw in sync with the Decimal supply."""
+    if asset.decimals is not None and asset.supply is not None:
+        asset.supply_raw = to_base_units(Decimal(asset.supply), asset.decimals)
+
+
+def get_unique_slug(connection, asset: "Asset", slug: str, claimed: set) -> str:
+    """Number a slug colliding with other assets of the network, like the slug migration does.
+
+    :param claimed: (network id, slug) pairs taken by assets earlier in the same flush, not yet in the database
+    """
+    network_id = asset.network_id or (asset.network and asset.network.id)
+    table = Asset.__table__
+    query = sqlalchemy.select([table.c.slug]).where(table.c.network_id == network_id).where(table.c.slug.like(slug + "%"))
+    if asset.id:
+        query = query.where(table.c.id != asset.id)
+
+    taken = {row[0] for row in connection.execute(query)}
+    taken.update(s for n, s in claimed if n == network_id)
+
+    candidate = slug
+    counter = 2
+    while candidate in taken:
+        candidate = "{}-{}".format(slug, counter)
+        counter += 1
+
+    claimed.add((network_id, candidate))
+    return candidate
+
+
+@event.listens_for(Asset, "before_insert")
+@event.listens_for(Asset, "before_update")
+def _sync_slug(mapper, connection, asset: Asset):
+    """Keep slug in sync with the name and persistent slug.
+
+    Automatic slugs colliding with other assets, e.g. "Token" and "TOKEN", get a number suffix. The numbered slug is made persistent, so that it is not lost when the asset is saved next time.
+    """
+    slug = asset.get_default_slug()
+    if slug and not (asset.other_data or {}).get("slug"):
+        claimed = Session.object_session(asset).info.setdefault("wallet_asset_slugs", set())
+        unique_slug = get_unique_slug(connection, asset, slug, claimed)
+        if unique_slug != slug:
+            if asset.other_data is None:
+                asset.other_data = {}
+            asset.other_data["slug"] = slug = unique_slug
+    asset.slug = slug
+
+
+@event.listens_for(Session, "after_flush")
+@event.listens_for(Session, "after_rollback")
+def _forget_claimed_slugs(session, *args):
+    session.info.pop("wallet_asset_slugs", None)
+
+
+@event.listens_for(Asset.name, "set")
+def _set_slug_from_name(asset: Asset, value, oldvalue, initiator):
+    """Slug is usable before the asset is flushed. Collisions are resolved on flush."""
+    if not (asset.other_data or {}).get("slug"):
+        asset.slug = slugify(value) if value else None
+
+
 class IncompatibleAssets(Exception):
     """Transfer between accounts of different assets."""
 
@@ -235,6 +398,64 @@ class AccountOverdrawn(Exception):
     """Tried to send more than account has."""
 
 
+class AccountLockTimeout(TransientError):
+    """Could not lock accounts for a transfer in time.
+
+    This is a transient error, so ``retryable`` will run the transaction again.
+    """
+
+
+class LockStats:
+    """Per process counters for account row locking.
+
+    Exposed through ``post_network_stats`` so that lock contention on hot accounts shows up in monitoring.
+    """
+
+    #: Lock acquisitions slower than this are counted as waits, seconds
+    wait_threshold = 0.005
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+        self.conflicts = 0
+        self.retries = 0
+
+    def record(self, duration: float, timeout=False, conflict=False, retry=False):
+        """
+        :param timeout: Lock was not acquired within lock timeout
+        :param conflict: Serializable transaction was aborted while locking
+        :param retry: Lock was acquired by a transaction retried after a timeout or conflict
+        """
+        with self.lock:
+            if timeout:
+                self.timeouts += 1
+                return
+            if conflict:
+                self.conflicts += 1
+                return
+            self.acquired += 1
+            if retry:
+                self.retries += 1
+            if duration > self.wait_threshold:
+                self.waits += 1
+                self.wait_seconds += duration
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return dict(acquired=self.acquired, waits=self.waits, wait_seconds=self.wait_seconds, timeouts=self.timeouts, conflicts=self.conflicts, retries=self.retries)
+
+
+#: Account lock counters of this process
+lock_stats = LockStats()
+
+
+@client_side_id
 class Account(Base):
     """Internal credit/debit account.
 
@@ -242,7 +463,7 @@ class Account(Base):
     """
     __tablename__ = "account"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: When this was created
     created_at = Column(UTCDateTime, default=now, nullable=False)
@@ -257,6 +478,20 @@ class Account(Base):
     #: Hold cached balance that is sum of all transactions
     denormalized_balance = Column(Numeric(60, 20), nullable=False, server_default='0')
 
+    #: Cached balance in base units if the asset has decimals set. None until the first transaction after decimals were set.
+    balance_raw = Column(Numeric(78, 0), nullable=True)
+
+    #: Who this account is holding for. Balances are summed per class to :class:`AssetLiability`.
+    liability_class = Column(Enum(LiabilityClass, name="liability_class"), nullable=False, default=LiabilityClass.user, server_default=LiabilityClass.user.value)
+
+    #: Set on pooled escrow accounts, see :meth:`get_escrow_account`
+    escrow_stripe = Column(Integer, nullable=True)
+
+    __table_args__ = (UniqueConstraint("asset_id", "escrow_stripe", name="escrow_stripe_per_asset"), )
+
+    #: How long we wait for row locks of other transfers before giving up and retrying the transaction, milliseconds
+    lock_timeout_ms = 2000
+
     def __str__(self):
         return "<Acc:{} asset:{} bal:{}>".format(self.id, self.asset.symbol, self.get_balance())
 
@@ -267,11 +502,137 @@ class Account(Base):
         # denormalized balance can be non-zero until the account is created
         return self.denormalized_balance or Decimal(0)
 
+    def get_balance_raw(self) -> int:
+        """Get balance as integer base units of the asset."""
+        if self.balance_raw is not None:
+            return int(self.balance_raw)
+        return self.asset.to_raw(self.get_balance())
+
+    def get_balance_at(self, ts: datetime.datetime) -> Optional[Decimal]:
+        """What was the balance of this account at a point of time.
+
+        Start from the latest :class:`AccountBalanceCheckpoint` before ``ts`` and sum only transactions after it.
+
+        :return: Balance or None if ``ts`` is before the archive horizon and there is no checkpoint exactly at ``ts``, as the transactions between checkpoints are no longer available
+        """
+        assert self.id
+        dbsession = Session.object_session(self)
+
+        checkpoint = dbsession.query(AccountBalanceCheckpoint).filter(AccountBalanceCheckpoint.account_id == self.id, AccountBalanceCheckpoint.taken_at <= ts).order_by(AccountBalanceCheckpoint.taken_at.desc()).first()
+
+        horizon = get_archive_horizon(dbsession)
+        if horizon and ts < horizon and not (checkpoint and checkpoint.taken_at == ts):
+            return None
+
+        q = dbsession.query(func.sum(AccountTransaction.amount)).filter(AccountTransaction.account_id == self.id, AccountTransaction.created_at <= ts)
+        if checkpoint:
+            q = q.filter(AccountTransaction.created_at > checkpoint.taken_at)
+            start = checkpoint.balance
+        else:
+            start = Decimal(0)
+
+        return start + (q.scalar() or Decimal(0))
+
+    @classmethod
+    def get_balances_at(cls, dbsession: Session, asset: "Asset", ts: datetime.datetime) -> Dict[UUID, Decimal]:
+        """Balances of all accounts of an asset at a point of time.
+
+        Bulk variant of :meth:`get_balance_at` for end of the day reports.
+
+        :return: Map of account id to balance. Balance is None if it cannot be known because of archived transactions.
+        """
+        result = dbsession.execute(_BALANCE_AT_SQL.format(where="a.asset_id = :asset_id"), {"ts": ts, "asset_id": asset.id, "horizon": get_archive_horizon(dbsession)})
+        return {_as_uuid(row[0]): row[1] for row in result}
+
     def update_balance(self) -> Decimal:
+        """Recalculate the cached balance from all transactions of the account.
+
+        This is slow for accounts with long history. Normal transfers use :meth:`increment_balance`. Use this to fix a drift found by :func:`find_balance_drift`. Archived transactions are accounted by the opening balance checkpoint, see :func:`get_opening_balances`.
+        """
         assert self.id
         dbsession = Session.object_session(self)
-        results = dbsession.query(func.sum(AccountTransaction.amount.label("sum"))).filter(AccountTransaction.account_id == self.id).all()
-        self.denormalized_balance = results[0][0] if results else Decimal(0)
+        horizon = get_archive_horizon(dbsession)
+
+        q = dbsession.query(func.sum(AccountTransaction.amount.label("sum"))).filter(AccountTransaction.account_id == self.id)
+        if horizon:
+            q = q.filter(AccountTransaction.created_at >= horizon)
+
+        opening = get_opening_balances(dbsession, [self.id], horizon).get(self.id, Decimal(0))
+        self.denormalized_balance = opening + (q.scalar() or Decimal(0))
+        return self.denormalized_balance
+
+    def increment_balance(self, amount: Decimal, allow_negative: bool=False) -> Decimal:
+        """Atomically add to the cached balance in the database.
+
+        The overdraw check happens in the same ``UPDATE`` statement, so there is no window between reading the balance and writing it.
+
+        :raise AccountOverdrawn: If the balance would go negative
+        :return: New balance
+        """
+        assert self.id
+        dbsession = Session.object_session(self)
+        table = Account.__table__
+        decimals = self.asset.decimals
+
+        if inspect(self).pending:
+            # Account is inserted on the next flush and no other transaction can see it yet
+            balance = (self.denormalized_balance or Decimal(0)) + amount
+            if not allow_negative and amount < 0 and balance < 0:
+                raise AccountOverdrawn("Cannot withdraw more than you have on the account")
+            self.denormalized_balance = balance
+            if decimals is not None:
+                self.balance_raw = (self.balance_raw or 0) + to_base_units(amount, decimals)
+            add_liabilities(dbsession, {self.get_liability_key(): amount})
+            return balance
+
+        values = dict(denormalized_balance=table.c.denormalized_balance + amount)
+
+        if decimals is not None:
+            # Raw balance missing if the asset got decimals after this account had transactions
+            values["balance_raw"] = func.coalesce(table.c.balance_raw, func.trunc(table.c.denormalized_balance * 10**decimals)) + to_base_units(amount, decimals)
+
+        stmt = table.update().where(table.c.id == self.id).values(**values)
+        if not allow_negative and amount < 0:
+            stmt = stmt.where(table.c.denormalized_balance + amount >= 0)
+
+        row = dbsession.execute(stmt.returning(table.c.denormalized_balance, table.c.balance_raw)).first()
+        if row is None:
+            raise AccountOverdrawn("Cannot withdraw more than you have on the account")
+
+        # Also discards pending ORM changes to these columns, so a later flush does not overwrite the update
+        balance, balance_raw = row
+        set_committed_value(self, "denormalized_balance", balance)
+        set_committed_value(self, "balance_raw", balance_raw)
+
+        add_liabilities(dbsession, {self.get_liability_key(): amount})
+        return balance
+
+    @classmethod
+    def get_escrow_account(cls, dbsession: Session, asset: Asset, stripe: int) -> "Account":
+        """Get a pooled escrow account of an asset, creating it on the first use.
+
+        Crypto operations park their funds in escrow accounts until they complete. One asset has at most :data:`ESCROW_STRIPES` of them and ``AccountTransaction.operation_id`` tells which funds belong to which operation.
+        """
+        assert asset.id
+        assert 0 <= stripe < ESCROW_STRIPES
+
+        # Escrow accounts are only created with the statement below, pending ORM changes cannot affect the lookups
+        with dbsession.no_autoflush:
+            account = dbsession.query(Account).filter_by(asset_id=asset.id, escrow_stripe=stripe).one_or_none()
+            if account:
+                return account
+
+            # Concurrent transactions may race to create the same stripe
+            dbsession.execute("""
+                INSERT INTO account (asset_id, liability_class, escrow_stripe, created_at) VALUES (:asset_id, :liability_class, :stripe, :created_at)
+                ON CONFLICT (asset_id, escrow_stripe) DO NOTHING
+            """, {"asset_id": asset.id, "liability_class": LiabilityClass.holding.value, "stripe": stripe, "created_at": now()})
+
+            return dbsession.query(Account).filter_by(asset_id=asset.id, escrow_stripe=stripe).one()
+
+    def get_liability_key(self) -> Tuple[uuid.UUID, LiabilityClass, int]:
+        """Which :class:`AssetLiability` row balance changes of this account go to."""
+        return self.asset_id, self.liability_class or LiabilityClass.user, self.id.int % LIABILITY_STRIPES
 
     def do_withdraw_or_deposit(self, amount: Decimal, note: str, allow_negative: bool=False) -> "AccountTransaction":
         """Do a top up operation on account.
@@ -295,20 +656,59 @@ class Account(Base):
         if amount > 0:
             self.asset.ensure_not_frozen()
 
-        if not allow_negative:
-            if amount < 0 and self.get_balance() < abs(amount):
-                raise AccountOverdrawn("Cannot withdraw more than you have on the account")
+        self.increment_balance(amount, allow_negative=allow_negative)
 
         DBSession = Session.object_session(self)
         t = AccountTransaction(account=self)
         t.amount = Decimal(amount)
+        if self.asset.decimals is not None:
+            t.amount_raw = self.asset.to_raw(t.amount)
         t.message = note
         DBSession.add(t)
 
-        self.update_balance()
-
         return t
 
+    @classmethod
+    def lock_accounts(cls, dbsession: Session, accounts: List["Account"]):
+        """Take row locks on accounts for the rest of the transaction.
+
+        Locks are always taken in account id order, so two transfers touching the same accounts in opposite directions cannot deadlock. Accounts which have not been flushed yet are not visible to other transactions and are not locked.
+
+        :raise AccountLockTimeout: If another transaction held the locks longer than :attr:`lock_timeout_ms`
+        """
+        ids = sorted(set(a.id for a in accounts if not inspect(a).pending))
+        if not ids:
+            return
+
+        table = cls.__table__
+
+        # SET LOCAL would apply until the end of the transaction, so remember the old value and put it back after locking
+        previous_timeout, _ = dbsession.execute("SELECT current_setting('lock_timeout'), set_config('lock_timeout', :timeout, true)", {"timeout": str(int(cls.lock_timeout_ms))}).first()
+
+        # Set when the previous attempt of the transaction on this session failed to lock
+        retry = dbsession.info.pop("wallet_lock_failed", False)
+
+        started = time.time()
+        try:
+            dbsession.execute(sqlalchemy.select([table.c.id]).where(table.c.id.in_(ids)).order_by(table.c.id).with_for_update()).fetchall()
+        except OperationalError as e:
+            pgcode = getattr(e.orig, "pgcode", None)
+            # 55P03 lock_not_available
+            if pgcode == "55P03":
+                lock_stats.record(time.time() - started, timeout=True)
+                dbsession.info["wallet_lock_failed"] = True
+                logger.warning("Timed out locking accounts %s", ids)
+                raise AccountLockTimeout("Could not lock accounts {}".format(ids)) from e
+            # 40001 serialization_failure, 40P01 deadlock_detected
+            if pgcode in ("40001", "40P01"):
+                lock_stats.record(time.time() - started, conflict=True)
+                dbsession.info["wallet_lock_failed"] = True
+            raise
+
+        lock_stats.record(time.time() - started, retry=retry)
+
+        dbsession.execute("SELECT set_config('lock_timeout', :timeout, true)", {"timeout": previous_timeout})
+
     @classmethod
     def transfer(cls, amount: Decimal, from_: "Account", to: "Account", note: Optional[str]=None) -> Tuple["AccountTransaction", "AccountTransaction"]:
         """Transfer asset between accounts.
@@ -321,6 +721,8 @@ class Account(Base):
 
         - Transaction counterparty fields point each other
 
+        Both accounts are locked first, see :meth:`lock_accounts`.
+
         :return: tuple(withdraw transaction, deposit transaction)
         """
         DBSession = Session.object_session(from_)
@@ -330,25 +732,153 @@ class Account(Base):
 
         from_.asset.ensure_not_frozen()
 
+        cls.lock_accounts(DBSession, [from_, to])
+
         withdraw = from_.do_withdraw_or_deposit(-amount, note)
         deposit = to.do_withdraw_or_deposit(amount, note)
 
-        DBSession.flush()
-
-        deposit.counterparty = withdraw
-        withdraw.counterparty = deposit
+        # Ids are known before flush, so the links are written with the inserts instead of separate updates
+        deposit.counterparty_id = withdraw.id
+        withdraw.counterparty_id = deposit.id
 
         return withdraw, deposit
 
+    #: How many legs we write per INSERT statement in :meth:`post_batch`
+    batch_insert_size = 1000
 
+    @classmethod
+    def post_batch(cls, dbsession: Session, legs: List[Tuple[Optional["Account"], "Account", Decimal, Optional[str]]], allow_negative: bool=False) -> List[Tuple[Optional[uuid.UUID], uuid.UUID]]:
+        """Post many transfers at once.
+
+        Same as calling :meth:`transfer` for each leg, but balances are updated with one set based ``UPDATE`` and transactions are written with multi-row ``INSERT`` statements. Use this when moving funds for many users at once.
+
+        Transactions are written with Core statements, so ``Account.transactions`` of already loaded objects reflect them only on the next query.
+
+        :param legs: List of (from account, to account, amount, note). From account can be None for a plain deposit like :meth:`do_withdraw_or_deposit`.
+        :param allow_negative: Allow from accounts to go negative
+        :raise IncompatibleAssets: If a leg moves between different assets
+        :raise AssetFrozen: If any asset in the batch is frozen
+        :raise AccountOverdrawn: If any account would go negative. Nothing is posted.
+        :return: List of (withdraw transaction id, deposit transaction id) in the order of legs
+        """
+
+        if not legs:
+            return []
+
+        deltas = {}
+        accounts = {}
+        for from_, to, amount, note in legs:
+            assert isinstance(amount, Decimal)
+            assert amount > 0, "Leg amount must be positive"
+            if note:
+                assert isinstance(note, str)
+
+            if from_ is not None:
+                if from_.asset_id != to.asset_id:
+                    raise IncompatibleAssets("Tried to transfer between {} and {}".format(from_, to))
+                accounts[from_.id] = from_
+                deltas[from_.id] = deltas.get(from_.id, Decimal(0)) - amount
+
+            accounts[to.id] = to
+            deltas[to.id] = deltas.get(to.id, Decimal(0)) + amount
+
+        asset_ids = set(a.asset_id for a in accounts.values())
+        frozen = dbsession.query(Asset).filter(Asset.id.in_(asset_ids), Asset.state == AssetState.frozen).first()
+        if frozen:
+            raise AssetFrozen("Asset is frozen: {}".format(frozen))
+
+        # Balances are updated and transactions inserted with Core statements, which need the account rows
+        assert not any(inspect(a).pending for a in accounts.values()), "New accounts must be flushed before posting a batch"
+
+        decimals = dict(dbsession.query(Asset.id, Asset.decimals).filter(Asset.id.in_(asset_ids)).all())
+
+        ids = list(deltas.keys())
+        scales = []
+        for i in ids:
+            account_decimals = decimals.get(accounts[i].asset_id)
+            if account_decimals is not None:
+                # Validate precision before touching the database
+                to_base_units(deltas[i], account_decimals)
+                scales.append(10**account_decimals)
+            else:
+                scales.append(None)
+
+        cls.lock_accounts(dbsession, list(accounts.values()))
+
+        debits = [i for i in ids if deltas[i] < 0]
+        if debits and not allow_negative:
+            # Balances cannot change under our row locks, so check the whole batch before updating anything
+            table = cls.__table__
+            current = {_as_uuid(row[0]): row[1] for row in dbsession.execute(sqlalchemy.select([table.c.id, table.c.denormalized_balance]).where(table.c.id.in_(debits)))}
+            overdrawn = [accounts[i] for i in debits if current[i] + deltas[i] < 0]
+            if overdrawn:
+                raise AccountOverdrawn("Cannot withdraw more than you have on the accounts {}".format(overdrawn))
+
+        # Net balance change per account in one statement
+        stmt = sqlalchemy.text("""
+            UPDATE account SET
+                denormalized_balance = account.denormalized_balance + d.delta,
+                balance_raw = CASE WHEN d.scale IS NULL THEN account.balance_raw ELSE coalesce(account.balance_raw, trunc(account.denormalized_balance * d.scale)) + d.delta * d.scale END,
+                updated_at = :updated_at
+            FROM (SELECT unnest(CAST(:ids AS uuid[])) AS id, unnest(CAST(:deltas AS numeric[])) AS delta, unnest(CAST(:scales AS numeric[])) AS scale) AS d
+            WHERE account.id = d.id
+            RETURNING account.id, account.denormalized_balance, account.balance_raw
+        """)
+        result = dbsession.execute(stmt, {"ids": [str(i) for i in ids], "deltas": [deltas[i] for i in ids], "scales": scales, "updated_at": now()})
+        balances = {_as_uuid(row[0]): (row[1], row[2]) for row in result}
+
+        for account_id, (balance, balance_raw) in balances.items():
+            set_committed_value(accounts[account_id], "denormalized_balance", balance)
+            set_committed_value(accounts[account_id], "balance_raw", balance_raw)
+
+        liabilities = {}
+        for account_id, delta in deltas.items():
+            key = accounts[account_id].get_liability_key()
+            liabilities[key] = liabilities.get(key, Decimal(0)) + delta
+        add_liabilities(dbsession, liabilities)
+
+        # Generate ids beforehand, so that counterparty links go in the same INSERT
+        created_at = now()
+        leg_rows = []
+        posted = []
+        for from_, to, amount, note in legs:
+            leg_decimals = decimals.get(to.asset_id)
+            amount_raw = to_base_units(amount, leg_decimals) if leg_decimals is not None else None
+            deposit_id = uuid7()
+            rows = []
+            if from_ is not None:
+                withdraw_id = uuid7()
+                rows.append(dict(id=withdraw_id, created_at=created_at, account_id=from_.id, amount=-amount, amount_raw=-amount_raw if amount_raw is not None else None, message=note, counterparty_id=deposit_id))
+            else:
+                withdraw_id = None
+            rows.append(dict(id=deposit_id, created_at=created_at, account_id=to.id, amount=amount, amount_raw=amount_raw, message=note, counterparty_id=withdraw_id))
+            leg_rows.append(rows)
+            posted.append((withdraw_id, deposit_id))
+
+        # Both rows of a leg go to the same statement, so a failed batch never leaves half of a transfer behind
+        table = AccountTransaction.__table__
+        for i in range(0, len(leg_rows), cls.batch_insert_size):
+            chunk = [row for rows in leg_rows[i:i + cls.batch_insert_size] for row in rows]
+            dbsession.execute(table.insert().values(chunk))
+
+        # Core inserts are not seen by flush events, see websauna.wallet.models.blockchain.mark_wallet_summaries_stale
+        dbsession.info.setdefault("wallet_summary_accounts", set()).update(ids)
+
+        return posted
+
+
+@client_side_id
 class AccountTransaction(Base):
-    """Instant transaction between accounts."""
+    """Instant transaction between accounts.
+
+    The table is partitioned by month of ``created_at``, see :mod:`websauna.wallet.partitions`. The partition key must be part of the table primary key, but the mapper identifies rows by ``id`` alone.
+    """
 
     __tablename__ = "account_transaction"
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: When this was created
-    created_at = Column(UTCDateTime, default=now, nullable=False)
+    created_at = Column(UTCDateTime, default=now, nullable=False, primary_key=True)
 
     #: When this data was updated last time
     updated_at = Column(UTCDateTime, onupdate=now, nullable=True)
@@ -363,10 +893,29 @@ class AccountTransaction(Base):
                                             ))
 
     amount = Column(Numeric(60, 20), nullable=False, server_default='0')
+
+    #: Amount in base units if the asset has decimals set
+    amount_raw = Column(Numeric(78, 0), nullable=True)
+
     message = Column(String(256))
 
-    counterparty_id = Column(ForeignKey("account_transaction.id"))
-    counterparty = relationship("AccountTransaction", primaryjoin=counterparty_id == id, uselist=False, post_update=True)
+    #: Other leg of a transfer. Not a foreign key, as a partitioned table cannot have a unique constraint on id alone.
+    counterparty_id = Column(UUID(as_uuid=True), nullable=True)
+    counterparty = relationship("AccountTransaction", primaryjoin=counterparty_id == id, foreign_keys=[counterparty_id], remote_side=[id], uselist=False, post_update=True)
+
+    #: Crypto operation whose escrowed funds this transaction moves, see :meth:`Account.get_escrow_account`
+    operation_id = Column(ForeignKey("crypto_operation.id"), nullable=True)
+
+    __table_args__ = (
+        # Point in time balances, see Account.get_balance_at()
+        Index("ix_account_transaction_account_created_at", "account_id", "created_at"),
+        Index("ix_account_transaction_operation_id", "operation_id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    __mapper_args__ = {
+        "primary_key": [id],
+    }
 
     def __str__(self):
         counter_account = self.counterparty.account if self.counterparty else "-"
@@ -378,19 +927,270 @@ class AccountTransaction(Base):
     def __json__(self, request):
         return dict(id=str(self.id), amount=float(self.amount), message=self.message)
 
-    def reverse(self) -> "AccountTransaction":
-        """Moves the funds back to the sending account."""
+    def reverse(self) -> Tuple["AccountTransaction", "AccountTransaction"]:
+        """Moves the funds back to the sending account.
+
+        Reversing transactions belong to the same crypto operation as this one.
+        """
         counter_account = self.counterparty.account
         note = "Transaction {} reversed".format(self.id)
-        return Account.transfer(self.amount, self.account, counter_account, note)
+        withdraw, deposit = Account.transfer(self.amount, self.account, counter_account, note)
+        withdraw.operation_id = deposit.operation_id = self.operation_id
+        return withdraw, deposit
+
+
+# Rows go to the default partition until monthly partitions are created, see websauna.wallet.partitions
+event.listen(AccountTransaction.__table__, "after_create", DDL("CREATE TABLE account_transaction_default PARTITION OF account_transaction DEFAULT"))
+
+
+class AssetLiability(Base):
+    """Running total of account balances per asset and liability class.
+
+    Updated in the same transaction as balances, by :meth:`Account.increment_balance` and :meth:`Account.post_batch`. Every total is striped over :data:`LIABILITY_STRIPES` rows, sum them up for the total.
+
+    Use ``wallet-verify-liabilities`` command to check and rebuild the totals.
+    """
+
+    __tablename__ = "asset_liability"
+
+    asset_id = Column(ForeignKey("asset.id"), primary_key=True)
+
+    liability_class = Column(Enum(LiabilityClass, name="liability_class"), primary_key=True)
+
+    stripe = Column(Integer, primary_key=True, autoincrement=False)
+
+    total = Column(Numeric(60, 20), nullable=False, server_default='0')
+
+    def __str__(self):
+        return "<Liability asset:{} {} stripe:{} total:{}>".format(self.asset_id, self.liability_class, self.stripe, self.total)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def add_liabilities(dbsession: Session, changes: Dict[Tuple[uuid.UUID, LiabilityClass, int], Decimal]):
+    """Add balance changes to liability totals in one statement.
+
+    :param changes: Map of (asset id, liability class, stripe) to amount
+    """
+    changes = {key: amount for key, amount in changes.items() if amount}
+    if not changes:
+        return
+
+    # Sort keys, so that concurrent transactions update rows in the same order
+    keys = sorted(changes.keys(), key=lambda k: (str(k[0]), k[1].value, k[2]))
+    stmt = """
+        INSERT INTO asset_liability (asset_id, liability_class, stripe, total)
+        SELECT * FROM unnest(CAST(:asset_ids AS uuid[]), CAST(:classes AS liability_class[]), CAST(:stripes AS integer[]), CAST(:totals AS numeric[]))
+        ON CONFLICT (asset_id, liability_class, stripe) DO UPDATE SET total = asset_liability.total + EXCLUDED.total
+    """
+    dbsession.execute(stmt, {
+        "asset_ids": [str(k[0]) for k in keys],
+        "classes": [k[1].value for k in keys],
+        "stripes": [k[2] for k in keys],
+        "totals": [changes[k] for k in keys],
+    })
+
+
+def verify_asset_liabilities(dbsession: Session, rebuild: bool=False) -> List[Tuple[uuid.UUID, LiabilityClass, Decimal, Decimal]]:
+    """Compare liability totals against account balances.
+
+    :param rebuild: Replace the totals with sums calculated from accounts
+    :return: List of (asset id, liability class, aggregated total, sum of account balances) that do not match
+    """
+
+    aggregated = dbsession.query(AssetLiability.asset_id, AssetLiability.liability_class, func.sum(AssetLiability.total)).group_by(AssetLiability.asset_id, AssetLiability.liability_class)
+    aggregated = {(asset_id, c): total for asset_id, c, total in aggregated}
+
+    actual = dbsession.query(Account.asset_id, Account.liability_class, func.sum(Account.denormalized_balance)).group_by(Account.asset_id, Account.liability_class)
+    actual = {(asset_id, c): total for asset_id, c, total in actual}
+
+    mismatches = []
+    for key in set(aggregated.keys()) | set(actual.keys()):
+        a = aggregated.get(key) or Decimal(0)
+        b = actual.get(key) or Decimal(0)
+        if a != b:
+            mismatches.append((key[0], key[1], a, b))
+
+    if rebuild:
+        dbsession.query(AssetLiability).delete()
+        add_liabilities(dbsession, {(asset_id, c, 0): total for (asset_id, c), total in actual.items()})
+
+    return mismatches
+
+
+def _as_uuid(value) -> uuid.UUID:
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(value)
+
+
+#: Balance of accounts at :ts from their latest checkpoint before it plus the transactions after the checkpoint
+_BALANCE_AT_SQL = """
+    SELECT a.id, CASE WHEN :ts < :horizon AND prev.taken_at IS DISTINCT FROM :ts THEN NULL ELSE coalesce(prev.balance, 0) + coalesce((
+        SELECT sum(t.amount) FROM account_transaction t
+        WHERE t.account_id = a.id AND t.created_at <= :ts AND (prev.taken_at IS NULL OR t.created_at > prev.taken_at)
+    ), 0) END AS balance
+    FROM account a
+    LEFT JOIN LATERAL (
+        SELECT c.balance, c.taken_at FROM account_balance_checkpoint c
+        WHERE c.account_id = a.id AND c.taken_at <= :ts
+        ORDER BY c.taken_at DESC LIMIT 1
+    ) prev ON true
+    WHERE {where}
+"""
+
+
+@client_side_id
+class AccountBalanceCheckpoint(Base):
+    """Balance of an account at a point of time.
+
+    Written periodically by ``wallet.checkpoint_account_balances`` task, so that :meth:`Account.get_balance_at` does not need to sum the whole account history.
+    """
+
+    __tablename__ = "account_balance_checkpoint"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
+    account_id = Column(ForeignKey("account.id"), nullable=False)
+    account = relationship(Account, backref=backref("balance_checkpoints", lazy="dynamic", cascade="all, delete-orphan"))
 
+    #: Balance includes all transactions created at or before this time
+    taken_at = Column(UTCDateTime, nullable=False)
+
+    balance = Column(Numeric(60, 20), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('account_id', 'taken_at', name='one_checkpoint_per_time'),
+    )
+
+    def __str__(self):
+        return "<Checkpoint acc:{} at:{} bal:{}>".format(self.account_id, self.taken_at, self.balance)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+@client_side_id
+class AccountTransactionArchive(Base):
+    """A partition of ``account_transaction`` which has been detached from the live table.
+
+    Balances of all accounts were checkpointed at the end of the partition range before detaching, so cached balances can still be verified against the live transactions. See :func:`websauna.wallet.partitions.archive_partition`.
+    """
+
+    __tablename__ = "account_transaction_archive"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+
+    #: Name of the detached table
+    partition_name = Column(String(64), nullable=False, unique=True)
+
+    #: None for the partition holding the history before partitioning
+    range_start = Column(UTCDateTime, nullable=True)
+
+    range_end = Column(UTCDateTime, nullable=False)
+
+    archived_at = Column(UTCDateTime, default=now, nullable=False)
+
+    transaction_count = Column(Integer, nullable=False)
+
+    def __str__(self):
+        return "<Archived partition {} {} - {}>".format(self.partition_name, self.range_start, self.range_end)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def get_archive_horizon(dbsession: Session) -> Optional[datetime.datetime]:
+    """Transactions created before this time have been archived.
+
+    :return: None if nothing has been archived
+    """
+    return dbsession.query(func.max(AccountTransactionArchive.range_end)).scalar()
+
+
+def get_opening_checkpoint_time(horizon: datetime.datetime) -> datetime.datetime:
+    """When the balance checkpoint covering all archived transactions is taken.
+
+    Checkpoints include transactions created at or before their time and the archive horizon is exclusive.
+    """
+    return horizon - datetime.timedelta(microseconds=1)
+
+
+def get_opening_balances(dbsession: Session, account_ids: List[UUID], horizon: Optional[datetime.datetime]) -> Dict[UUID, Decimal]:
+    """Balances of accounts at the archive horizon.
+
+    Add live transactions created at or after the horizon to get the current balance.
+
+    :return: Map of account id to balance. Accounts without archived history are missing.
+    """
+    if not horizon or not account_ids:
+        return {}
+
+    q = dbsession.query(AccountBalanceCheckpoint.account_id, AccountBalanceCheckpoint.balance).filter(AccountBalanceCheckpoint.account_id.in_(account_ids), AccountBalanceCheckpoint.taken_at == get_opening_checkpoint_time(horizon))
+    return dict(q.all())
+
+
+def create_balance_checkpoints(dbsession: Session, taken_at: datetime.datetime, after_id: Optional[UUID]=None, limit: int=500) -> Optional[UUID]:
+    """Write balance checkpoints at ``taken_at`` for one chunk of accounts.
+
+    Each checkpoint is computed from the previous checkpoint and the transactions after it. ``taken_at`` should lag behind the current time, so that transactions still in flight are committed before their time is checkpointed.
+
+    :param after_id: Continue after this account id. None to start from the beginning.
+    :return: Last account id in chunk or None if no more accounts
+    """
+    q = dbsession.query(Account.id).order_by(Account.id)
+    if after_id:
+        q = q.filter(Account.id > after_id)
+    ids = [a.id for a in q.limit(limit)]
+
+    if not ids:
+        return None
+
+    select = _BALANCE_AT_SQL.format(where="a.id = ANY(CAST(:ids AS uuid[]))")
+    stmt = "INSERT INTO account_balance_checkpoint (account_id, taken_at, balance) SELECT b.id, :ts, b.balance FROM ({}) AS b WHERE b.balance IS NOT NULL ON CONFLICT DO NOTHING".format(select)
+    dbsession.execute(stmt, {"ts": taken_at, "ids": [str(i) for i in ids], "horizon": get_archive_horizon(dbsession)})
+    return ids[-1]
+
+
+def find_balance_drift(dbsession: Session, after_id: Optional[UUID]=None, limit: int=500) -> Tuple[List[Tuple[UUID, Decimal, Decimal]], Optional[UUID]]:
+    """Compare cached balances against transaction sums for one chunk of accounts.
+
+    Run both queries in the same transaction to get a consistent snapshot.
+
+    :param after_id: Continue after this account id. None to start from the beginning.
+    :return: tuple(list of (account id, cached balance, transaction sum) that do not match, last account id in chunk or None if no more accounts)
+    """
+    q = dbsession.query(Account.id, Account.denormalized_balance).order_by(Account.id)
+    if after_id:
+        q = q.filter(Account.id > after_id)
+    accounts = q.limit(limit).all()
+
+    if not accounts:
+        return [], None
+
+    ids = [a.id for a in accounts]
+    horizon = get_archive_horizon(dbsession)
+    sums = dbsession.query(AccountTransaction.account_id, func.sum(AccountTransaction.amount)).filter(AccountTransaction.account_id.in_(ids)).group_by(AccountTransaction.account_id)
+    if horizon:
+        sums = sums.filter(AccountTransaction.created_at >= horizon)
+    sums = dict(sums.all())
+    opening = get_opening_balances(dbsession, ids, horizon)
+
+    drift = []
+    for account_id, balance in accounts:
+        actual = opening.get(account_id, Decimal(0)) + (sums.get(account_id) or Decimal(0))
+        if (balance or Decimal(0)) != actual:
+            drift.append((account_id, balance, actual))
+
+    return drift, ids[-1]
+
+
+@client_side_id
 class UserOwnedAccount(Base):
     """An account belonging to a some user."""
 
     __tablename__ = "user_owned_account"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     account_id = Column(ForeignKey("account.id"))
     account = relationship(Account,
@@ -413,7 +1213,7 @@ class UserOwnedAccount(Base):
     def create_for_user(cls, user, asset):
         dbsession = Session.object_session(user)
         account = Account(asset=asset)
-        dbsession.flush()
+        dbsession.add(account)
         uoa = UserOwnedAccount(user=user, account=account)
         return uoa
 
@@ -425,13 +1225,10 @@ class UserOwnedAccount(Base):
         # We already have an account for this asset
         if account:
             return account, False
-        dbsession.flush()
 
         # TODO: Why cannot use relationship here
         account = Account(asset_id=asset.id)  # Create account
         dbsession.add(account)
-        dbsession.flush()
         uoa = UserOwnedAccount(user=user, account=account)  # Assign it to a user
-        dbsession.flush()  # Give id to UserOwnedAccount
         return uoa, True
 
@@ -6,6 +6,8 @@ import binascii
 from typing import Optional, Iterable, List, Tuple, Union
 
 import datetime
+import random
+import time
 
 import enum
 import uuid
@@ -14,8 +16,12 @@ import sqlalchemy
 from sqlalchemy import func
 from sqlalchemy import Enum
 from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index
 from sqlalchemy import Column, Integer, Numeric, ForeignKey, func, String, LargeBinary
-from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy import event
+from sqlalchemy import inspect
+from sqlalchemy.orm import relationship, backref, Session, Query
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.dialects.postgresql import UUID
 import sqlalchemy.dialects.postgresql as psql
 
@@ -27,9 +33,10 @@ from websauna.system.model.meta import Base
 from websauna.wallet.ethereum.utils import bin_to_eth_address, bin_to_txid
 from websauna.wallet.utils import ensure_positive
 
-from .account import Account, AccountTransaction
+from .account import Account, AccountTransaction, LiabilityClass, ESCROW_STRIPES
 from .account import AssetNetwork
 from .account import Asset
+from .ids import client_side_id, uuid7
 
 from .confirmation import ManualConfirmation, ManualConfirmationType
 
@@ -77,7 +84,15 @@ class CryptoOperationState(enum.Enum):
     #: The operation was cancelled before it was broadcasted to the network. The balance was returned to the user automatically.
     cancelled = "cancelled"
 
+    #: The service daemon failed to perform the operation too many times. It is not picked up again and needs manual intervention. The balance is still held.
+    dead_letter = "dead_letter"
 
+
+#: Operations which are still in progress from the user point of view
+PENDING_OPERATION_STATES = (CryptoOperationState.confirmation_required, CryptoOperationState.waiting, CryptoOperationState.broadcasted, CryptoOperationState.pending, CryptoOperationState.dead_letter)
+
+
+@client_side_id
 class CryptoAddress(Base):
     """Crypto account is an Ethereum account and Bitcoin address.
 
@@ -92,7 +107,7 @@ class CryptoAddress(Base):
 
     __tablename__ = "crypto_address"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: Native presentation of account / address. Hex string format for Ethereum.
     address = Column(LargeBinary(length=20), nullable=True)
@@ -130,12 +145,12 @@ class CryptoAddress(Base):
         if self.crypto_address_accounts.join(Account).join(Asset).filter(Asset.id==asset.id).one_or_none():
             raise MultipleAssetAccountsPerAddress("Tried to create account for asset {} under address {} twice".format(asset, self))
 
-        account = Account(asset=asset)
-        dbsession.flush()
+        is_house = self.network.other_data.get("house_address") == str(self.id)
+        account = Account(asset=asset, liability_class=LiabilityClass.house if is_house else LiabilityClass.user)
+        dbsession.add(account)
 
         ca_account = CryptoAddressAccount(account=account)
         ca_account.address = self
-        dbsession.flush()
         # self.crypto_address_accounts.append(account)
 
         return ca_account
@@ -189,11 +204,10 @@ class CryptoAddress(Base):
         # Create the operation
         op = CryptoAddressDeposit(network=asset.network)
         op.crypto_account = crypto_account
-        op.holding_account = Account(asset=asset)
         op.txid = txid
-        dbsession.flush()
+        dbsession.add(op)
 
-        op.holding_account.do_withdraw_or_deposit(amount, note)
+        op.hold(asset, amount, note)
 
         return op
 
@@ -217,9 +231,8 @@ class CryptoAddress(Base):
         # Create the operation
         op = CryptoTokenCreation(network=asset.network)
         op.crypto_account = crypto_account
-        op.holding_account = Account(asset=asset)
-        dbsession.flush()
-        op.holding_account.do_withdraw_or_deposit(asset.supply, "Initial supply")
+        dbsession.add(op)
+        op.hold(asset, asset.supply, "Initial supply")
         op.required_confirmation_count = required_confirmation_count
 
         return op
@@ -256,7 +269,6 @@ class CryptoAddress(Base):
         op = CryptoAddressCreation(address=addr)
 
         dbsession.add(op)
-        dbsession.flush()
 
         return op
 
@@ -273,6 +285,7 @@ class CryptoAddress(Base):
         return dbsession.query(CryptoAddressCreation).filter_by(address=self).one()
 
 
+@client_side_id
 class CryptoAddressAccount(Base):
     """Hold balances of crypto currency, token or other asset in address.
 
@@ -281,7 +294,7 @@ class CryptoAddressAccount(Base):
 
     __tablename__ = "crypto_address_account"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     account_id = Column(ForeignKey("account.id"), nullable=False)
     account = relationship(Account,
@@ -336,15 +349,13 @@ class CryptoAddressAccount(Base):
 
         op = CryptoAddressWithdraw(network=network)
         op.crypto_account  = self
-        op.holding_account = Account(asset=self.account.asset)
         op.external_address = to_address
         op.required_confirmation_count = required_confirmation_count
         dbsession = Session.object_session(self)
         dbsession.add(op)
-        dbsession.flush()  # Give ids
 
         # Lock assetes in transfer to this object
-        Account.transfer(amount, self.account, op.holding_account, note)
+        op.hold(self.account.asset, amount, note, from_account=self.account)
 
         return op
 
@@ -357,6 +368,7 @@ class CryptoAddressAccount(Base):
         return dbsession.query(CryptoOperation)
 
 
+@client_side_id
 class CryptoOperation(Base):
     """External network operation.
 
@@ -378,7 +390,7 @@ class CryptoOperation(Base):
 
     __tablename__ = "crypto_operation"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     # Network where this operation happens
     network_id = Column(ForeignKey("asset_network.id"), nullable=False)
@@ -398,6 +410,9 @@ class CryptoOperation(Base):
     attempted_at = Column(UTCDateTime, default=None, nullable=True)
     attempts = Column(Integer, default=0, nullable=False)
 
+    #: Failed operation is not picked up by the service daemon before this time. See :meth:`schedule_retry`.
+    next_attempt_at = Column(UTCDateTime, default=None, nullable=True)
+
     #: When we are created we start in waiting state.
     #: It's up to service daemon to complete the operation and update the state field.
     state = Column(Enum(CryptoOperationState, name="operation_state"), nullable=False, default='waiting')
@@ -440,6 +455,7 @@ class CryptoOperation(Base):
                                     single_parent=True,),)
 
     #: Holds the tokens until the operation is transacted to or from the network. In the case of outgoing transfer hold the assets here until the operation is completed, so user cannot send the asset twice. In the case of incoming transfer have a matching account where the assets are being held until the operation is complete.
+    #: This is a pooled escrow account shared with other operations of the same asset, see :meth:`hold`. Operations created before pooling have their own holding account.
     holding_account_id = Column(ForeignKey("account.id"), nullable=True)
     holding_account = relationship(Account,
                            uselist=False,
@@ -461,6 +477,9 @@ class CryptoOperation(Base):
         "order_by": created_at
     }
 
+    #: Keyset pagination of transaction history
+    __table_args__ = (Index("ix_crypto_operation_created_at_id", "created_at", "id"), )
+
     def __init__(self, network: AssetNetwork, **kwargs):
         assert network
         assert network.id
@@ -473,9 +492,9 @@ class CryptoOperation(Base):
         failure_reason = self.other_data.get("error") or ""
 
         if self.has_txid():
-            network_status = dbsession.query(CryptoNetworkStatus).get(self.network_id)
-            if network_status:
-                nblock = network_status.block_number
+            heartbeat = CryptoNetworkStatus.get_heartbeat(dbsession, self.network_id)
+            if heartbeat:
+                nblock = heartbeat.get("block_number")
             else:
                 nblock = "network-missing"
 
@@ -509,9 +528,42 @@ class CryptoOperation(Base):
     def primary_tx(self) -> Optional[AccountTransaction]:
         """Get the transaction that moves value between user account and holding account."""
         if self.holding_account:
-            return self.holding_account.transactions.first()
+            return self.get_escrow_transactions().order_by(AccountTransaction.created_at).first()
         return None
 
+    def hold(self, asset: Asset, amount: Decimal, note: str, from_account: Optional[Account]=None) -> AccountTransaction:
+        """Put funds of this operation to escrow until the operation completes.
+
+        The funds go to one of the pooled escrow accounts of the asset, picked by the operation id. Both legs of the transfer are tagged with this operation.
+
+        :param from_account: Where the funds come from. If not given the funds are deposited from the outside world.
+        :return: Transaction on the escrow account
+        """
+        dbsession = Session.object_session(self)
+        assert self.id
+
+        escrow = Account.get_escrow_account(dbsession, asset, self.id.int % ESCROW_STRIPES)
+        self.holding_account = escrow
+
+        if from_account:
+            txs = Account.transfer(amount, from_account, escrow, note)
+        else:
+            txs = (escrow.do_withdraw_or_deposit(amount, note),)
+
+        for tx in txs:
+            tx.operation_id = self.id
+
+        return txs[-1]
+
+    def get_escrow_transactions(self) -> Query:
+        """Transactions on the holding account belonging to this operation."""
+        return self.holding_account.transactions.filter(AccountTransaction.operation_id == self.id)
+
+    def get_escrow_balance(self) -> Decimal:
+        """How much of this operation's funds are still in escrow."""
+        dbsession = Session.object_session(self)
+        return dbsession.query(func.sum(AccountTransaction.amount)).filter(AccountTransaction.account_id == self.holding_account_id, AccountTransaction.operation_id == self.id).scalar() or Decimal(0)
+
     @property
     def amount(self) -> Optional[Decimal]:
         """Return human readable value of this operation in asset or None if no asset assigned."""
@@ -579,6 +631,29 @@ class CryptoOperation(Base):
         self.other_data["error"] = error
         self.reverse()
 
+    def schedule_retry(self, error: str, max_attempts: int, base_delay: float, max_delay: float):
+        """Performing this operation failed in the service daemon, try again later.
+
+        The delay grows exponentially with the number of attempts and is randomized, so that operations failing together are not retried together. After ``max_attempts`` the operation is moved to dead letter state.
+
+        :param base_delay: Delay after the first failure in seconds
+        :param max_delay: Upper bound for delay in seconds
+        """
+        self.attempts = (self.attempts or 0) + 1
+        self.attempted_at = now()
+        self.other_data["error"] = error
+
+        if self.attempts >= max_attempts:
+            self.next_attempt_at = None
+            self.failed_at = now()
+            self.state = CryptoOperationState.dead_letter
+            return
+
+        delay = min(max_delay, base_delay * 2 ** (self.attempts - 1))
+        # Equal jitter: wait at least half of the backoff, randomize the rest
+        delay = random.uniform(delay / 2, delay)
+        self.next_attempt_at = self.attempted_at + datetime.timedelta(seconds=delay)
+
     def resolve(self):
         self.mark_complete()
 
@@ -624,13 +699,9 @@ class CryptoOperation(Base):
             # Not yet mined
             return 0
 
-        network_status = dbsession.query(CryptoNetworkStatus).get(self.network_id)
-        if not network_status:
-            return None
-
-        heartbeat = network_status.data.get("heartbeat")
+        heartbeat = CryptoNetworkStatus.get_heartbeat(dbsession, self.network_id)
         if not heartbeat:
-            return
+            return None
 
         current_block = heartbeat.get("block_number")
         if not current_block:
@@ -710,10 +781,11 @@ class DepositResolver:
             # We have already (be forced) to complete externally, we can skip this
             return
 
-        incoming_tx = self.holding_account.transactions.one()
+        incoming_tx = self.get_escrow_transactions().one()
 
         # Settle the user account
-        Account.transfer(incoming_tx.amount, self.holding_account, self.crypto_account.account, incoming_tx.message)
+        withdraw, deposit = Account.transfer(incoming_tx.amount, self.holding_account, self.crypto_account.account, incoming_tx.message)
+        withdraw.operation_id = deposit.operation_id = self.id
 
         self.mark_complete()
 
@@ -764,7 +836,7 @@ class CryptoAddressWithdraw(CryptoOperation):
 
     def reverse(self):
         """User cancels the withdraw before it reaches the network."""
-        escrow_tx = self.holding_account.transactions.first()
+        escrow_tx = self.get_escrow_transactions().order_by(AccountTransaction.created_at).first()
         escrow_tx.reverse()
 
 
@@ -798,13 +870,24 @@ class CryptoTokenImport(CryptoOperation):
         'polymorphic_identity': CryptoOperationType.import_token,
     }
 
+    def get_import_progress(self) -> Optional[Tuple[int, int]]:
+        """How far the chunked balance import has proceeded.
 
+        :return: tuple(processed addresses, total addresses) or None if the import has not started yet
+        """
+        progress = self.other_data.get("import")
+        if not progress:
+            return None
+        return progress["processed"], progress["total"]
+
+
+@client_side_id
 class UserCryptoAddress(Base):
     """An account belonging to a some user."""
 
     __tablename__ = "user_owned_crypto_address"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     #: User given label for this address
     name = Column(String(256))
@@ -837,14 +920,12 @@ class UserCryptoAddress(Base):
         uca.address = CryptoAddress(network=network)
         uca.name = name
         user.owned_crypto_addresses.append(uca)
-        dbsession.flush()
 
         # Put the creation operation in pipeline
         op = CryptoAddressCreation(address=uca.address)
         op.required_confirmation_count = confirmations
 
         dbsession.add(op)
-        dbsession.flush()
         assert op.network
 
         # Bind operation to a user
@@ -898,12 +979,13 @@ class UserCryptoAddress(Base):
         return uco
 
 
+@client_side_id
 class UserCryptoOperation(Base):
     """Operation initiated by a user.."""
 
     __tablename__ = "user_crypto_operation"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, server_default=sqlalchemy.text("uuid_generate_v4()"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sqlalchemy.text("uuid_generate_v4()"),)
 
     crypto_operation_id = Column(ForeignKey("crypto_operation.id"), nullable=False, unique=True)
     crypto_operation = relationship(CryptoOperation,
@@ -918,6 +1000,8 @@ class UserCryptoOperation(Base):
                                         cascade="all, delete-orphan",
                                         single_parent=True,),)
 
+    __table_args__ = (Index("ix_user_crypto_operation_user_id", "user_id"), )
+
     def __str__(self):
         return "<{} {}>".format(self.user, self.crypto_operation)
 
@@ -931,7 +1015,6 @@ class UserCryptoOperation(Base):
         dbsession = Session.object_session(user)
         uco = UserCryptoOperation(user=user, crypto_operation=op)
         dbsession.add(uco)
-        dbsession.flush()
         return uco
 
     @classmethod
@@ -951,6 +1034,160 @@ class UserCryptoOperation(Base):
         return dbsession.query(UserCryptoOperation).filter_by(crypto_operation=op).one_or_none()
 
 
+class UserWalletSummary(Base):
+    """Denormalized wallet totals of a user for wallet header and overview.
+
+    Reading the summary is one primary key lookup. Summaries are kept up to date by session events: when a flush creates user operations, changes operation states or writes account transactions, the summaries of the affected users are recalculated after the flush. Changes written with Core statements, like :meth:`Account.post_batch`, are picked up at the latest when the transaction commits. Use ``wallet-rebuild-summaries`` command to repair summaries after manual changes.
+    """
+
+    __tablename__ = "user_wallet_summary"
+
+    user_id = Column(ForeignKey("users.id"), primary_key=True)
+    user = relationship(User,
+                        backref=backref("wallet_summary",
+                                        uselist=False,
+                                        cascade="all, delete-orphan",
+                                        single_parent=True,),)
+
+    #: Operations in :data:`PENDING_OPERATION_STATES`
+    pending_operation_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    #: Asset id -> balance over all user addresses, as decimal string
+    balances = Column(NestedMutationDict.as_mutable(psql.JSONB), default=dict)
+
+    #: When any of user operations was created or updated last time
+    last_activity_at = Column(UTCDateTime, nullable=True)
+
+    #: When this summary was recalculated
+    updated_at = Column(UTCDateTime, nullable=True)
+
+    def __str__(self):
+        return "<Wallet summary user:{} pending:{}>".format(self.user_id, self.pending_operation_count)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_balance(self, asset: Asset) -> Decimal:
+        """Balance of an asset over all user addresses."""
+        return Decimal(self.balances.get(str(asset.id), 0))
+
+    @classmethod
+    def get_for_user(cls, user: User) -> "UserWalletSummary":
+        """Get summary of a user, calculating it first time if needed."""
+        dbsession = Session.object_session(user)
+        # Not get(), so that pending changes are flushed and the summary refreshed before reading
+        summary = dbsession.query(UserWalletSummary).filter_by(user_id=user.id).one_or_none()
+        if not summary:
+            summary = cls.refresh(user)
+        return summary
+
+    @classmethod
+    def refresh(cls, user: User) -> "UserWalletSummary":
+        """Recalculate summary of a user from operations and accounts in one statement."""
+        dbsession = Session.object_session(user)
+        cls.refresh_by_id(dbsession, user.id)
+        return dbsession.query(UserWalletSummary).populate_existing().get(user.id)
+
+    @classmethod
+    def refresh_by_id(cls, dbsession: Session, user_id: int):
+        """Recalculate summary without loading the user."""
+        dbsession.execute(_WALLET_SUMMARY_SQL, {
+            "user_id": user_id,
+            "pending": tuple(s.value for s in PENDING_OPERATION_STATES),
+            "now": now(),
+        })
+
+
+_WALLET_SUMMARY_SQL = """
+    INSERT INTO user_wallet_summary (user_id, pending_operation_count, balances, last_activity_at, updated_at)
+    SELECT
+        :user_id,
+        (SELECT count(*) FROM user_crypto_operation u JOIN crypto_operation o ON o.id = u.crypto_operation_id
+         WHERE u.user_id = :user_id AND CAST(o.state AS text) IN :pending),
+        (SELECT coalesce(jsonb_object_agg(b.asset_id, b.balance), '{}') FROM (
+            SELECT CAST(a.asset_id AS text) AS asset_id, CAST(sum(coalesce(a.denormalized_balance, 0)) AS text) AS balance
+            FROM user_owned_crypto_address uca
+            JOIN crypto_address_account caa ON caa.address_id = uca.address_id
+            JOIN account a ON a.id = caa.account_id
+            WHERE uca.user_id = :user_id
+            GROUP BY a.asset_id) b),
+        (SELECT max(greatest(o.created_at, o.updated_at)) FROM user_crypto_operation u JOIN crypto_operation o ON o.id = u.crypto_operation_id
+         WHERE u.user_id = :user_id),
+        :now
+    ON CONFLICT (user_id) DO UPDATE SET
+        pending_operation_count = EXCLUDED.pending_operation_count,
+        balances = EXCLUDED.balances,
+        last_activity_at = EXCLUDED.last_activity_at,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def mark_wallet_summaries_stale(dbsession: Session, op_ids: Iterable[uuid.UUID]=(), account_ids: Iterable[uuid.UUID]=()):
+    """Recalculate summaries of users owning these operations or accounts after the next flush or before commit."""
+    dbsession.info.setdefault("wallet_summary_ops", set()).update(op_ids)
+    dbsession.info.setdefault("wallet_summary_accounts", set()).update(account_ids)
+
+
+def refresh_stale_wallet_summaries(dbsession: Session):
+    """Recalculate summaries marked with :func:`mark_wallet_summaries_stale`."""
+    op_ids = dbsession.info.pop("wallet_summary_ops", None)
+    account_ids = dbsession.info.pop("wallet_summary_accounts", None)
+
+    user_ids = set()
+    if op_ids:
+        user_ids.update(row[0] for row in dbsession.query(UserCryptoOperation.user_id).filter(UserCryptoOperation.crypto_operation_id.in_(op_ids)).distinct())
+    if account_ids:
+        owners = dbsession.query(UserCryptoAddress.user_id) \
+            .join(CryptoAddressAccount, CryptoAddressAccount.address_id == UserCryptoAddress.address_id) \
+            .filter(CryptoAddressAccount.account_id.in_(account_ids)) \
+            .distinct()
+        user_ids.update(row[0] for row in owners)
+
+    for user_id in sorted(user_ids):
+        UserWalletSummary.refresh_by_id(dbsession, user_id)
+        summary = dbsession.identity_map.get(identity_key(UserWalletSummary, user_id))
+        if summary:
+            dbsession.expire(summary)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_wallet_summary_changes(session, flush_context, instances):
+    op_ids = set()
+    account_ids = set()
+
+    for obj in session.dirty:
+        if isinstance(obj, CryptoOperation) and inspect(obj).attrs.state.history.has_changes():
+            op_ids.add(obj.id)
+
+    for obj in session.new:
+        if isinstance(obj, UserCryptoOperation):
+            op_ids.add(obj.crypto_operation.id if obj.crypto_operation else obj.crypto_operation_id)
+        elif isinstance(obj, AccountTransaction):
+            account_ids.add(obj.account.id if obj.account else obj.account_id)
+
+    if op_ids or account_ids:
+        mark_wallet_summaries_stale(session, op_ids, account_ids)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _refresh_wallet_summaries(session, flush_context):
+    if session.info.get("wallet_summary_ops") or session.info.get("wallet_summary_accounts"):
+        refresh_stale_wallet_summaries(session)
+
+
+@event.listens_for(Session, "before_commit")
+def _refresh_wallet_summaries_before_commit(session):
+    """Core statements do not flush, refresh what they marked stale. Pending ORM changes mark their users again when the commit flushes them."""
+    if session.info.get("wallet_summary_ops") or session.info.get("wallet_summary_accounts"):
+        refresh_stale_wallet_summaries(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_wallet_summary_changes(session):
+    session.info.pop("wallet_summary_ops", None)
+    session.info.pop("wallet_summary_accounts", None)
+
+
 def import_token(network: AssetNetwork, address: bytes) -> CryptoOperation:
     """Create operation to import existing token smart contract to system as asset.
 
@@ -963,10 +1200,16 @@ def import_token(network: AssetNetwork, address: bytes) -> CryptoOperation:
     op = CryptoTokenImport(network=network)
     op.external_address = address
     dbsession.add(op)
-    dbsession.flush()
     return op
 
 
+#: How many seconds a network heartbeat read from the database is reused within the process
+HEARTBEAT_CACHE_SECONDS = 5
+
+#: Network id -> (expires at monotonic time, heartbeat data)
+_heartbeat_cache = {}
+
+
 class CryptoNetworkStatus(Base):
     """Hold uptime/stats about a network."""
 
@@ -988,7 +1231,6 @@ class CryptoNetworkStatus(Base):
         if not obj:
             obj = CryptoNetworkStatus(network_id=network_id)
             dbsession.add(obj)
-            dbsession.flush()
         return obj
 
     @property
@@ -1000,6 +1242,30 @@ class CryptoNetworkStatus(Base):
 
         return heartbeat.get("block_number")
 
+    @classmethod
+    def get_heartbeat(cls, dbsession: Session, network_id: uuid.UUID, max_age: float=HEARTBEAT_CACHE_SECONDS) -> dict:
+        """Get the latest heartbeat of a network, shared by all sessions of the process for a few seconds.
+
+        Heartbeat changes at most once per block. Confirmation counts, log lines and liveness checks can use a few seconds old value instead of reading the status row for every operation.
+
+        :param max_age: How old cached value is acceptable, in seconds. Zero always reads the database.
+        :return: Heartbeat data with keys timestamp, block_number and block_timestamp or empty dict if the network has not been seen
+        """
+        current = time.monotonic()
+        cached = _heartbeat_cache.get(network_id)
+        if cached and cached[0] > current and max_age > 0:
+            return cached[1]
+
+        data = dbsession.query(CryptoNetworkStatus.data).filter_by(network_id=network_id).scalar() or {}
+        heartbeat = dict(data.get("heartbeat") or {})
+        _heartbeat_cache[network_id] = (current + max_age, heartbeat)
+        return heartbeat
+
+    @classmethod
+    def cache_heartbeat(cls, network_id: uuid.UUID, heartbeat: dict, max_age: float=HEARTBEAT_CACHE_SECONDS):
+        """Heartbeat was written by this process, no need to read it back."""
+        _heartbeat_cache[network_id] = (time.monotonic() + max_age, dict(heartbeat))
+
 
 class UserWithdrawConfirmation(ManualConfirmation):
     """Confirm withdraws with SMS."""
@@ -1035,7 +1301,6 @@ class UserWithdrawConfirmation(ManualConfirmation):
         uwc.deadline_at = now() + datetime.timedelta(seconds=timeout)
         uwc.require_sms(user.user_data["phone_number"])
         dbsession.add(uwc)
-        dbsession.flush()
         return uwc
 
     @classmethod
@@ -16,6 +16,7 @@ from websauna.system.model.json import NestedMutationDict
 from websauna.system.user.models import User
 from websauna.system.model.meta import Base
 from websauna.utils.time import now
+from websauna.wallet.models.ids import client_side_id, uuid7
 
 
 def create_sms_code():
@@ -52,11 +53,12 @@ class ManualConfirmationError(Exception):
     pass
 
 
+@client_side_id
 class ManualConfirmation(Base):
 
     __tablename__ = "manual_confirmation"
 
-    id = sa.Column(psql.UUID(as_uuid=True), primary_key=True, server_default=sa.text("uuid_generate_v4()"),)
+    id = sa.Column(psql.UUID(as_uuid=True), primary_key=True, default=uuid7, server_default=sa.text("uuid_generate_v4()"),)
 
     #: When this was created
     created_at = sa.Column(UTCDateTime, default=now, nullable=False)
@@ -174,5 +176,4 @@ class UserNewPhoneNumberConfirmation(ManualConfirmation):
         confirmation.deadline_at = now() + datetime.timedelta(seconds=timeout)
         confirmation.require_sms(phone_number)
         dbsession.add(confirmation)
-        dbsession.flush()
         return confirmation
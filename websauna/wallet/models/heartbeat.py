@@ -15,11 +15,14 @@ def update_heart_beat(dbsession: Session, network_id: UUID, block_number: int, b
 
     with dbsession.transaction_manager:
         status = CryptoNetworkStatus.get_network_status(dbsession, network_id)
-        status.data["heartbeat"] = {
+        heartbeat = {
             "timestamp": time.time(),
             "block_number": block_number,
             "block_timestamp": block_timestamp,
         }
+        status.data["heartbeat"] = heartbeat
+
+    CryptoNetworkStatus.cache_heartbeat(network_id, heartbeat)
 
 
 def is_network_alive(network: AssetNetwork, timeout=60, block_timeout=180, current_time=None):
@@ -30,8 +33,7 @@ def is_network_alive(network: AssetNetwork, timeout=60, block_timeout=180, curre
     if not current_time:
         current_time = time.time()
 
-    status = CryptoNetworkStatus.get_network_status(session, network.id)
-    heartbeat_data = status.data.get("heartbeat")
+    heartbeat_data = CryptoNetworkStatus.get_heartbeat(session, network.id)
     if not heartbeat_data:
         return False
 
@@ -52,8 +54,7 @@ def dump_network_heartbeat(network: AssetNetwork):
 
     session = Session.object_session(network)
 
-    status = CryptoNetworkStatus.get_network_status(session, network.id)
-    heartbeat_data = status.data.get("heartbeat")
+    heartbeat_data = CryptoNetworkStatus.get_heartbeat(session, network.id)
     if not heartbeat_data:
         return {}
 
@@ -0,0 +1,44 @@
+"""Client side primary keys.
+
+Primary keys are generated in Python when a model is constructed, so the id is known before the session is flushed and a business operation can be written in one flush. Ids are time ordered using UUIDv7 layout, so new rows go to the right edge of primary key indexes instead of random pages.
+
+Tables keep ``uuid_generate_v4()`` server default for rows inserted with plain SQL.
+"""
+import os
+import time
+import uuid
+
+from sqlalchemy import event
+
+
+def uuid7(timestamp: float=None) -> uuid.UUID:
+    """Generate a time ordered UUID.
+
+    48 bits of Unix time in milliseconds, followed by version, variant and 74 random bits.
+
+    :param timestamp: Unix time in seconds. Default to the current time.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    ms = int(timestamp * 1000) & 0xffffffffffff
+    rand = int.from_bytes(os.urandom(10), "big")
+    rand_a = rand >> 68 & 0xfff
+    rand_b = rand & 0x3fffffffffffffff
+
+    value = ms << 80 | 0x7 << 76 | rand_a << 64 | 0b10 << 62 | rand_b
+    return uuid.UUID(int=value)
+
+
+def client_side_id(cls):
+    """Class decorator giving a model instance ``id`` when it is constructed.
+
+    An ``id`` passed to the constructor wins.
+    """
+
+    def assign_id(target, args, kwargs):
+        if target.id is None:
+            target.id = uuid7()
+
+    event.listen(cls, "init", assign_id, propagate=True)
+    return cls
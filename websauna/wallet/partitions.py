@@ -0,0 +1,195 @@
+"""Monthly partitions of account_transaction.
+
+``account_transaction`` is partitioned by range of ``created_at``. Each month has its own partition, so queries for recent activity only touch the latest partitions. Rows which do not fit any monthly partition go to ``account_transaction_default``. The history from before partitioning is in ``account_transaction_legacy``, see the migration.
+
+Settled history can be archived by detaching old partitions. The detached tables stay in the database for dumping and dropping. Before detaching, balances of all accounts are checkpointed at the end of the partition, so that cached balances can still be verified, see :func:`websauna.wallet.models.account.get_opening_balances`.
+
+Run ``wallet.maintain_transaction_partitions`` task daily.
+"""
+import datetime
+import logging
+import re
+from typing import List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from websauna.utils.time import now
+from websauna.wallet.models.account import AccountTransactionArchive, create_balance_checkpoints, get_opening_checkpoint_time
+
+
+logger = logging.getLogger(__name__)
+
+
+#: How many months of partitions we create in advance
+PARTITIONS_AHEAD = 2
+
+#: Accounts checkpointed per statement before archiving
+CHECKPOINT_CHUNK_SIZE = 500
+
+#: Operation states in which escrowed funds are settled, so their transactions can be archived.
+#: Failed and dead letter operations still hold their escrow until they are resolved by hand, and keep blocking archival until then.
+SETTLED_OPERATION_STATES = ("success", "cancelled")
+
+#: How many blocking operations are reported when a partition cannot be archived
+UNSETTLED_REPORT_LIMIT = 20
+
+
+class PartitionNotSettled(Exception):
+    """Partition has transactions of operations which are still in progress."""
+
+    def __init__(self, name: str, operation_ids: List[UUID]):
+        super(PartitionNotSettled, self).__init__("Partition {} has transactions of unsettled operations {}".format(name, ", ".join(str(i) for i in operation_ids)))
+        self.name = name
+        self.operation_ids = operation_ids
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    """First moment of the month in UTC."""
+    dt = dt.astimezone(datetime.timezone.utc)
+    return datetime.datetime(dt.year, dt.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def next_month(dt: datetime.datetime) -> datetime.datetime:
+    """First moment of the following month in UTC."""
+    dt = month_start(dt)
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def get_partition_name(start: datetime.datetime) -> str:
+    return "account_transaction_y{:04d}m{:02d}".format(start.year, start.month)
+
+
+def list_partitions(dbsession: Session) -> List[Tuple[str, Optional[datetime.datetime], Optional[datetime.datetime]]]:
+    """List attached range partitions, oldest first.
+
+    :return: List of (partition name, range start or None for MINVALUE, range end or None for MAXVALUE). The default partition is not included.
+    """
+    rows = dbsession.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = CAST('account_transaction' AS regclass)
+    """).fetchall()
+
+    def parse_bound(value):
+        if value in ("MINVALUE", "MAXVALUE"):
+            return None
+        # Let the database parse the timestamp literal in its own format
+        return dbsession.execute("SELECT CAST(:value AS timestamptz)", {"value": value.strip("'")}).scalar()
+
+    partitions = []
+    for name, bound in rows:
+        m = re.match(r"FOR VALUES FROM \((.*)\) TO \((.*)\)", bound)
+        if not m:
+            # DEFAULT
+            continue
+        partitions.append((name, parse_bound(m.group(1)), parse_bound(m.group(2))))
+
+    partitions.sort(key=lambda p: p[2] or datetime.datetime.max.replace(tzinfo=datetime.timezone.utc))
+    return partitions
+
+
+def create_partition(dbsession: Session, start: datetime.datetime) -> str:
+    """Create a monthly partition.
+
+    Rows of the month which have already landed in the default partition are moved to the new partition.
+
+    :return: Partition name
+    """
+    start = month_start(start)
+    end = next_month(start)
+    name = get_partition_name(start)
+    params = {"start": start, "end": end}
+
+    dbsession.execute("CREATE TABLE {} (LIKE account_transaction INCLUDING DEFAULTS)".format(name))
+    dbsession.execute("INSERT INTO {} SELECT * FROM account_transaction_default WHERE created_at >= :start AND created_at < :end".format(name), params)
+    dbsession.execute("DELETE FROM account_transaction_default WHERE created_at >= :start AND created_at < :end", params)
+
+    # Indexes and foreign keys of the parent table are created on the partition when it is attached
+    bounds = dbsession.execute("SELECT quote_literal(CAST(:start AS timestamptz)), quote_literal(CAST(:end AS timestamptz))", params).fetchone()
+    dbsession.execute("ALTER TABLE account_transaction ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})".format(name, bounds[0], bounds[1]))
+
+    logger.info("Created transaction partition %s", name)
+    return name
+
+
+def ensure_partitions(dbsession: Session, months_ahead: int=PARTITIONS_AHEAD) -> List[str]:
+    """Make sure monthly partitions exist from the current month to ``months_ahead`` months forward.
+
+    :return: Names of created partitions
+    """
+    partitions = list_partitions(dbsession)
+    covered_until = max((end for name, start, end in partitions if end), default=None)
+
+    created = []
+    month = month_start(now())
+    for i in range(months_ahead + 1):
+        if not covered_until or month >= covered_until:
+            created.append(create_partition(dbsession, month))
+        month = next_month(month)
+
+    return created
+
+
+def archive_partition(dbsession: Session, name: str, start: Optional[datetime.datetime], end: datetime.datetime) -> AccountTransactionArchive:
+    """Checkpoint all balances at the end of a partition and detach it.
+
+    Partitions must be archived oldest first.
+
+    :raise PartitionNotSettled: If operations which still hold funds in escrow have transactions in the partition. The exception lists them.
+    """
+    unsettled = get_unsettled_operation_ids(dbsession, name)
+    if unsettled:
+        raise PartitionNotSettled(name, unsettled)
+
+    taken_at = get_opening_checkpoint_time(end)
+    after_id = None
+    while True:
+        after_id = create_balance_checkpoints(dbsession, taken_at, after_id, limit=CHECKPOINT_CHUNK_SIZE)
+        if not after_id:
+            break
+
+    count = dbsession.execute("SELECT count(*) FROM {}".format(name)).scalar()
+    archive = AccountTransactionArchive(partition_name=name, range_start=start, range_end=end, transaction_count=count)
+    dbsession.add(archive)
+
+    dbsession.execute("ALTER TABLE account_transaction DETACH PARTITION {}".format(name))
+    dbsession.flush()
+
+    logger.info("Archived transaction partition %s with %d transactions", name, count)
+    return archive
+
+
+def get_unsettled_operation_ids(dbsession: Session, name: str, limit: int=UNSETTLED_REPORT_LIMIT) -> List[UUID]:
+    """Operations not in :data:`SETTLED_OPERATION_STATES` which have transactions in a partition."""
+    rows = dbsession.execute("""
+        SELECT DISTINCT o.id FROM {} t JOIN crypto_operation o ON o.id = t.operation_id
+        WHERE CAST(o.state AS text) NOT IN :settled ORDER BY o.id LIMIT :limit
+    """.format(name), {"settled": SETTLED_OPERATION_STATES, "limit": limit})
+    return [row[0] for row in rows]
+
+
+def get_archivable_partitions(dbsession: Session, keep_months: int) -> List[Tuple[str, Optional[datetime.datetime], datetime.datetime]]:
+    """Partitions whose whole range is older than ``keep_months`` full months, oldest first.
+
+    The archive horizon must stay contiguous, so the list stops before the first partition with unsettled operations. The operations blocking it are logged as a warning.
+    """
+    cutoff = month_start(now())
+    for i in range(keep_months):
+        cutoff = month_start(cutoff - datetime.timedelta(days=1))
+
+    archivable = []
+    for name, start, end in list_partitions(dbsession):
+        if not end or end > cutoff:
+            break
+
+        unsettled = get_unsettled_operation_ids(dbsession, name)
+        if unsettled:
+            logger.warning("%s", PartitionNotSettled(name, unsettled))
+            break
+
+        archivable.append((name, start, end))
+
+    return archivable
@@ -24,8 +24,6 @@ def give_toybox(event):
 
     if not event.web3:
         # MockEthreumService test shortcut
-        dbsession = Session.object_session(event.address)
-        network = event.address.network
         house_holdings = get_house_holdings(toybox)
         op = do_faux_deposit(event.address, house_holdings.account.asset.id, Decimal(amount))
     else:
@@ -33,10 +31,6 @@ def give_toybox(event):
         house_holdings = get_house_holdings(toybox)
         op = house_holdings.withdraw(Decimal(amount), event.address.address, "Starter assets for user {}".format(user.friendly_name))
 
-        # Generate op.id
-        dbsession = Session.object_session(user)
-        dbsession.flush()
-
     assert op.id
 
     # Record this operation in user data so we can verify it later
@@ -8,18 +8,28 @@ import time
 import redis_lock
 from celery import Task
 from websauna.system.core.redis import get_redis
+from websauna.system.model.retry import retryable
+from websauna.utils.time import now
 from websauna.system.task.tasks import task, WebsaunaTask
 from websauna.system.task.tasks import RetryableTransactionTask
 from websauna.wallet.ethereum.service import ServiceCore, OneShot
-from websauna.wallet.events import NetworkStats, ServiceUpdated
+from websauna.wallet.events import NetworkStats, ServiceUpdated, BalanceDriftDetected
 from websauna.wallet.models import AssetNetwork
+from websauna.wallet.models.account import find_balance_drift, lock_stats, create_balance_checkpoints
 from websauna.wallet.models.heartbeat import dump_network_heartbeat
+from websauna.wallet.partitions import ensure_partitions, get_archivable_partitions, archive_partition, PartitionNotSettled, PARTITIONS_AHEAD
 
 logger = logging.getLogger(__name__)
 
 
 BAD_LOCK_TIMEOUT = 3600
 
+#: How many accounts we verify per database transaction
+RECONCILE_CHUNK_SIZE = 500
+
+#: How far behind the current time we checkpoint balances, so that transactions in flight have been committed
+CHECKPOINT_LAG = datetime.timedelta(minutes=10)
+
 
 @task(name="blockchain.update_networks", bind=True, time_limit=60*30, soft_time_limit=60*15, base=WebsaunaTask)
 def update_networks(self: Task):
@@ -87,5 +97,100 @@ def post_network_stats(self: Task):
     for network in dbsession.query(AssetNetwork).all():
         if network.name in services.keys():
             stats = dump_network_heartbeat(network)
+            stats["account_locks"] = lock_stats.as_dict()
             request.registry.notify(NetworkStats(request, network.name, stats))
 
+
+@task(name="wallet.reconcile_account_balances", bind=True, time_limit=60*60, soft_time_limit=60*45, base=WebsaunaTask)
+def reconcile_account_balances(self: Task):
+    """Verify cached account balances against transaction sums.
+
+    Accounts are checked in chunks, each in its own short transaction, so we don't hold a long snapshot open over the whole ledger. Drift is only reported, not fixed. Use ``Account.update_balance()`` after investigating.
+    """
+    request = self.request.request
+    dbsession = request.dbsession
+
+    @retryable(tm=dbsession.transaction_manager)
+    def check_chunk(after_id):
+        return find_balance_drift(dbsession, after_id, limit=RECONCILE_CHUNK_SIZE)
+
+    all_drift = []
+    after_id = None
+    while True:
+        drift, after_id = check_chunk(after_id)
+        all_drift += drift
+        if not after_id:
+            break
+
+    for account_id, balance, actual in all_drift:
+        logger.error("Account %s balance drift, cached %s, transactions sum %s", account_id, balance, actual)
+
+    if all_drift:
+        request.registry.notify(BalanceDriftDetected(request, all_drift))
+
+    return len(all_drift)
+
+
+@task(name="wallet.checkpoint_account_balances", bind=True, time_limit=60*60, soft_time_limit=60*45, base=WebsaunaTask)
+def checkpoint_account_balances(self: Task):
+    """Write balance checkpoints for all accounts.
+
+    Run periodically, e.g. hourly, to keep ``Account.get_balance_at()`` fast.
+    """
+    request = self.request.request
+    dbsession = request.dbsession
+    taken_at = now() - CHECKPOINT_LAG
+
+    @retryable(tm=dbsession.transaction_manager)
+    def checkpoint_chunk(after_id):
+        return create_balance_checkpoints(dbsession, taken_at, after_id, limit=RECONCILE_CHUNK_SIZE)
+
+    after_id = None
+    while True:
+        after_id = checkpoint_chunk(after_id)
+        if not after_id:
+            break
+
+    logger.info("Account balances checkpointed at %s", taken_at)
+
+
+@task(name="wallet.maintain_transaction_partitions", bind=True, time_limit=60*60, soft_time_limit=60*45, base=WebsaunaTask)
+def maintain_transaction_partitions(self: Task):
+    """Create upcoming monthly partitions of account transactions and archive old ones.
+
+    Run daily. Archival is off unless ``websauna.wallet.transaction_archive_months`` setting tells how many full months of transactions are kept live.
+    """
+    request = self.request.request
+    dbsession = request.dbsession
+    settings = request.registry.settings
+    months_ahead = int(settings.get("websauna.wallet.transaction_partitions_ahead", PARTITIONS_AHEAD))
+    keep_months = int(settings.get("websauna.wallet.transaction_archive_months", 0))
+
+    @retryable(tm=dbsession.transaction_manager)
+    def create_partitions():
+        return ensure_partitions(dbsession, months_ahead)
+
+    @retryable(tm=dbsession.transaction_manager)
+    def list_archivable():
+        return get_archivable_partitions(dbsession, keep_months)
+
+    @retryable(tm=dbsession.transaction_manager)
+    def archive(name, start, end):
+        archive_partition(dbsession, name, start, end)
+
+    created = create_partitions()
+
+    archived = []
+    if keep_months:
+        # Oldest first, one partition per transaction
+        for name, start, end in list_archivable():
+            try:
+                archive(name, start, end)
+            except PartitionNotSettled as e:
+                # Archive horizon must stay contiguous, so newer partitions wait too
+                logger.warning("Stopped archiving: %s", e)
+                break
+            archived.append(name)
+
+    logger.info("Transaction partitions created %s, archived %s", created, archived)
+    return created, archived
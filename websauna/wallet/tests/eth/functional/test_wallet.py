@@ -1,10 +1,14 @@
 
 """An example login test case."""
 
+import requests
 import transaction
 from pyramid.registry import Registry
 from sqlalchemy.orm.session import Session
 from splinter.driver import DriverAPI
+from websauna.system.user.models import User
+from websauna.tests.utils import create_user
+from websauna.utils.slug import uuid_to_slug
 from websauna.wallet.tests.eth.utils import mock_create_addresses
 
 
@@ -43,12 +47,20 @@ def test_ui_create_address(logged_in_wallet_user_browser: DriverAPI, dbsession:
     assert b.is_element_present_by_css("#heading-address")  # Page renders without errors
 
 
+def test_api_other_user_wallet_forbidden(logged_in_wallet_user_browser: DriverAPI, dbsession: Session, registry: Registry, web_server: str, wallet_user):
+    """Signed in users can read their own wallet JSON, but not wallets of others."""
 
+    with transaction.manager:
+        own_slug = uuid_to_slug(dbsession.query(User).get(wallet_user["user_id"]).uuid)
+        other_slug = uuid_to_slug(create_user(dbsession, registry, email="other@example.com", password="password").uuid)
 
+    # Reuse the session of the signed in browser
+    cookies = {c["name"]: c["value"] for c in logged_in_wallet_user_browser.driver.get_cookies()}
 
+    resp = requests.get("{}/wallet/{}/wallet.json".format(web_server, own_slug), cookies=cookies)
+    assert resp.status_code == 200
+    assert "balances" in resp.json()
 
-
-
-
-
-
+    for name in ("wallet.json", "balances.json", "transactions/operations.json"):
+        resp = requests.get("{}/wallet/{}/{}".format(web_server, other_slug, name), cookies=cookies)
+        assert resp.status_code == 403
@@ -0,0 +1,117 @@
+"""Paginated transaction history."""
+import pytest
+import transaction
+from pyramid.httpexceptions import HTTPBadRequest
+
+from websauna.system.user.models import User
+from websauna.wallet.ethereum.asset import get_eth_network
+from websauna.wallet.models import UserCryptoAddress
+from websauna.wallet.tests.eth.utils import count_queries
+from websauna.wallet.views.api import OPERATION_FIELDS, get_fields, serialize_operation, operations_json
+from websauna.wallet.views.wallet import WalletFolder, PENDING_OP_STATES, BadCursor, describe_operation, preload_operations
+
+
+def test_operations_keyset_pagination(dbsession, test_request, wallet_user):
+    """Walk through pending operations page by page."""
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        network = get_eth_network(dbsession, "testnet")
+        for i in range(4):
+            UserCryptoAddress.create_address(user, network, "Address {}".format(i), confirmations=1)
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        op_folder = WalletFolder(test_request).get_user_wallet(user)["transactions"]
+
+        all_ops = [uo.op.id for uo in op_folder.get_operations(PENDING_OP_STATES)]
+        assert len(all_ops) == 5
+
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = op_folder.get_operations_page(PENDING_OP_STATES, after=cursor, limit=2)
+            seen += [uo.op.id for uo in page]
+            if not cursor:
+                break
+
+        assert seen == all_ops
+
+        with pytest.raises(BadCursor):
+            op_folder.get_operations_page(PENDING_OP_STATES, after="foobar")
+
+
+def describe_page(dbsession, test_request, user_id, limit, api=False) -> tuple:
+    """Describe one page of pending operations like the transaction history does.
+
+    :param api: Serialize the page with operations.json view instead
+    :return: Tuple (operation count, query count)
+    """
+    with transaction.manager:
+        # Fresh request cache and identity map, as in a new request
+        test_request._wallet_resource_cache = {}
+        dbsession.expunge_all()
+
+        user = dbsession.query(User).get(user_id)
+        op_folder = WalletFolder(test_request).get_user_wallet(user)["transactions"]
+        with count_queries(dbsession) as statements:
+            if api:
+                # Skip the sign in check of the decorator, the request has no session
+                test_request.GET["limit"] = str(limit)
+                details = operations_json.__wrapped__(op_folder, test_request)["operations"]
+            else:
+                ops, cursor = op_folder.get_operations_page(PENDING_OP_STATES, limit=limit)
+                preload_operations(test_request, ops)
+                details = [describe_operation(test_request, uop) for uop in ops]
+                # Touch everything the template renders
+                for detail in details:
+                    detail["address_resource"].get_title()
+                    detail["network_resource"].get_title()
+        return len(details), len(statements)
+
+
+def test_operations_query_count(dbsession, test_request, wallet_user):
+    """Describing a page of operations costs the same number of queries for one or many operations."""
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        network = get_eth_network(dbsession, "testnet")
+        for i in range(4):
+            UserCryptoAddress.create_address(user, network, "Address {}".format(i), confirmations=1)
+
+    op_count, single_query_count = describe_page(dbsession, test_request, wallet_user["user_id"], limit=1)
+    assert op_count == 1
+
+    op_count, query_count = describe_page(dbsession, test_request, wallet_user["user_id"], limit=5)
+    assert op_count == 5
+    assert query_count == single_query_count
+
+    op_count, single_query_count = describe_page(dbsession, test_request, wallet_user["user_id"], limit=1, api=True)
+    assert op_count == 1
+
+    op_count, query_count = describe_page(dbsession, test_request, wallet_user["user_id"], limit=5, api=True)
+    assert op_count == 5
+    assert query_count == single_query_count
+
+
+def test_operations_json_serialization(dbsession, test_request, wallet_user):
+    """Operations serialize without resolving linked resources and honour field selection."""
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        op_folder = WalletFolder(test_request).get_user_wallet(user)["transactions"]
+
+        ops, cursor = op_folder.get_operations_page(PENDING_OP_STATES, limit=10)
+        detail = describe_operation(test_request, ops[0], resources=False)
+        assert "address_resource" not in detail
+
+        data = serialize_operation(detail, OPERATION_FIELDS)
+        assert data["id"] == ops[0].__name__
+        assert data["type"] == "create_address"
+
+        test_request.GET["fields"] = "id,state"
+        assert list(serialize_operation(detail, get_fields(test_request, OPERATION_FIELDS))) == ["id", "state"]
+
+        test_request.GET["fields"] = "id,foobar"
+        with pytest.raises(HTTPBadRequest):
+            get_fields(test_request, OPERATION_FIELDS)
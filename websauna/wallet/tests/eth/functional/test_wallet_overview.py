@@ -0,0 +1,79 @@
+"""Wallet overview read model and resource resolution."""
+import transaction
+
+from websauna.system.user.models import User
+from websauna.wallet.ethereum.asset import get_ether_asset
+from websauna.wallet.models import AssetNetwork
+from websauna.wallet.models import CryptoAddress
+from websauna.wallet.models import UserCryptoAddress
+from websauna.wallet.tests.eth.utils import count_queries, mock_create_addresses
+from websauna.wallet.views.network import get_network_resource
+from websauna.wallet.views.wallet import WalletFolder, load_wallet_overview, get_user_address_resource
+
+
+def load_overview(dbsession, test_request, user_id) -> tuple:
+    with transaction.manager:
+        user = dbsession.query(User).get(user_id)
+        wallet = WalletFolder(test_request).get_user_wallet(user)
+        with count_queries(dbsession) as statements:
+            asset_details, address_details = load_wallet_overview(wallet)
+            # Touch everything the templates render
+            for detail in asset_details:
+                detail["asset_resource"].asset.symbol
+                detail["address_resource"].get_title()
+                detail["network_resource"].get_title()
+            for detail in address_details:
+                detail["op"].state
+                detail["network_resource"].get_title()
+        return len(asset_details), len(address_details), len(statements)
+
+
+def test_wallet_overview_query_count(dbsession, test_request, wallet_user, mock_eth_service):
+    """The number of queries for wallet overview does not grow with the number of addresses and assets."""
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        # Mock service created the address in its own network only
+        uca = user.owned_crypto_addresses.join(CryptoAddress).filter(CryptoAddress.address != None).one()
+        uca.address.create_account(get_ether_asset(dbsession, uca.address.network))
+        network_id = uca.address.network.id
+
+    asset_count, address_count, query_count = load_overview(dbsession, test_request, wallet_user["user_id"])
+    assert (asset_count, address_count) == (1, 2)
+    assert query_count == 3
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        network = dbsession.query(AssetNetwork).get(network_id)
+        UserCryptoAddress.create_address(user, network, "Second", confirmations=1)
+
+    mock_create_addresses(mock_eth_service, dbsession, address="0x7C0d52faAB596C08F484E3478AeBc6205F3f5D8C")
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        uca = user.owned_crypto_addresses.filter_by(name="Second").one()
+        uca.address.create_account(get_ether_asset(dbsession, uca.address.network))
+
+    asset_count, address_count, query_count = load_overview(dbsession, test_request, wallet_user["user_id"])
+    assert (asset_count, address_count) == (2, 3)
+    assert query_count == 3
+
+
+def test_resource_resolution_cached(dbsession, test_request, wallet_user):
+    """Resources resolved once are not looked up again within the request."""
+
+    with transaction.manager:
+        user = dbsession.query(User).get(wallet_user["user_id"])
+        uca = user.owned_crypto_addresses.join(CryptoAddress).filter(CryptoAddress.address != None).one()
+        address = uca.address
+        network = address.network
+
+        ua = get_user_address_resource(test_request, address)
+        network_resource = get_network_resource(test_request, network)
+
+        with count_queries(dbsession) as statements:
+            assert get_user_address_resource(test_request, address) is ua
+            assert get_network_resource(test_request, network) is network_resource
+
+        assert statements == []
+        assert ua.wallet.user == user
@@ -9,6 +9,7 @@ from web3 import Web3
 
 from sqlalchemy.orm import Session
 
+from websauna.wallet.ethereum import ops
 from websauna.wallet.ethereum.asset import get_ether_asset
 from websauna.wallet.ethereum.contract import confirm_transaction
 from websauna.wallet.ethereum.service import EthereumService
@@ -88,7 +89,7 @@ def test_deposit_eth(dbsession, eth_network_id, web3, eth_service, coinbase, dep
         assert len(ops) == 2  # Create + deposit
         op = ops[-1]
         assert isinstance(op, CryptoAddressDeposit)
-        assert op.holding_account.get_balance() == TEST_VALUE
+        assert op.get_escrow_balance() == TEST_VALUE
         assert op.completed_at is None
         opid = op.id
 
@@ -103,7 +104,7 @@ def test_deposit_eth(dbsession, eth_network_id, web3, eth_service, coinbase, dep
         assert len(ops) == 2  # Create + deposit
         op = ops[-1]
         assert isinstance(op, CryptoAddressDeposit)
-        assert op.holding_account.get_balance() == 0
+        assert op.get_escrow_balance() == 0
         assert op.completed_at is not None
 
         address = dbsession.query(CryptoAddress).filter_by(address=eth_address_to_bin(deposit_address)).one()
@@ -362,6 +363,36 @@ def test_import_token(dbsession, eth_network_id, web3: Web3, eth_service: Ethere
         assert caccount.account.get_balance() == 4000
 
 
+def test_import_token_chunked(dbsession, eth_network_id, web3: Web3, coinbase: str, deposit_address: str, token: Token):
+    """Import commits balances in chunks and records its progress."""
+
+    txid = token.transfer(deposit_address, Decimal(4000))
+    confirm_transaction(web3, txid)
+
+    with transaction.manager:
+        network = dbsession.query(AssetNetwork).get(eth_network_id)
+        op = import_token(network, eth_address_to_bin(token.address))
+        opid = op.id
+
+        # Addresses without tokens
+        for addr in ("0x2f70d3d26829e412a602e83fe8eebf80255aeea5", "0x7bd2f95cefada49141a7f467f40c42f94e3c7338"):
+            dbsession.add(CryptoAddress(network=network, address=eth_address_to_bin(addr)))
+
+    # One address per transaction
+    ops.import_token(web3, dbsession, opid, chunk_size=1)
+
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).get(opid)
+        assert op.completed_at
+        processed, total = op.get_import_progress()
+        assert processed == total == 3
+
+        network = dbsession.query(AssetNetwork).get(eth_network_id)
+        caddress = CryptoAddress.get_network_address(network, eth_address_to_bin(deposit_address))
+        caccount = caddress.get_account_by_address(eth_address_to_bin(token.address))
+        assert caccount.account.get_balance() == 4000
+
+
 def test_import_no_address_token(dbsession: Session, eth_network_id, web3: Web3, eth_service: EthereumService):
     """Import should fail for address that doesn't exist."""
 
@@ -411,7 +442,7 @@ def test_deposit_token(dbsession, eth_network_id, web3: Web3, eth_service: Ether
         assert not op.completed_at
         address = dbsession.query(CryptoAddress).filter_by(address=eth_address_to_bin(deposit_address)).one()
         asset = op.holding_account.asset
-        assert op.holding_account.get_balance() == 4000
+        assert op.get_escrow_balance() == 4000
         assert op.completed_at is None
         assert address.get_account(asset).account.get_balance() == 0  # Not credited until confirmations reached
         assert address.crypto_address_accounts.count() == 1
@@ -426,7 +457,7 @@ def test_deposit_token(dbsession, eth_network_id, web3: Web3, eth_service: Ether
         assert op.completed_at
         address = dbsession.query(CryptoAddress).filter_by(address=eth_address_to_bin(deposit_address)).one()
         asset = op.holding_account.asset
-        assert op.holding_account.get_balance() == 0
+        assert op.get_escrow_balance() == 0
         assert address.get_account(asset).account.get_balance() == 4000
         assert op.state == CryptoOperationState.success
 
@@ -86,7 +86,7 @@ def _withdraw(web3, dbsession: Session, opid: UUID):
         assert op.crypto_account.id
         assert op.crypto_account.account.id
         assert op.holding_account.id
-        assert op.holding_account.get_balance() > 0
+        assert op.get_escrow_balance() > 0
         assert op.external_address
         assert op.required_confirmation_count  # Should be set by the creator
 
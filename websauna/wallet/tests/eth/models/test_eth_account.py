@@ -11,9 +11,10 @@ from websauna.system.user.models import User
 from websauna.tests.utils import create_user
 from websauna.wallet.ethereum.asset import setup_user_account
 from websauna.wallet.ethereum.utils import eth_address_to_bin, txid_to_bin, bin_to_txid
-from websauna.wallet.models import AssetNetwork, CryptoAddressCreation, CryptoOperation, CryptoAddress, Asset, CryptoAddressAccount, CryptoAddressWithdraw, CryptoOperationState, AssetClass
-from websauna.wallet.models.blockchain import MultipleAssetAccountsPerAddress, UserCryptoOperation, UserCryptoAddress
-from websauna.wallet.tests.eth.utils import mock_create_addresses, TEST_ADDRESS
+from websauna.wallet.models import AssetNetwork, CryptoAddressCreation, CryptoOperation, CryptoAddress, Asset, CryptoAddressAccount, CryptoAddressWithdraw, CryptoOperationState, Account
+from websauna.wallet.models.account import ESCROW_STRIPES
+from websauna.wallet.models.blockchain import MultipleAssetAccountsPerAddress, UserCryptoOperation, UserCryptoAddress, UserWalletSummary
+from websauna.wallet.tests.eth.utils import mock_create_addresses, count_flushes, TEST_ADDRESS
 
 TEST_TXID = "0x00df829c5a142f1fccd7d8216c5785ac562ff41e2dcfdf5785ac562ff41e2dcf"
 
@@ -125,7 +126,7 @@ def test_deposit_eth_account(dbsession, eth_network_id, eth_service, eth_asset_i
         account = address.get_account(asset)
         op = dbsession.query(CryptoOperation).one()
         assert account.account.get_balance() == Decimal(10)
-        assert op.holding_account.get_balance() == 0
+        assert op.get_escrow_balance() == 0
 
         # Transaction label should be the Ethereum txid
         tx = account.account.transactions.one()
@@ -199,10 +200,10 @@ def test_withdraw_eth_account(dbsession, eth_service, eth_network_id, eth_asset_
         op = ca_account.withdraw(Decimal("10"), withdraw_address, "Bailing out")
 
         # We withdraw 10 ETHs
-        assert op.holding_account.get_balance() == Decimal("10")
+        assert op.get_escrow_balance() == Decimal("10")
         assert op.holding_account.asset == dbsession.query(Asset).get(eth_asset_id)
-        assert op.holding_account.transactions.count() == 1
-        assert op.holding_account.transactions.first().message == "Bailing out"
+        assert op.get_escrow_transactions().count() == 1
+        assert op.get_escrow_transactions().first().message == "Bailing out"
 
         # Check all looks good on sending account
         assert ca_account.account.transactions.count() == 2
@@ -229,6 +230,43 @@ def test_withdraw_eth_account(dbsession, eth_service, eth_network_id, eth_asset_
         assert ops[0].txid == txid_to_bin(TEST_TXID)
 
 
+def test_withdraw_escrow_pooled(dbsession, eth_network_id, eth_asset_id):
+    """Withdraws share escrow accounts, but each one can be reversed on its own."""
+
+    with transaction.manager:
+        network = dbsession.query(AssetNetwork).get(eth_network_id)
+        address = CryptoAddress(network=network, address=eth_address_to_bin(TEST_ADDRESS))
+        dbsession.flush()
+        asset = dbsession.query(Asset).get(eth_asset_id)
+        ca_account = address.create_account(asset)
+        ca_account.account.do_withdraw_or_deposit(Decimal(1000), "Faux top up")
+
+    with transaction.manager:
+        account_count = dbsession.query(Account).count()
+        ca_account = dbsession.query(CryptoAddressAccount).one()
+        ops = [ca_account.withdraw(Decimal(i + 1), eth_address_to_bin(TEST_ADDRESS), "Withdraw {}".format(i)) for i in range(ESCROW_STRIPES + 1)]
+        op_ids = [op.id for op in ops]
+
+        # Escrow accounts are shared instead of created per operation
+        assert dbsession.query(Account).count() <= account_count + ESCROW_STRIPES
+        for i, op in enumerate(ops):
+            assert op.holding_account.escrow_stripe is not None
+            assert op.get_escrow_balance() == Decimal(i + 1)
+            assert op.amount == Decimal(i + 1)
+
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).get(op_ids[0])
+        op.mark_cancelled("User cancelled")
+
+    with transaction.manager:
+        ops = [dbsession.query(CryptoOperation).get(opid) for opid in op_ids]
+        assert ops[0].get_escrow_balance() == 0
+        assert ops[1].get_escrow_balance() == Decimal(2)
+
+        ca_account = dbsession.query(CryptoAddressAccount).one()
+        assert ca_account.account.get_balance() == Decimal(1000) - sum(Decimal(i + 1) for i in range(1, ESCROW_STRIPES + 1))
+
+
 def test_setup_user_account(dbsession, registry, eth_service, testnet_service, eth_network_id):
     """See that we create primary and testnet address."""
 
@@ -318,3 +356,57 @@ def test_get_user_account_assets(dbsession, registry, mock_eth_service, eth_netw
         assert current_address == address
 
 
+def test_user_wallet_summary(dbsession, topped_up_user, eth_network_id, eth_asset_id):
+    """Wallet summary follows user operations."""
+
+    with transaction.manager:
+        user = dbsession.query(User).first()
+        asset = dbsession.query(Asset).get(eth_asset_id)
+        summary = UserWalletSummary.get_for_user(user)
+
+        # Testnet address creation is still waiting
+        assert summary.pending_operation_count == 1
+        assert summary.last_activity_at
+        assert summary.get_balance(asset) == Decimal(10)
+
+        network = dbsession.query(AssetNetwork).get(eth_network_id)
+        address = UserCryptoAddress.get_default(user, network)
+        uop = address.withdraw(asset, Decimal(5), eth_address_to_bin(TEST_ADDRESS), "Foobar", 1)
+
+        # New operation and its escrow posting are picked up on flush
+        summary = UserWalletSummary.get_for_user(user)
+        assert summary.pending_operation_count == 2
+        assert summary.get_balance(asset) == Decimal(5)
+
+        # State changes outside of event subscribers are picked up on flush
+        uop.crypto_operation.mark_failed("Smart contract rejected the transaction")
+        dbsession.flush()
+        assert UserWalletSummary.get_for_user(user).pending_operation_count == 1
+
+        # Rebuild repairs the summary
+        summary.pending_operation_count = 0
+        dbsession.flush()
+        UserWalletSummary.refresh_by_id(dbsession, user.id)
+        dbsession.refresh(summary)
+        assert summary.pending_operation_count == 1
+
+
+def test_operation_single_flush(dbsession, topped_up_user, eth_network_id, eth_asset_id):
+    """Deposit and withdraw are written with one flush when the transaction commits."""
+
+    for kind in ("deposit", "withdraw"):
+        with count_flushes(dbsession) as flushes:
+            with transaction.manager:
+                user = dbsession.query(User).first()
+                network = dbsession.query(AssetNetwork).get(eth_network_id)
+                asset = dbsession.query(Asset).get(eth_asset_id)
+                address = UserCryptoAddress.get_default(user, network)
+
+                if kind == "deposit":
+                    address.address.deposit(Decimal(1), asset, txid_to_bin(TEST_TXID), TEST_TXID)
+                else:
+                    address.withdraw(asset, Decimal(1), eth_address_to_bin(TEST_ADDRESS), "Foobar", 1)
+
+                assert flushes == [], "{} flushed before commit".format(kind)
+
+        assert len(flushes) == 1, kind
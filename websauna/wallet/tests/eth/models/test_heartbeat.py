@@ -2,6 +2,7 @@
 
 import transaction
 from websauna.wallet.models import AssetNetwork
+from websauna.wallet.models import CryptoNetworkStatus
 from websauna.wallet.models.heartbeat import update_heart_beat, is_network_alive, dump_network_heartbeat
 
 TEST_ADDRESS = "0x2f70d3d26829e412a602e83fe8eebf80255aeea5"
@@ -27,4 +28,19 @@ def test_dump_network_stats(dbsession, eth_network_id, eth_service):
 
     with transaction.manager:
         network = dbsession.query(AssetNetwork).get(eth_network_id)
-        dump_network_heartbeat(network)
\ No newline at end of file
+        dump_network_heartbeat(network)
+
+
+def test_heartbeat_cache(dbsession, eth_network_id, eth_service):
+    """Heartbeat is read from the database once per cache period."""
+
+    update_heart_beat(dbsession, eth_network_id, 555, 666)
+
+    with transaction.manager:
+        # Somebody else updates the status row
+        status = CryptoNetworkStatus.get_network_status(dbsession, eth_network_id)
+        status.data["heartbeat"]["block_number"] = 556
+
+    with transaction.manager:
+        assert CryptoNetworkStatus.get_heartbeat(dbsession, eth_network_id)["block_number"] == 555
+        assert CryptoNetworkStatus.get_heartbeat(dbsession, eth_network_id, max_age=0)["block_number"] == 556
@@ -0,0 +1,141 @@
+"""Operation queue priority lanes."""
+import transaction
+
+from websauna.tests.utils import create_user
+from websauna.wallet.ethereum.asset import setup_user_account
+from websauna.wallet.ethereum.dboperationqueue import get_configured_lanes
+from websauna.wallet.ethereum.utils import eth_address_to_bin
+from websauna.wallet.models import AssetNetwork, CryptoOperation, CryptoOperationState
+from websauna.wallet.models.blockchain import CryptoOperationType, import_token
+
+
+TOKEN_ADDRESS = "0x2f70d3d26829e412a602e83fe8eebf80255aeea5"
+
+
+def create_import_op(dbsession, eth_network_id):
+    with transaction.manager:
+        network = dbsession.query(AssetNetwork).get(eth_network_id)
+        op = import_token(network, eth_address_to_bin(TOKEN_ADDRESS))
+        dbsession.flush()
+        return op.id
+
+
+def create_users(dbsession, registry, count):
+    with transaction.manager:
+        for i in range(count):
+            user = create_user(dbsession, registry, email="lane{}@example.com".format(i))
+            setup_user_account(user, do_mainnet=True)
+
+
+def test_configure_lanes():
+    """Operation types can be moved between lanes and budgets changed."""
+
+    lanes = get_configured_lanes({
+        "ethereum.operation_lanes": "create_address:urgent",
+        "ethereum.operation_lane_budgets": "urgent:5 bulk:0",
+    })
+    lanes = {lane.name: lane for lane in lanes}
+
+    assert CryptoOperationType.create_address in lanes["urgent"].operation_types
+    assert CryptoOperationType.create_address not in lanes["normal"].operation_types
+    assert lanes["urgent"].budget == 5
+    assert lanes["bulk"].budget == 0
+
+
+def test_lane_budget(dbsession, registry, mock_eth_service, eth_network_id):
+    """Lanes give out operations in priority order and only as many as their budget has room next to operations in flight."""
+
+    import_opid = create_import_op(dbsession, eth_network_id)
+    create_users(dbsession, registry, 3)
+
+    op_queue_manager = mock_eth_service.op_queue_manager
+    lanes = {lane.name: lane for lane in op_queue_manager.lanes}
+    lanes["normal"].budget = 0
+
+    # The older bulk import comes out, address creations are held back
+    assert op_queue_manager.get_waiting_operation_ids() == [(import_opid, CryptoOperationType.import_token)]
+
+    lanes["normal"].budget = 2
+    op_types = [op_type for opid, op_type in op_queue_manager.get_waiting_operation_ids()]
+    assert op_types == [CryptoOperationType.create_address, CryptoOperationType.create_address, CryptoOperationType.import_token]
+
+    # One address creation is in flight, waiting for network confirmation
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).filter_by(network_id=eth_network_id, operation_type=CryptoOperationType.create_address).first()
+        op.mark_performed()
+        op.mark_broadcasted()
+
+    op_types = [op_type for opid, op_type in op_queue_manager.get_waiting_operation_ids()]
+    assert op_types == [CryptoOperationType.create_address, CryptoOperationType.import_token]
+
+    lanes["normal"].budget = 1
+    op_types = [op_type for opid, op_type in op_queue_manager.get_waiting_operation_ids()]
+    assert op_types == [CryptoOperationType.import_token]
+
+
+def test_lane_budget_limits_cycle(dbsession, registry, mock_eth_service, eth_network_id):
+    """Operations beyond lane budget wait until the ones in flight are confirmed."""
+
+    create_users(dbsession, registry, 3)
+
+    op_queue_manager = mock_eth_service.op_queue_manager
+    lanes = {lane.name: lane for lane in op_queue_manager.lanes}
+    lanes["normal"].budget = 2
+
+    def _broadcast_address(web3, dbsession, opid):
+        with transaction.manager:
+            op = dbsession.query(CryptoOperation).get(opid)
+            op.mark_performed()
+            op.mark_broadcasted()
+
+    op_queue_manager.get_eth_operations = lambda registry: {CryptoOperationType.create_address: _broadcast_address}
+    op_queue_manager.notify_op_performed = lambda opid: None
+
+    assert op_queue_manager.run_waiting_operations() == (2, 0)
+    assert op_queue_manager.run_waiting_operations() == (0, 0)
+
+    with transaction.manager:
+        states = [op.state for op in dbsession.query(CryptoOperation).filter_by(network_id=eth_network_id, operation_type=CryptoOperationType.create_address)]
+        assert states.count(CryptoOperationState.broadcasted) == 2
+        assert states.count(CryptoOperationState.waiting) == 1
+
+
+def test_bulk_yields_to_urgent(dbsession, registry, mock_eth_service, eth_network_id):
+    """Operation queued in a higher priority lane during a long import runs before the import continues."""
+
+    import_opid = create_import_op(dbsession, eth_network_id)
+
+    op_queue_manager = mock_eth_service.op_queue_manager
+    performed = []
+
+    def _import_token(web3, dbsession, opid, should_yield=None):
+        performed.append("import_token")
+        if len(performed) == 1:
+            # Address creation comes in while we are importing the first chunk
+            create_users(dbsession, registry, 1)
+            assert should_yield()
+            return
+
+        assert not should_yield()
+        with transaction.manager:
+            op = dbsession.query(CryptoOperation).get(opid)
+            op.mark_performed()
+            op.mark_broadcasted()
+            op.mark_complete()
+
+    def _create_address(web3, dbsession, opid):
+        performed.append("create_address")
+        with transaction.manager:
+            op = dbsession.query(CryptoOperation).get(opid)
+            op.mark_performed()
+            op.mark_broadcasted()
+            op.mark_complete()
+
+    op_queue_manager.get_eth_operations = lambda registry: {CryptoOperationType.import_token: _import_token, CryptoOperationType.create_address: _create_address}
+    op_queue_manager.notify_op_performed = lambda opid: None
+
+    assert op_queue_manager.run_waiting_operations() == (2, 0)
+    assert performed == ["import_token", "create_address", "import_token"]
+
+    with transaction.manager:
+        assert dbsession.query(CryptoOperation).get(import_opid).state == CryptoOperationState.success
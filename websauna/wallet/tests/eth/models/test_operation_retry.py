@@ -0,0 +1,68 @@
+"""Failed operations are retried with backoff."""
+from datetime import timedelta
+from unittest import mock
+
+import transaction
+
+from websauna.tests.utils import create_user
+from websauna.utils.time import now
+from websauna.wallet.ethereum.asset import setup_user_account
+from websauna.wallet.models import CryptoOperation, CryptoOperationState
+from websauna.wallet.models.blockchain import CryptoOperationType
+
+
+def _fail_create_address(service, dbsession, opid):
+    raise RuntimeError("Node is down")
+
+
+def test_failed_op_rescheduled(dbsession, registry, mock_eth_service, eth_network_id):
+    """Failure does not crash the queue and the op is not picked again until it is due."""
+
+    with transaction.manager:
+        user = create_user(dbsession, registry)
+        setup_user_account(user, do_mainnet=True)
+
+    with mock.patch("websauna.wallet.ethereum.ops.create_address", new=_fail_create_address):
+        success_count, failure_count = mock_eth_service.run_waiting_operations()
+
+    assert success_count == 0
+    assert failure_count == 1
+
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).filter_by(network_id=eth_network_id, operation_type=CryptoOperationType.create_address).one()
+        assert op.state == CryptoOperationState.waiting
+        assert op.attempts == 1
+        assert op.attempted_at
+        assert op.next_attempt_at > now()
+        assert op.other_data["error"] == "Node is down"
+
+    # Not due yet
+    with mock.patch("websauna.wallet.ethereum.ops.create_address", new=_fail_create_address):
+        assert mock_eth_service.run_waiting_operations() == (0, 0)
+
+
+def test_failed_op_dead_letter(dbsession, registry, mock_eth_service, eth_network_id):
+    """After too many attempts the operation is moved aside."""
+
+    with transaction.manager:
+        user = create_user(dbsession, registry)
+        setup_user_account(user, do_mainnet=True)
+
+    max_attempts = mock_eth_service.op_queue_manager.max_attempts
+
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).filter_by(network_id=eth_network_id, operation_type=CryptoOperationType.create_address).one()
+        op.attempts = max_attempts - 1
+        op.next_attempt_at = now() - timedelta(seconds=1)
+
+    with mock.patch("websauna.wallet.ethereum.ops.create_address", new=_fail_create_address):
+        assert mock_eth_service.run_waiting_operations() == (0, 1)
+
+    with transaction.manager:
+        op = dbsession.query(CryptoOperation).filter_by(network_id=eth_network_id, operation_type=CryptoOperationType.create_address).one()
+        assert op.state == CryptoOperationState.dead_letter
+        assert op.attempts == max_attempts
+        assert op.failed_at
+
+    with mock.patch("websauna.wallet.ethereum.ops.create_address", new=_fail_create_address):
+        assert mock_eth_service.run_waiting_operations() == (0, 0)
@@ -0,0 +1,78 @@
+"""Batched contract reads through Multicall."""
+import pytest
+
+from websauna.wallet.ethereum.contract import confirm_transaction
+from web3.exceptions import BadFunctionCallOutput
+
+from websauna.wallet.ethereum.contractwrapper import ContractWrapper
+from websauna.wallet.ethereum.multicall import Call, Multicall, decode_aggregate, split_by_gas, DEFAULT_CALL_GAS
+from websauna.wallet.ethereum.utils import uint256_to_bin
+
+
+@pytest.fixture(scope="module")
+def multicall(web3) -> Multicall:
+    return Multicall.create(web3)
+
+
+class FakeCall:
+
+    def __init__(self, gas, return_size=32):
+        self.gas = gas
+        self.return_size = return_size
+
+
+def test_split_by_gas():
+    """Calls are chunked so that every chunk fits in the gas limit."""
+    calls = [FakeCall(DEFAULT_CALL_GAS) for i in range(10)]
+    chunks = list(split_by_gas(calls, gas_limit=DEFAULT_CALL_GAS * 4))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+
+
+def test_decode_aggregate():
+    """Decode (uint256, bytes) return value and split it by reserved return sizes."""
+    data = uint256_to_bin(5) + uint256_to_bin(0x40) + uint256_to_bin(96)
+    data += uint256_to_bin(100) + uint256_to_bin(200) + uint256_to_bin(300)
+
+    block_number, results = decode_aggregate(data, [FakeCall(DEFAULT_CALL_GAS, 32), FakeCall(DEFAULT_CALL_GAS, 64)])
+    assert block_number == 5
+    assert results == [uint256_to_bin(100), uint256_to_bin(200) + uint256_to_bin(300)]
+
+    with pytest.raises(BadFunctionCallOutput):
+        decode_aggregate(data, [FakeCall(DEFAULT_CALL_GAS, 32)])
+
+
+@pytest.mark.slow
+def test_multicall_string_too_long(multicall, token):
+    """Strings longer than the reserved return size are not silently cut."""
+    with pytest.raises(BadFunctionCallOutput):
+        multicall.aggregate([Call(token.contract, "name", return_size=64 + 4)])
+
+
+@pytest.mark.slow
+def test_multicall_token_balances(web3, multicall, token, hosted_wallet, coinbase):
+    """Read many token balances in one call."""
+
+    txid = token.contract.transact().transfer(hosted_wallet.address, 4000)
+    confirm_transaction(web3, txid)
+
+    balances = multicall.get_token_balances(token.contract, [hosted_wallet.address, coinbase])
+    assert balances == [4000, 10000 - 4000]
+
+
+@pytest.mark.slow
+def test_multicall_token_details(multicall, token):
+    """Read token name, symbol and supply in one call."""
+    assert multicall.get_token_details(token.contract) == ("Mootoken", "MOO", 10000)
+
+
+@pytest.mark.slow
+def test_multicall_owners_and_eth_balances(web3, multicall, hosted_wallet, coinbase):
+    """Read hosted wallet owners and ETH balances."""
+    assert multicall.get_owners([hosted_wallet.contract]) == [coinbase]
+    assert multicall.get_eth_balances([hosted_wallet.address]) == [web3.eth.getBalance(hosted_wallet.address)]
+
+
+@pytest.mark.slow
+def test_multicall_get_balances(web3, multicall, hosted_wallet):
+    """ContractWrapper reads many balances through Multicall."""
+    assert ContractWrapper.get_balances([hosted_wallet], multicall=multicall) == ContractWrapper.get_balances([hosted_wallet])
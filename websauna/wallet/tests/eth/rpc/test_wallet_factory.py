@@ -0,0 +1,110 @@
+"""Minimal proxy wallet factory."""
+import uuid
+
+import pytest
+
+from websauna.wallet.ethereum.contract import confirm_transaction
+from websauna.wallet.ethereum.utils import get_create2_address
+from websauna.wallet.ethereum.wallet import HostedWallet
+from websauna.wallet.ethereum.walletfactory import WalletFactory, DeterministicWalletFactory, WalletFactoryError, uuid_to_salt, supports_create2
+from websauna.wallet.tests.eth.utils import send_balance_to_contract
+
+from decimal import Decimal
+
+
+@pytest.fixture(scope="module")
+def wallet_factory(web3) -> WalletFactory:
+    """Deploy wallet implementation and a factory for it."""
+    return WalletFactory.create_factory(web3)
+
+
+@pytest.fixture(scope="module")
+def deterministic_factory(web3, wallet_factory) -> DeterministicWalletFactory:
+    """CREATE2 factory sharing the implementation with the other factory."""
+    if not supports_create2(web3):
+        pytest.skip("Test chain does not support CREATE2")
+    return DeterministicWalletFactory.create_factory(web3, implementation=wallet_factory.implementation)
+
+
+def test_create2_address():
+    """Check against EIP-1014 test vectors."""
+    salt = b"\x00" * 32
+    assert get_create2_address("0x0000000000000000000000000000000000000000", salt, b"\x00") == "0x4d1a2e2bb4f88f0250f26ffff098b0b30b26bf38"
+    assert get_create2_address("0xdeadbeef00000000000000000000000000000000", salt, b"\x00") == "0xb928f69bb1d91cd65274e3c79d8986362984fda3"
+
+
+def test_create2_address_bound_to_sender():
+    """Factory salts are bound to the caller, so other accounts cannot deploy to our addresses."""
+    salt = b"\x01" * 32
+    deployer = "0xdeadbeef00000000000000000000000000000000"
+    ours = get_create2_address(deployer, salt, b"\x00", sender="0x1000000000000000000000000000000000000000")
+    theirs = get_create2_address(deployer, salt, b"\x00", sender="0x2000000000000000000000000000000000000000")
+    assert ours != theirs
+    assert ours != get_create2_address(deployer, salt, b"\x00")
+
+
+def test_uuid_to_salt():
+    """Salt is 32 bytes and stable."""
+    u = uuid.uuid4()
+    assert len(uuid_to_salt(u)) == 32
+    assert uuid_to_salt(u) == uuid_to_salt(u)
+
+
+@pytest.mark.slow
+def test_create_clone(web3, wallet_factory, coinbase):
+    """Deploy a clone and see it is owned by us."""
+
+    wallet = HostedWallet.create(web3, factory=wallet_factory)
+    assert wallet.address
+    assert wallet.contract.call().owner() == coinbase
+    assert wallet.contract.call().version() == "2.0"
+
+
+@pytest.mark.slow
+def test_create_many_clones(web3, wallet_factory):
+    """Deploy several clones in one transaction."""
+
+    wallets = HostedWallet.create_clones(web3, wallet_factory, count=5)
+    assert len(wallets) == 5
+    assert len(set(w.address for w in wallets)) == 5
+    assert len(set(w.initial_txid for w in wallets)) == 1
+
+
+@pytest.mark.slow
+def test_create_deterministic_clone(web3, deterministic_factory, coinbase):
+    """We know the wallet address before it is deployed."""
+
+    salt = uuid_to_salt(uuid.uuid4())
+    expected = deterministic_factory.compute_address(salt)
+    assert deterministic_factory.contract.call().computeAddress(coinbase, salt).lower() == expected
+    assert not deterministic_factory.is_deployed(expected)
+
+    wallet = HostedWallet.create(web3, factory=deterministic_factory, salt=salt)
+    assert wallet.address.lower() == expected
+    assert wallet.contract.call().owner() == coinbase
+    assert deterministic_factory.is_deployed(expected)
+
+
+@pytest.mark.slow
+def test_deterministic_salt_used_twice(web3, deterministic_factory):
+    """Deploying the same salt again fails cleanly, so retries can check is_deployed() instead."""
+
+    salt = uuid_to_salt(uuid.uuid4())
+    HostedWallet.create(web3, factory=deterministic_factory, salt=salt)
+
+    with pytest.raises(WalletFactoryError):
+        HostedWallet.create(web3, factory=deterministic_factory, salt=salt)
+
+
+@pytest.mark.slow
+def test_clone_withdraw(web3, wallet_factory, coinbase):
+    """Clone behaves like a full wallet."""
+
+    wallet = HostedWallet.create(web3, factory=wallet_factory)
+    txid = send_balance_to_contract(wallet, Decimal("0.01"))
+    confirm_transaction(web3, txid)
+    assert wallet.get_balance() == Decimal("0.01")
+
+    txid = wallet.withdraw(coinbase, Decimal("0.01"))
+    confirm_transaction(web3, txid)
+    assert wallet.get_balance() == 0
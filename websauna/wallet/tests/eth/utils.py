@@ -1,8 +1,10 @@
+from contextlib import contextmanager
 from typing import Tuple
 
 from decimal import Decimal
 from uuid import UUID
 
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 
 import transaction
@@ -187,3 +189,33 @@ def do_faux_withdraw(user_address: UserCryptoAddress, target_address, asset_id,
     return op
 
 
+@contextmanager
+def count_queries(dbsession: Session) -> list:
+    """Collect SQL statements executed on the session connection."""
+    statements = []
+    engine = dbsession.get_bind()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@contextmanager
+def count_flushes(dbsession: Session) -> list:
+    """Collect flushes of the session."""
+    flushes = []
+
+    def after_flush(session, flush_context):
+        if session is dbsession:
+            flushes.append(flush_context)
+
+    event.listen(Session, "after_flush", after_flush)
+    try:
+        yield flushes
+    finally:
+        event.remove(Session, "after_flush", after_flush)
@@ -0,0 +1,93 @@
+"""Concurrent transfers against the same accounts."""
+import threading
+from decimal import Decimal
+
+import transaction
+from sqlalchemy.exc import OperationalError
+from websauna.system.model.meta import create_dbsession
+from websauna.system.model.retry import retryable
+
+from websauna.wallet.models import Account, AccountTransaction, Asset, AssetClass, AssetNetwork
+from websauna.wallet.models.account import AccountLockTimeout, find_balance_drift, lock_stats
+
+
+THREADS = 8
+
+TRANSFERS_PER_THREAD = 10
+
+
+def test_concurrent_transfers(dbsession, registry):
+    """Transfers in both directions between two hot accounts from many threads do not deadlock or lose money."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        asset = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+        network.assets.append(asset)
+        dbsession.flush()
+
+        a = Account(asset=asset)
+        b = Account(asset=asset)
+        dbsession.add_all([a, b])
+        dbsession.flush()
+        a.do_withdraw_or_deposit(Decimal(1000), "Initial")
+        b.do_withdraw_or_deposit(Decimal(1000), "Initial")
+        a_id, b_id = a.id, b.id
+
+    lock_stats.reset()
+
+    # Committed transfers per direction
+    moved = {(a_id, b_id): 0, (b_id, a_id): 0}
+    moved_lock = threading.Lock()
+    errors = []
+
+    def worker(n):
+        tm = transaction.TransactionManager()
+        session = create_dbsession(registry, manager=tm)
+
+        @retryable(tm=tm)
+        def move(from_id, to_id):
+            from_ = session.query(Account).get(from_id)
+            to = session.query(Account).get(to_id)
+            Account.transfer(Decimal(1), from_, to, "Stress")
+
+        try:
+            for i in range(TRANSFERS_PER_THREAD):
+                # Opposite directions in every other transfer, which deadlocks without ordered locking
+                direction = (a_id, b_id) if (n + i) % 2 else (b_id, a_id)
+                try:
+                    move(*direction)
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                with moved_lock:
+                    moved[direction] += 1
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Under heavy contention some transfers may exhaust their retries, but never half way
+    assert len(errors) < THREADS * TRANSFERS_PER_THREAD / 2, errors
+
+    # Only contention may fail a transfer: 40001 serialization_failure, 40P01 deadlock_detected
+    for e in errors:
+        assert isinstance(e, AccountLockTimeout) or (isinstance(e, OperationalError) and e.orig.pgcode in ("40001", "40P01")), repr(e)
+
+    with transaction.manager:
+        a = dbsession.query(Account).get(a_id)
+        b = dbsession.query(Account).get(b_id)
+        assert a.get_balance() == 1000 - moved[(a_id, b_id)] + moved[(b_id, a_id)]
+        assert b.get_balance() == 1000 - moved[(b_id, a_id)] + moved[(a_id, b_id)]
+        assert dbsession.query(AccountTransaction).filter_by(message="Stress").count() == 2 * sum(moved.values())
+        assert find_balance_drift(dbsession)[0] == []
+
+    stats = lock_stats.as_dict()
+    assert stats["acquired"] >= sum(moved.values())
+    assert stats["retries"] <= stats["timeouts"] + stats["conflicts"]
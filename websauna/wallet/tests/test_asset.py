@@ -1,6 +1,19 @@
+from decimal import Decimal
+
+import colander
+import pytest
 import transaction
+from websauna.wallet.ethereum.utils import to_base_units, from_base_units
+from websauna.wallet.models import Account
+from websauna.wallet.models import Asset
 from websauna.wallet.models import AssetNetwork
 from websauna.wallet.models import AssetClass
+from websauna.wallet.models import AssetState
+from websauna.wallet.models import AssetLiability
+from websauna.wallet.models import LiabilityClass
+from websauna.wallet.models.account import verify_asset_liabilities
+from websauna.wallet.catalog import get_catalog
+from websauna.wallet.views.schemas import validate_withdraw_amount
 
 
 def test_get_or_create_network_asset(dbsession):
@@ -22,3 +35,214 @@ def test_get_or_create_network_asset(dbsession):
         asset, _ = network.get_or_create_asset_by_name("Footoken")
         assert asset.id == aid
 
+
+def test_base_units():
+    """Conversion to integer base units is exact."""
+    assert to_base_units(Decimal("1.5"), 18) == 1500000000000000000
+    assert from_base_units(1500000000000000000, 18) == Decimal("1.5")
+
+    # Beyond Numeric(60, 20) and default Decimal context precision
+    big = 2**256 - 1
+    assert to_base_units(from_base_units(big, 18), 18) == big
+
+    with pytest.raises(ValueError):
+        to_base_units(Decimal("0.1"), 0)
+
+    # ETH amounts are limited to wei, even if Numeric(60, 20) columns could store more
+    assert to_base_units(Decimal("0.100000000000000000000"), 18) == 10**17
+    with pytest.raises(ValueError):
+        to_base_units(Decimal("0.0000000000000000001"), 18)
+
+
+def test_withdraw_amount_precision():
+    """Withdraw form rejects amounts more precise than the asset base unit."""
+
+    asset = Asset(name="Ether", symbol="ETH", asset_class=AssetClass.ether, decimals=18)
+    account = Account(asset=asset, denormalized_balance=Decimal(1))
+    node = colander.SchemaNode(colander.Decimal())
+    validate = validate_withdraw_amount(node, {"account": account})
+
+    validate(node, Decimal("0.000000000000000001"))
+
+    with pytest.raises(colander.Invalid):
+        validate(node, Decimal("0.00000000000000000001"))
+
+
+def test_account_raw_balance(dbsession):
+    """Accounts of assets with decimals track balances in base units too."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        asset = Asset(name="Ether", symbol="ETH", asset_class=AssetClass.ether, supply=Decimal(100), decimals=18)
+        network.assets.append(asset)
+        a = Account(asset=asset)
+        b = Account(asset=asset)
+        dbsession.add_all([a, b])
+        dbsession.flush()
+
+        assert asset.supply_raw == 100 * 10**18
+
+        a.do_withdraw_or_deposit(Decimal("2.000000000000000001"), "Top up")
+        Account.transfer(Decimal("0.5"), a, b)
+        Account.post_batch(dbsession, [(a, b, Decimal("0.25"), "Batch")])
+
+        assert a.get_balance_raw() == 1250000000000000001
+        assert b.get_balance_raw() == 750000000000000000
+        assert a.transactions.filter_by(message="Top up").one().amount_raw == 2000000000000000001
+
+
+def test_liabilities(dbsession):
+    """Liability totals are per asset and per class."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        usd = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+        eur = Asset(name="Euro", symbol="EUR", asset_class=AssetClass.fiat)
+        network.assets.append(usd)
+        network.assets.append(eur)
+
+        user = Account(asset=usd)
+        holding = Account(asset=usd, liability_class=LiabilityClass.holding)
+        other = Account(asset=eur)
+        dbsession.add_all([user, holding, other])
+        dbsession.flush()
+
+        user.do_withdraw_or_deposit(Decimal(100), "Top up")
+        holding.do_withdraw_or_deposit(Decimal(20), "Deposit")
+        Account.transfer(Decimal(5), user, holding)
+        other.do_withdraw_or_deposit(Decimal(7), "Top up")
+
+        assert usd.get_liabilities() == {LiabilityClass.user: Decimal(95), LiabilityClass.holding: Decimal(25), LiabilityClass.house: Decimal(0)}
+        assert usd.get_local_liabilities() == Decimal(120)
+        assert eur.get_local_liabilities() == Decimal(7)
+
+        assert verify_asset_liabilities(dbsession) == []
+
+        # Break the totals and fix them
+        dbsession.query(AssetLiability).filter_by(asset_id=eur.id).delete()
+        assert verify_asset_liabilities(dbsession, rebuild=True) == [(eur.id, LiabilityClass.user, Decimal(0), Decimal(7))]
+        assert verify_asset_liabilities(dbsession) == []
+        assert eur.get_local_liabilities() == Decimal(7)
+
+
+def test_asset_slug(dbsession):
+    """Slug is stored and follows name changes unless set persistently."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        asset = Asset(name="Foo Token", symbol="FOO", asset_class=AssetClass.token)
+        network.assets.append(asset)
+        assert asset.slug == "foo-token"
+        dbsession.flush()
+
+        asset.name = "Bar Token"
+        dbsession.flush()
+        assert dbsession.query(Asset).filter_by(network=network, slug="bar-token").one() == asset
+
+        asset.other_data["slug"] = "bar"
+        dbsession.flush()
+        assert asset.slug == "bar"
+
+        asset.name = "Baz Token"
+        dbsession.flush()
+        assert asset.slug == "bar"
+
+
+def test_asset_slug_collision(dbsession):
+    """Names slugifying the same get numbered slugs, also within one flush."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        token = Asset(name="Token", symbol="TOK", asset_class=AssetClass.token)
+        network.assets.append(token)
+        dbsession.flush()
+
+        upper = Asset(name="TOKEN", symbol="TOK2", asset_class=AssetClass.token)
+        network.assets.append(upper)
+        dbsession.flush()
+        assert upper.slug == "token-2"
+
+        other = Asset(name="Token!", symbol="TOK3", asset_class=AssetClass.token)
+        another = Asset(name="token", symbol="TOK4", asset_class=AssetClass.token)
+        network.assets.append(other)
+        network.assets.append(another)
+        dbsession.flush()
+        assert {other.slug, another.slug} == {"token-3", "token-4"}
+
+        # Numbered slug stays when the first asset goes away
+        token.name = "Renamed"
+        dbsession.flush()
+        upper.symbol = "TOK5"
+        dbsession.flush()
+        assert upper.slug == "token-2"
+        assert dbsession.query(Asset).filter_by(network=network, slug="token-2").one() == upper
+
+
+def test_asset_catalog(dbsession):
+    """Catalog lists public assets in name order and follows committed changes."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        for name, symbol in (("Charlie", "CCC"), ("alpha", "AAA"), ("Bravo", "BBB")):
+            network.assets.append(Asset(name=name, symbol=symbol, asset_class=AssetClass.token))
+        network.assets.append(Asset(name="Hidden", symbol="HID", asset_class=AssetClass.token, state=AssetState.owner))
+
+    with transaction.manager:
+        catalog = get_catalog(dbsession)
+        names = [dbsession.query(Asset).get(e.asset_id).name for e in catalog.entries]
+        assert names == ["alpha", "Bravo", "Charlie"]
+
+        bravo = dbsession.query(Asset).filter_by(name="Bravo").one()
+        next, prev = catalog.get_neighbours(bravo.id)
+        assert dbsession.query(Asset).get(next.asset_id).name == "Charlie"
+        assert dbsession.query(Asset).get(prev.asset_id).name == "alpha"
+        assert [e.asset_id for e in catalog.get_page(2, 10)] == [next.asset_id]
+
+    with transaction.manager:
+        network = dbsession.query(AssetNetwork).one()
+        network.assets.append(Asset(name="Delta", symbol="DDD", asset_class=AssetClass.token))
+
+    with transaction.manager:
+        catalog = get_catalog(dbsession)
+        assert len(catalog) == 4
+
+
+def test_long_description_html(dbsession):
+    """Rendered long description is reused until the Markdown source changes."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        dbsession.flush()
+
+        asset = Asset(name="Foo Token", symbol="FOO", asset_class=AssetClass.token)
+        network.assets.append(asset)
+        asset.other_data = {"long_description": "*Foo*"}
+        assert asset.render_long_description() == "<p><em>Foo</em></p>"
+
+        asset.other_data["long_description_html"] = "cached"
+        assert asset.get_long_description_html() == "cached"
+
+        asset.other_data["long_description"] = "*Bar*"
+        dbsession.flush()
+        aid = asset.id
+
+    # Reading a stale description renders it without touching the asset
+    with transaction.manager:
+        asset = dbsession.query(Asset).get(aid)
+        assert asset.get_long_description_html() == "<p><em>Bar</em></p>"
+        assert asset.other_data["long_description_html"] == "cached"
+        assert asset not in dbsession.dirty
@@ -0,0 +1,79 @@
+"""Conditional GET and page caching of public pages."""
+from pyramid.response import Response
+
+from websauna.wallet.views.httpcache import MemoryPageCache, public_page
+
+
+def test_public_page_not_modified(test_request):
+    """Matching If-None-Match skips rendering and the page cache serves repeated requests."""
+
+    calls = []
+
+    def view(context, request):
+        calls.append(1)
+        return Response("Hello", content_type="text/html")
+
+    wrapped = public_page(lambda context, request: "v1")(view)
+    test_request.registry.wallet_page_cache = MemoryPageCache()
+
+    try:
+        response = wrapped(None, test_request)
+        assert response.status_code == 200
+        assert response.cache_control.public
+        etag = response.etag
+
+        response = wrapped(None, test_request)
+        assert response.body == b"Hello"
+        assert len(calls) == 1
+
+        test_request.if_none_match = etag
+        response = wrapped(None, test_request)
+        assert response.status_code == 304
+        assert len(calls) == 1
+    finally:
+        del test_request.registry.wallet_page_cache
+
+
+def test_memory_page_cache_bounded():
+    cache = MemoryPageCache(size=2)
+    for i in range(3):
+        cache.set(str(i), ("text/html", b"x"), ttl=60)
+    assert cache.get("0") is None
+    assert cache.get("2") == ("text/html", b"x")
+
+    cache.set("expired", ("text/html", b"x"), ttl=-1)
+    assert cache.get("expired") is None
+
+
+def test_public_page_cache_key(test_request):
+    """Only declared query parameters make a new page cache entry and flash messages skip the cache."""
+
+    calls = []
+
+    def view(context, request):
+        calls.append(1)
+        return Response("Hello", content_type="text/html")
+
+    wrapped = public_page(lambda context, request: "v1", params=("page", ))(view)
+    test_request.registry.wallet_page_cache = MemoryPageCache()
+
+    try:
+        wrapped(None, test_request)
+        assert len(calls) == 1
+
+        # Unknown parameters are served from the same entry
+        test_request.GET["utm_source"] = "spam"
+        wrapped(None, test_request)
+        assert len(calls) == 1
+
+        test_request.GET["page"] = "2"
+        wrapped(None, test_request)
+        assert len(calls) == 2
+
+        test_request.session.flash("Message for you")
+        response = wrapped(None, test_request)
+        assert len(calls) == 3
+        assert response.cache_control.private
+        assert not response.etag
+    finally:
+        del test_request.registry.wallet_page_cache
@@ -0,0 +1,53 @@
+"""Ledger integrity verifier."""
+from decimal import Decimal
+
+import transaction
+
+from websauna.wallet.ledgerverify import iter_account_ranges, verify_range
+from websauna.wallet.models import Account, Asset, AssetClass, AssetNetwork
+
+
+def create_accounts(dbsession, count=5):
+    network = AssetNetwork(name="Foo Bank")
+    dbsession.add(network)
+    dbsession.flush()
+
+    asset = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+    network.assets.append(asset)
+    accounts = [Account(asset=asset) for i in range(count)]
+    dbsession.add_all(accounts)
+    dbsession.flush()
+    return accounts
+
+
+def test_account_ranges(dbsession):
+    """Accounts are split to key ordered ranges."""
+
+    with transaction.manager:
+        accounts = create_accounts(dbsession)
+        ids = sorted(str(a.id) for a in accounts)
+
+        ranges = list(iter_account_ranges(dbsession.connection(), chunk_size=2))
+        assert ranges == [(ids[0], ids[1]), (ids[2], ids[3]), (ids[4], ids[4])]
+
+
+def test_verify_range(dbsession):
+    """Broken balances and counterparty links are reported."""
+
+    with transaction.manager:
+        a, b, c, d, e = create_accounts(dbsession)
+        a.do_withdraw_or_deposit(Decimal(100), "Top up")
+        _, deposit = Account.transfer(Decimal(10), a, b)
+        dbsession.flush()
+
+        ids = sorted(str(x.id) for x in (a, b, c, d, e))
+        assert verify_range(dbsession.connection(), ids[0], ids[-1]) == []
+
+        # Break things
+        c.denormalized_balance = Decimal(5)
+        deposit.counterparty = None
+        dbsession.flush()
+
+        problems = verify_range(dbsession.connection(), ids[0], ids[-1])
+        checks = sorted((p["check"], p["account_id"]) for p in problems)
+        assert checks == sorted([("balance", str(c.id)), ("counterparty", str(a.id))])
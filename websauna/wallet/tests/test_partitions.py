@@ -0,0 +1,85 @@
+"""Monthly account transaction partitions and archival."""
+import datetime
+from decimal import Decimal
+
+import transaction
+
+from websauna.utils.time import now
+from websauna.wallet.ledgerverify import verify_range
+from websauna.wallet.models import Account, AccountTransaction, Asset, AssetClass, AssetNetwork
+from websauna.wallet.models.account import find_balance_drift, get_archive_horizon, get_opening_checkpoint_time
+from websauna.wallet.partitions import ensure_partitions, list_partitions, create_partition, archive_partition, month_start, next_month, get_partition_name
+
+
+def create_account(dbsession):
+    network = AssetNetwork(name="Foo Bank")
+    dbsession.add(network)
+    dbsession.flush()
+
+    asset = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+    network.assets.append(asset)
+    account = Account(asset=asset)
+    dbsession.add(account)
+    dbsession.flush()
+    return account
+
+
+def test_ensure_partitions(dbsession):
+    """Rows in the default partition move to the monthly partition."""
+
+    with transaction.manager:
+        account = create_account(dbsession)
+        account.do_withdraw_or_deposit(Decimal(10), "Top up")
+        dbsession.flush()
+
+        created = ensure_partitions(dbsession, months_ahead=1)
+        this_month = month_start(now())
+        assert created == [get_partition_name(this_month), get_partition_name(next_month(this_month))]
+        assert [p[1] for p in list_partitions(dbsession)] == [this_month, next_month(this_month)]
+
+        name = get_partition_name(this_month)
+        assert dbsession.execute("SELECT count(*) FROM {}".format(name)).scalar() == 1
+        assert dbsession.execute("SELECT count(*) FROM account_transaction_default").scalar() == 0
+
+        # Nothing more to do
+        assert ensure_partitions(dbsession, months_ahead=1) == []
+        assert account.transactions.count() == 1
+
+
+def test_archive_partition(dbsession):
+    """Balances stay verifiable after old transactions have been detached."""
+
+    old_month = month_start(month_start(now()) - datetime.timedelta(days=1))
+
+    with transaction.manager:
+        account = create_account(dbsession)
+        account.do_withdraw_or_deposit(Decimal(10), "Top up")
+        dbsession.flush()
+        dbsession.query(AccountTransaction).update({"created_at": old_month + datetime.timedelta(days=1)})
+
+        account.do_withdraw_or_deposit(Decimal(5), "Top up")
+        dbsession.flush()
+        account_id = account.id
+
+        name = create_partition(dbsession, old_month)
+
+    try:
+        with transaction.manager:
+            archive = archive_partition(dbsession, name, old_month, next_month(old_month))
+            assert archive.transaction_count == 1
+
+        with transaction.manager:
+            account = dbsession.query(Account).get(account_id)
+            assert get_archive_horizon(dbsession) == next_month(old_month)
+            assert account.transactions.count() == 1
+            assert account.update_balance() == Decimal(15)
+            assert find_balance_drift(dbsession) == ([], account_id)
+            assert verify_range(dbsession.connection(), str(account_id), str(account_id)) == []
+
+            # Archived history is known only at checkpoints
+            assert account.get_balance_at(old_month + datetime.timedelta(days=2)) is None
+            assert account.get_balance_at(get_opening_checkpoint_time(next_month(old_month))) == Decimal(10)
+            assert Account.get_balances_at(dbsession, account.asset, old_month + datetime.timedelta(days=2)) == {account_id: None}
+    finally:
+        with transaction.manager:
+            dbsession.execute("DROP TABLE IF EXISTS {}".format(name))
@@ -1,14 +1,38 @@
+import datetime
+
 import pytest
 import transaction
 from decimal import Decimal
 
+from websauna.utils.time import now
+
 from websauna.tests.utils import create_user
 from websauna.tests.webserver import customized_web_server
 from websauna.wallet.models import AssetClass
+from websauna.wallet.models.account import AccountOverdrawn, IncompatibleAssets, find_balance_drift, create_balance_checkpoints
+from websauna.wallet.models.ids import uuid7
 
 from ..models import AssetNetwork
 from ..models import UserOwnedAccount
 from ..models import Asset
+from ..models import Account
+from ..models import AccountTransaction
+
+
+def create_user_account(dbsession, registry) -> UserOwnedAccount:
+    network = AssetNetwork(name="Foo Bank")
+    dbsession.add(network)
+    dbsession.flush()
+
+    asset = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+    network.assets.append(asset)
+    dbsession.flush()
+
+    user = create_user(dbsession, registry)
+    dbsession.flush()
+    oa = UserOwnedAccount.create_for_user(user=user, asset=asset)
+    dbsession.flush()
+    return oa
 
 
 def test_user_account_top_up(dbsession, registry):
@@ -31,3 +55,165 @@ def test_user_account_top_up(dbsession, registry):
 
         oa.account.do_withdraw_or_deposit(Decimal("+100"), "Topping up")
 
+
+def test_user_account_overdraw(dbsession, registry):
+    """Overdraw check happens in the balance update statement."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        oa.account.do_withdraw_or_deposit(Decimal("+100"), "Topping up")
+        oa.account.do_withdraw_or_deposit(Decimal("-60"), "Spending")
+        assert oa.account.get_balance() == Decimal(40)
+
+        with pytest.raises(AccountOverdrawn):
+            oa.account.do_withdraw_or_deposit(Decimal("-60"), "Spending")
+
+        assert oa.account.get_balance() == Decimal(40)
+
+
+def test_balance_drift(dbsession, registry):
+    """Reconciler finds accounts where cached balance does not match transactions."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        oa.account.do_withdraw_or_deposit(Decimal("+100"), "Topping up")
+        account_id = oa.account.id
+
+    with transaction.manager:
+        drift, last_id = find_balance_drift(dbsession)
+        assert drift == []
+        assert last_id
+
+    with transaction.manager:
+        oa = dbsession.query(UserOwnedAccount).first()
+        oa.account.denormalized_balance = Decimal(99)
+
+    with transaction.manager:
+        drift, last_id = find_balance_drift(dbsession)
+        assert drift == [(account_id, Decimal(99), Decimal(100))]
+
+        # Past the last account
+        assert find_balance_drift(dbsession, after_id=last_id) == ([], None)
+
+
+def test_post_batch(dbsession, registry):
+    """Post many transfers with one call."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        asset = oa.account.asset
+        house = Account(asset=asset)
+        users = [Account(asset=asset) for i in range(5)]
+        dbsession.add_all([house] + users)
+        dbsession.flush()
+
+        legs = [(None, house, Decimal(1000), "Initial")]
+        legs += [(house, u, Decimal(10 * (i + 1)), "Giveaway") for i, u in enumerate(users)]
+        posted = Account.post_batch(dbsession, legs)
+
+        assert len(posted) == 6
+        assert posted[0][0] is None
+        assert house.get_balance() == Decimal(1000 - 150)
+        assert [u.get_balance() for u in users] == [Decimal(10), Decimal(20), Decimal(30), Decimal(40), Decimal(50)]
+
+        withdraw_id, deposit_id = posted[1]
+        withdraw = dbsession.query(AccountTransaction).get(withdraw_id)
+        deposit = dbsession.query(AccountTransaction).get(deposit_id)
+        assert withdraw.account == house
+        assert withdraw.amount == Decimal(-10)
+        assert withdraw.counterparty == deposit
+        assert deposit.counterparty == withdraw
+
+        assert find_balance_drift(dbsession)[0] == []
+
+
+def test_post_batch_overdraw(dbsession, registry):
+    """Batch is rejected as a whole if any account would go negative."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        other = Account(asset=oa.account.asset)
+        third = Account(asset=oa.account.asset)
+        dbsession.add_all([other, third])
+        dbsession.flush()
+        Account.post_batch(dbsession, [(None, oa.account, Decimal(10), "Initial"), (None, third, Decimal(10), "Initial")])
+
+        with pytest.raises(AccountOverdrawn):
+            # Credits and the debit which fits come before the overdraw
+            Account.post_batch(dbsession, [(None, other, Decimal(1), "Bonus"), (third, other, Decimal(5), "Pay"), (oa.account, other, Decimal(6), "Pay"), (oa.account, other, Decimal(6), "Pay")])
+
+        account_ids = (oa.account.id, other.id, third.id)
+
+    # The caller caught the exception and committed
+    with transaction.manager:
+        balances = dict(dbsession.query(Account.id, Account.denormalized_balance).filter(Account.id.in_(account_ids)))
+        assert balances == {account_ids[0]: Decimal(10), account_ids[1]: Decimal(0), account_ids[2]: Decimal(10)}
+        assert dbsession.query(AccountTransaction).filter_by(account_id=account_ids[1]).count() == 0
+        assert find_balance_drift(dbsession)[0] == []
+
+
+def test_post_batch_incompatible_assets(dbsession, registry):
+    """All legs must be within one asset."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        asset = Asset(name="Euro", symbol="EUR", asset_class=AssetClass.fiat)
+        oa.account.asset.network.assets.append(asset)
+        other = Account(asset=asset)
+        dbsession.add(other)
+        dbsession.flush()
+
+        with pytest.raises(IncompatibleAssets):
+            Account.post_batch(dbsession, [(oa.account, other, Decimal(1), "Pay")])
+
+
+def test_balance_at(dbsession, registry):
+    """Point in time balances with and without checkpoints."""
+
+    with transaction.manager:
+        oa = create_user_account(dbsession, registry)
+        t1 = oa.account.do_withdraw_or_deposit(Decimal(100), "First")
+        t2 = oa.account.do_withdraw_or_deposit(Decimal(50), "Second")
+        dbsession.flush()
+
+        t1.created_at = now() - datetime.timedelta(days=3)
+        t2.created_at = now() - datetime.timedelta(days=1)
+        dbsession.flush()
+
+        account = oa.account
+        assert account.get_balance_at(now() - datetime.timedelta(days=4)) == 0
+        assert account.get_balance_at(now() - datetime.timedelta(days=2)) == 100
+        assert account.get_balance_at(now()) == 150
+
+        # Checkpoint covers the first transaction
+        create_balance_checkpoints(dbsession, now() - datetime.timedelta(days=2))
+        assert account.balance_checkpoints.one().balance == 100
+
+        # Second checkpoint builds on the first one
+        create_balance_checkpoints(dbsession, now() - datetime.timedelta(hours=1))
+        assert account.balance_checkpoints.count() == 2
+
+        assert account.get_balance_at(now() - datetime.timedelta(days=2, hours=12)) == 100
+        assert account.get_balance_at(now() - datetime.timedelta(hours=12)) == 150
+        assert account.get_balance_at(now()) == 150
+
+        assert Account.get_balances_at(dbsession, account.asset, now() - datetime.timedelta(days=2)) == {account.id: Decimal(100)}
+
+
+def test_client_side_ids(dbsession, registry):
+    """Ids are known before flush and sort by creation time."""
+
+    with transaction.manager:
+        network = AssetNetwork(name="Foo Bank")
+        dbsession.add(network)
+        asset = Asset(name="US Dollar", symbol="USD", asset_class=AssetClass.fiat)
+        network.assets.append(asset)
+        user = create_user(dbsession, registry)
+        oa, created = UserOwnedAccount.get_or_create_user_default_account(user, asset)
+        assert created
+        assert network.id and asset.id and oa.id and oa.account.id
+        assert oa.account.id.version == 7
+
+    earlier = uuid7(timestamp=1000)
+    later = uuid7(timestamp=1000.002)
+    assert earlier < later
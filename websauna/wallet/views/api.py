@@ -0,0 +1,194 @@
+"""JSON API of user wallets for mobile and single page app clients.
+
+Endpoints live in the same traversal as the wallet pages:
+
+* ``/wallet/{user}/wallet.json`` - balances, addresses, per asset totals and pending operation count in one request
+
+* ``/wallet/{user}/balances.json``
+
+* ``/wallet/{user}/addresses.json``
+
+* ``/wallet/{user}/transactions/operations.json?state=pending|finished&after={cursor}&limit={n}``
+
+* ``/wallet/{user}/transactions/{op}/operation.json``
+
+Rows are serialized from the same ``describe_*`` data as the pages, but no resource URLs are built for them. Clients can ask only the fields they need with ``fields=name,balance``.
+"""
+from typing import Iterable, Optional, Tuple
+from uuid import UUID
+
+from pyramid import httpexceptions
+from pyramid.view import view_config
+
+from websauna.system.http import Request
+from websauna.utils.slug import uuid_to_slug
+from websauna.wallet.ethereum.utils import bin_to_eth_address
+from websauna.wallet.views.decorators import wallet_api_view
+from websauna.wallet.views.wallet import UserWallet
+from websauna.wallet.views.wallet import UserOperation
+from websauna.wallet.views.wallet import UserOperationFolder
+from websauna.wallet.views.wallet import BadCursor
+from websauna.wallet.views.wallet import PENDING_OP_STATES
+from websauna.wallet.views.wallet import FINISHED_OP_STATES
+from websauna.wallet.views.wallet import OPERATIONS_PAGE_SIZE
+from websauna.wallet.views.wallet import MAX_OPERATIONS_PAGE_SIZE
+from websauna.wallet.views.wallet import describe_operation
+from websauna.wallet.views.wallet import preload_operations
+from websauna.wallet.views.wallet import load_wallet_overview
+
+
+BALANCE_FIELDS = ("asset_id", "name", "symbol", "type", "network", "address_id", "balance", "formatted_balance", "can_withdraw")
+
+ADDRESS_FIELDS = ("id", "name", "address", "network", "state")
+
+OPERATION_FIELDS = ("id", "type", "state", "state_label", "created_at", "completed_at", "network", "asset_symbol", "amount", "formatted_amount", "txid", "external_address", "deposit_like", "confirmations", "manual_confirmation_needed", "notes")
+
+OPERATION_STATES = {
+    "pending": PENDING_OP_STATES,
+    "finished": FINISHED_OP_STATES,
+}
+
+
+def get_fields(request: Request, available: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Read field selection from ``fields`` query parameter.
+
+    :raise HTTPBadRequest: If unknown fields are asked
+    """
+    fields = request.params.get("fields")
+    if not fields:
+        return available
+
+    fields = tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = set(fields) - set(available)
+    if unknown:
+        raise httpexceptions.HTTPBadRequest("Unknown fields: {}".format(", ".join(sorted(unknown))))
+    return fields
+
+
+def isoformat(dt) -> Optional[str]:
+    return dt.isoformat() if dt else None
+
+
+def serialize_balance(detail: dict, fields: Iterable[str]) -> dict:
+    """Serialize :func:`describe_user_address_asset` output."""
+    account = detail["account"]
+    asset = account.asset
+    data = {
+        "asset_id": uuid_to_slug(asset.id),
+        "name": detail["name"],
+        "symbol": asset.symbol,
+        "type": detail["type"],
+        "network": asset.network.name,
+        "address_id": uuid_to_slug(detail["address_resource"].address.id),
+        "balance": str(account.get_balance()),
+        "formatted_balance": detail["balance"],
+        "can_withdraw": detail["can_withdraw"],
+    }
+    return {f: data[f] for f in fields}
+
+
+def serialize_address(detail: dict, fields: Iterable[str]) -> dict:
+    """Serialize :func:`describe_address` output."""
+    crypto_address = detail["address"]
+    op = detail["op"]
+    data = {
+        "id": uuid_to_slug(detail["id"]),
+        "name": detail["name"],
+        "address": bin_to_eth_address(crypto_address.address) if crypto_address.address else None,
+        "network": crypto_address.network.name,
+        "state": op.state.name if op else None,
+    }
+    return {f: data[f] for f in fields}
+
+
+def serialize_operation(detail: dict, fields: Iterable[str]) -> dict:
+    """Serialize :func:`describe_operation` output."""
+    uop = detail["resource"]
+    op = detail["op"]
+    data = {
+        "id": uuid_to_slug(uop.uop.id),
+        "type": op.operation_type.name,
+        "state": op.state.name,
+        "state_label": detail["state"],
+        "created_at": isoformat(op.created_at),
+        "completed_at": isoformat(op.completed_at),
+        "network": op.network.name,
+        "asset_symbol": op.asset.symbol if op.asset else None,
+        "amount": str(detail["amount_value"]) if detail["amount_value"] is not None else None,
+        "formatted_amount": detail.get("amount"),
+        "txid": detail.get("txid"),
+        "external_address": detail.get("external_address"),
+        "deposit_like": detail["deposit_like"],
+        "confirmations": detail.get("confirmations"),
+        "manual_confirmation_needed": detail["manual_confirmation_needed"],
+        "notes": detail.get("notes"),
+    }
+    return {f: data[f] for f in fields}
+
+
+@view_config(context=UserWallet, route_name="wallet", name="wallet.json", renderer="json", permission="view")
+@wallet_api_view
+def wallet_json(wallet: UserWallet, request: Request):
+    """Everything wallet overview shows in one request. Use the list endpoints for field selection."""
+    asset_details, address_details = load_wallet_overview(wallet)
+    return {
+        "balances": [serialize_balance(d, BALANCE_FIELDS) for d in asset_details],
+        "addresses": [serialize_address(d, ADDRESS_FIELDS) for d in address_details],
+        "pending_operation_count": wallet.get_pending_operation_count(),
+        # Asset id -> balance over all addresses, from the wallet summary
+        "total_balances": {uuid_to_slug(UUID(asset_id)): balance for asset_id, balance in wallet.summary.balances.items()},
+    }
+
+
+@view_config(context=UserWallet, route_name="wallet", name="balances.json", renderer="json", permission="view")
+@wallet_api_view
+def balances_json(wallet: UserWallet, request: Request):
+    fields = get_fields(request, BALANCE_FIELDS)
+    asset_details, address_details = load_wallet_overview(wallet)
+    return {"balances": [serialize_balance(d, fields) for d in asset_details]}
+
+
+@view_config(context=UserWallet, route_name="wallet", name="addresses.json", renderer="json", permission="view")
+@wallet_api_view
+def addresses_json(wallet: UserWallet, request: Request):
+    fields = get_fields(request, ADDRESS_FIELDS)
+    asset_details, address_details = load_wallet_overview(wallet)
+    return {"addresses": [serialize_address(d, fields) for d in address_details]}
+
+
+@view_config(context=UserOperationFolder, route_name="wallet", name="operations.json", renderer="json", permission="view")
+@wallet_api_view
+def operations_json(op_root: UserOperationFolder, request: Request):
+    """One page of transaction history.
+
+    Pass ``next`` of the response as ``after`` to get the next page. ``next`` is null on the last page.
+    """
+    fields = get_fields(request, OPERATION_FIELDS)
+
+    state = OPERATION_STATES.get(request.params.get("state", "pending"))
+    if not state:
+        raise httpexceptions.HTTPBadRequest("Bad state")
+
+    try:
+        limit = int(request.params.get("limit", OPERATIONS_PAGE_SIZE))
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest("Bad limit")
+    limit = max(1, min(limit, MAX_OPERATIONS_PAGE_SIZE))
+
+    try:
+        ops, cursor = op_root.get_operations_page(state, after=request.params.get("after"), limit=limit)
+    except BadCursor:
+        raise httpexceptions.HTTPBadRequest("Bad cursor")
+
+    preload_operations(request, ops)
+    return {
+        "operations": [serialize_operation(describe_operation(request, uop, resources=False), fields) for uop in ops],
+        "next": cursor,
+    }
+
+
+@view_config(context=UserOperation, route_name="wallet", name="operation.json", renderer="json", permission="view")
+@wallet_api_view
+def operation_json(uop: UserOperation, request: Request):
+    fields = get_fields(request, OPERATION_FIELDS)
+    return serialize_operation(describe_operation(request, uop, resources=False), fields)
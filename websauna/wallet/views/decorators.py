@@ -44,3 +44,25 @@ def wallet_view(func):
 
     return inner
 
+
+def wallet_api_view(func):
+    """Decorates a JSON view of a wallet.
+
+    Same checks as :func:`wallet_view`, but API clients get an error instead of being redirected to a HTML page.
+    """
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        context, request = args
+        user = request.user
+
+        if not user:
+            raise httpexceptions.HTTPForbidden("Please sign in")
+
+        if request.registry.settings.get("websauna.wallet.require_phone_number"):
+            if not UserNewPhoneNumberConfirmation.has_confirmed_phone_number(user):
+                raise httpexceptions.HTTPForbidden("Phone number confirmation required")
+
+        return func(*args, **kwargs)
+
+    return inner
@@ -0,0 +1,174 @@
+"""HTTP caching of public blockchain pages.
+
+Pages under ``/blockchain`` change only when assets or networks are edited, or when the network heartbeat moves. Views decorated with :func:`public_page` get an ``ETag`` calculated from these, answer ``If-None-Match`` with 304 without rendering and set ``Cache-Control``, so that browsers, a CDN or a reverse proxy can absorb traffic.
+
+Rendered pages of anonymous visitors can also be cached on the server. Set ``websauna.wallet.page_cache`` to ``memory`` (per process) or ``redis`` (shared). Cached pages are keyed by the ETag, so they go stale with it, and by the query parameters the view declares, so that arbitrary query strings cannot fill the cache. Pages rendered while the session has flash messages are never cached.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.registry import Registry
+from pyramid.response import Response
+
+from websauna.system.core.redis import get_redis
+from websauna.system.http import Request
+
+
+#: How long anonymous visitors, CDNs and proxies may use a page without revalidating, seconds
+PUBLIC_PAGE_MAX_AGE = 60
+
+#: How long rendered pages are kept in the page cache, seconds
+PAGE_CACHE_SECONDS = 300
+
+#: Max pages kept in the memory page cache of one process
+MEMORY_PAGE_CACHE_SIZE = 1000
+
+
+class MemoryPageCache:
+    """Least recently used page cache inside the process."""
+
+    def __init__(self, size: int=MEMORY_PAGE_CACHE_SIZE):
+        self.size = size
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        with self.lock:
+            item = self.pages.get(key)
+            if not item:
+                return None
+
+            expires, page = item
+            if expires < time.monotonic():
+                del self.pages[key]
+                return None
+
+            self.pages.move_to_end(key)
+            return page
+
+    def set(self, key: str, page: Tuple[str, bytes], ttl: int):
+        with self.lock:
+            self.pages[key] = (time.monotonic() + ttl, page)
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+
+
+class RedisPageCache:
+    """Page cache shared by all processes."""
+
+    def __init__(self, registry: Registry):
+        self.registry = registry
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        redis = get_redis(self.registry)
+        content_type, body = redis.hmget(key, "content_type", "body")
+        if body is None:
+            return None
+        return content_type.decode("utf-8"), body
+
+    def set(self, key: str, page: Tuple[str, bytes], ttl: int):
+        redis = get_redis(self.registry)
+        pipe = redis.pipeline()
+        pipe.hmset(key, {"content_type": page[0], "body": page[1]})
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+
+def get_page_cache(registry: Registry):
+    """Get the configured page cache or None if page caching is off."""
+    cache = getattr(registry, "wallet_page_cache", None)
+    if cache is not None:
+        return cache or None
+
+    kind = registry.settings.get("websauna.wallet.page_cache")
+    if kind == "memory":
+        cache = MemoryPageCache()
+    elif kind == "redis":
+        cache = RedisPageCache(registry)
+    elif kind:
+        raise RuntimeError("Unknown websauna.wallet.page_cache: {}".format(kind))
+    else:
+        cache = False
+
+    registry.wallet_page_cache = cache
+    return cache or None
+
+
+def set_cache_headers(request: Request, response: Response, etag: str, anonymous: bool):
+    response.etag = etag
+    if anonymous:
+        response.cache_control.public = True
+        response.cache_control.max_age = PUBLIC_PAGE_MAX_AGE
+    else:
+        # Page has personal navigation, let the browser revalidate
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.vary = ("Cookie", )
+
+
+def has_flash_messages(request: Request) -> bool:
+    """Does the page show flash messages, which differ per visitor and are consumed when rendered."""
+    # Pyramid sessions keep flash queues in ``_f_{queue}`` keys
+    return any(key.startswith("_f_") and request.session[key] for key in request.session)
+
+
+def get_page_key(request: Request, etag: str, params: Iterable[str]) -> str:
+    """Page cache key from the path and the query parameters the view uses, ignoring others."""
+    query = "&".join("{}={}".format(name, request.GET[name]) for name in sorted(params) if name in request.GET)
+    return "wallet-page:{}:{}?{}".format(etag, request.path, query)
+
+
+def public_page(validator: Callable[[object, Request], str], params: Iterable[str]=()):
+    """Pyramid view ``decorator`` adding conditional GET and caching to a public page.
+
+    :param validator: Callable (context, request) returning a string which changes when the page content changes
+
+    :param params: Query parameters the view reads. Pages are cached per their values.
+    """
+
+    def decorator(view):
+
+        def wrapper(context, request):
+            if has_flash_messages(request):
+                # Render the messages and do not let anybody cache the page
+                response = view(context, request)
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+
+            anonymous = request.user is None
+            audience = "anonymous" if anonymous else "user:{}".format(request.user.id)
+            etag = hashlib.md5("{}:{}".format(validator(context, request), audience).encode("utf-8")).hexdigest()
+
+            if etag in request.if_none_match:
+                response = HTTPNotModified()
+                set_cache_headers(request, response, etag, anonymous)
+                return response
+
+            cache = get_page_cache(request.registry) if anonymous and request.method == "GET" else None
+            key = get_page_key(request, etag, params)
+
+            if cache:
+                page = cache.get(key)
+                if page:
+                    response = Response(body=page[1], content_type=page[0], charset=None)
+                    set_cache_headers(request, response, etag, anonymous)
+                    return response
+
+            response = view(context, request)
+            if response.status_code != 200:
+                return response
+
+            set_cache_headers(request, response, etag, anonymous)
+            if cache:
+                cache.set(key, (response.headers["Content-Type"], response.body), PAGE_CACHE_SECONDS)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -4,9 +4,9 @@ from uuid import UUID
 from pyramid import httpexceptions
 from pyramid.security import Allow
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 
 import arrow
-import markdown
 from jinja2.exceptions import TemplateNotFound
 from pyramid.renderers import render
 from pyramid.view import view_config
@@ -26,9 +26,16 @@ from websauna.system.core.breadcrumbs import get_breadcrumbs
 
 from websauna.wallet.models import Asset
 from websauna.wallet.utils import format_asset_amount
+from websauna.wallet.views.requestcache import memoize_for_request
+from websauna.wallet.views.httpcache import public_page
+from websauna.wallet.catalog import CatalogEntry, get_catalog
 from zope.interface import implementer
 
 
+#: How many assets all assets listing shows per page
+ALL_ASSETS_PAGE_SIZE = 100
+
+
 class AssetDescription(Resource):
 
     def __init__(self, request: Request, asset: Asset):
@@ -76,9 +83,9 @@ class AssetFolder(Resource):
 
     def __getitem__(self, slug: str) -> AssetDescription:
 
-        for asset in self.request.dbsession.query(Asset).filter(Asset.network_id==self.get_network().id):
-            if asset.slug == slug:
-                return self.get_description(asset)
+        asset = self.request.dbsession.query(Asset).filter_by(network_id=self.get_network().id, slug=slug).one_or_none()
+        if asset:
+            return self.get_description(asset)
 
         raise KeyError()
 
@@ -171,42 +178,59 @@ class NetworkFolder(Resource):
             if network.other_data.get("visible", True) and asset_count > 0:
                 yield self.get_description(network, asset_count=asset_count)
 
-    def get_all_public_assets(self):
-        assets = []
-        networks = self.get_public_networks()
-        for network in networks:
-            assets += network["assets"].get_public_assets()
+    def describe_catalog_entries(self, entries: List[CatalogEntry]) -> List[AssetDescription]:
+        """Load assets of catalog entries in one query, keeping the order."""
+        ids = [e.asset_id for e in entries]
+        if not ids:
+            return []
+
+        assets = self.request.dbsession.query(Asset).filter(Asset.id.in_(ids)).options(joinedload(Asset.network))
+        assets = {asset.id: asset for asset in assets}
+        return [get_asset_resource(self.request, assets[asset_id]) for asset_id in ids if asset_id in assets]
+
+    def get_all_public_assets(self) -> List[AssetDescription]:
+        """All public assets of all networks in name order."""
+        catalog = get_catalog(self.request.dbsession)
+        return self.describe_catalog_entries(catalog.entries)
 
-        assets = sorted(assets, key=lambda asset: asset.get_title().lower())
-        return assets
+    def get_public_assets_page(self, page: int, page_size: int=ALL_ASSETS_PAGE_SIZE) -> Tuple[List[AssetDescription], int]:
+        """One page of all public assets in name order.
+
+        :param page: Zero based page number
+        :return: Tuple (assets, total number of pages)
+        """
+        catalog = get_catalog(self.request.dbsession)
+        page_count = max(1, (len(catalog) + page_size - 1) // page_size)
+        return self.describe_catalog_entries(catalog.get_page(page * page_size, page_size)), page_count
 
     def get_next_prev_asset(self, asset: Asset) -> Tuple[Optional[AssetDescription], Optional[AssetDescription]]:
         """Get next/prev navigation in public site listing.
 
         """
-        assets = self.get_all_public_assets()
+        catalog = get_catalog(self.request.dbsession)
+        next, prev = catalog.get_neighbours(asset.id)
+        described = {d.asset.id: d for d in self.describe_catalog_entries([e for e in (next, prev) if e])}
+        return (next and described.get(next.asset_id), prev and described.get(prev.asset_id))
 
-        for idx, a in enumerate(assets):
-            if a.asset == asset:
-                break
-        else:
-            return (None, None)
 
-        if idx > 0:
-            prev = assets[idx-1]
-        else:
-            prev = None
+def catalog_validator(context, request) -> str:
+    """Public listings change only when the asset catalog does."""
+    return get_catalog(request.dbsession).version
 
-        try:
-            next = assets[idx+1]
-        except IndexError:
-            next = None
 
-        return (next, prev)
+def asset_validator(asset_desc: AssetDescription, request) -> str:
+    """Asset page shows the asset and its neighbours in the catalog."""
+    asset = asset_desc.asset
+    return "{}:{}:{}".format(catalog_validator(asset_desc, request), asset.id, asset.updated_at or asset.created_at)
 
 
+def network_validator(network_desc: NetworkDescription, request) -> str:
+    """Network page shows the latest heartbeat."""
+    heartbeat = CryptoNetworkStatus.get_heartbeat(request.dbsession, network_desc.network.id)
+    return "{}:{}".format(catalog_validator(network_desc, request), heartbeat.get("timestamp"))
 
-@view_config(context=AssetFolder, route_name="network", name="", renderer="network/assets.html")
+
+@view_config(context=AssetFolder, route_name="network", name="", renderer="network/assets.html", decorator=public_page(catalog_validator))
 def asset_root(asset_folder, request):
     assets = asset_folder.get_public_assets()
     network_desc = asset_folder.__parent__
@@ -214,45 +238,48 @@ def asset_root(asset_folder, request):
     return locals()
 
 
-@view_config(context=AssetDescription, route_name="network", name="", renderer="network/asset.html")
+@view_config(context=AssetDescription, route_name="network", name="", renderer="network/asset.html", decorator=public_page(asset_validator))
 def asset(asset_desc: AssetDescription, request: Request):
     breadcrumbs = get_breadcrumbs(asset_desc, request)
 
-    long_description = asset_desc.asset.other_data.get("long_description", "")
-    if long_description:
-        long_description = markdown.markdown(long_description)
+    long_description = asset_desc.asset.get_long_description_html()
 
     return locals()
 
 
-@view_config(context=NetworkFolder, route_name="network", name="", renderer="network/networks.html")
+@view_config(context=NetworkFolder, route_name="network", name="", renderer="network/networks.html", decorator=public_page(catalog_validator))
 def network_root(network_folder, request):
     networks = network_folder.get_public_networks()
     breadcrumbs = get_breadcrumbs(network_folder, request)
     return locals()
 
 
-@view_config(context=NetworkFolder, route_name="network", name="all-assets", renderer="network/all_assets.html")
+@view_config(context=NetworkFolder, route_name="network", name="all-assets", renderer="network/all_assets.html", decorator=public_page(catalog_validator, params=("page", )))
 def all_assets(network_folder: NetworkFolder, request):
-    assets = network_folder.get_all_public_assets()
+    try:
+        page = max(0, int(request.params.get("page", 0)))
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest("Bad page")
+
+    assets, page_count = network_folder.get_public_assets_page(page)
+
+    prev_page_url = request.resource_url(network_folder, "all-assets", query={"page": page - 1}) if page > 0 else None
+    next_page_url = request.resource_url(network_folder, "all-assets", query={"page": page + 1}) if page + 1 < page_count else None
 
     breadcrumbs = get_breadcrumbs(network_folder, request, current_view_name="All digital assets", current_view_url=request.resource_url(network_folder, "all-assets"))
 
     return locals()
 
 
-@view_config(context=NetworkDescription, route_name="network", name="", renderer="network/network.html")
+@view_config(context=NetworkDescription, route_name="network", name="", renderer="network/network.html", decorator=public_page(network_validator))
 def network(network_desc: NetworkDescription, request: Request):
 
     network = network_desc.network
 
     timestamp = ""
-    status = request.dbsession.query(CryptoNetworkStatus).get(network.id)
-
-    if status:
-        heartbeat = status.data.get("heartbeat")
-        if heartbeat:
-            timestamp = arrow.get(status.data["heartbeat"]["timestamp"]).datetime
+    heartbeat = CryptoNetworkStatus.get_heartbeat(request.dbsession, network.id)
+    if heartbeat:
+        timestamp = arrow.get(heartbeat["timestamp"]).datetime
 
     try:
         network_text = render("network/{}.html".format(network.name), {}, request=request)
@@ -270,9 +297,14 @@ def route_factory(request):
     return Resource.make_lineage(root, folder, "blockchain")
 
 
+def get_network_folder(request) -> NetworkFolder:
+    """Get the root of network resources, shared within the request."""
+    return memoize_for_request(request, "network_folder", None, lambda: route_factory(request))
+
+
 def get_network_resource(request, network: AssetNetwork) -> NetworkDescription:
-    folder = route_factory(request)
-    return folder.get_description(network)
+    folder = get_network_folder(request)
+    return memoize_for_request(request, "network_resource", network.id, lambda: folder.get_description(network))
 
 
 def get_asset_resource(request, asset: Asset) -> AssetDescription:
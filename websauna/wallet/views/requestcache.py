@@ -0,0 +1,36 @@
+"""Per request memoization of traversal resources.
+
+Listings resolve the same wallet, address, account and network resources for every row they render. Resolving them again is a database query or several per row. Here the resolved resources live as long as the request does, so a page costs the same number of lookups no matter how many rows it has.
+
+Resources are request bound objects already, so caching them for the request lifetime does not change what the views see.
+"""
+from typing import Any, Callable, Hashable
+
+from websauna.system.http import Request
+
+
+#: Attribute on request where caches are stored
+REQUEST_ATTRIBUTE = "_wallet_resource_cache"
+
+
+def get_request_cache(request: Request, namespace: str) -> dict:
+    """Get a memo dictionary which lives as long as the request.
+
+    :param namespace: Name of the cache, so that different kinds of lookups do not mix their keys
+    """
+    caches = getattr(request, REQUEST_ATTRIBUTE, None)
+    if caches is None:
+        caches = {}
+        setattr(request, REQUEST_ATTRIBUTE, caches)
+    return caches.setdefault(namespace, {})
+
+
+def memoize_for_request(request: Request, namespace: str, key: Hashable, factory: Callable[[], Any]) -> Any:
+    """Return cached value for the key or create it with ``factory()``.
+
+    ``None`` results are cached too.
+    """
+    cache = get_request_cache(request, namespace)
+    if key not in cache:
+        cache[key] = factory()
+    return cache[key]
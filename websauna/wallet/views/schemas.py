@@ -68,6 +68,14 @@ def validate_withdraw_amount(node, bind_kw):
         if value > account.get_balance():
             raise colander.Invalid(node, "The account holds balance of {}".format(account.get_balance()))
 
+        asset = account.asset
+        if asset.decimals is not None:
+            # Balances are kept in integer base units, e.g. wei
+            try:
+                asset.to_raw(value)
+            except ValueError:
+                raise colander.Invalid(node, "{} allows at most {} decimal places.".format(asset.symbol or asset.name, asset.decimals))
+
     return validate
 
 
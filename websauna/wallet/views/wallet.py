@@ -1,10 +1,14 @@
-from typing import List, Iterable
+import datetime
+from typing import List, Iterable, Tuple, Optional
 
 from decimal import Decimal
+from uuid import UUID
 from pyramid import httpexceptions
 from pyramid.decorator import reify
 from pyramid.security import Allow
 from pyramid.view import view_config
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
 
 from websauna.system.core.breadcrumbs import get_breadcrumbs
 from websauna.system.core.root import Root
@@ -21,12 +25,16 @@ from websauna.wallet.models import CryptoOperationState
 from websauna.wallet.models import CryptoOperation
 from websauna.wallet.models import CryptoAddress
 from websauna.wallet.models import Account
+from websauna.wallet.models import AccountTransaction
 from websauna.wallet.models import Asset
 from websauna.wallet.models import CryptoAddressAccount
-from websauna.wallet.models.blockchain import CryptoOperationType
+from websauna.wallet.models import CryptoAddressCreation
+from websauna.wallet.models import UserWalletSummary
+from websauna.wallet.models.blockchain import CryptoOperationType, PENDING_OPERATION_STATES
 from websauna.wallet.utils import format_asset_amount
 from websauna.wallet.views.decorators import wallet_view
 from websauna.wallet.views.network import get_network_resource
+from websauna.wallet.views.requestcache import get_request_cache, memoize_for_request
 
 
 OP_STATES = {
@@ -37,8 +45,47 @@ OP_STATES = {
     CryptoOperationState.success: "Success",
     CryptoOperationState.failed: "Failure",
     CryptoOperationState.cancelled: "Cancelled",
+    CryptoOperationState.dead_letter: "Delayed, waiting for manual intervention",
 }
 
+#: How many operations transaction history shows per page
+OPERATIONS_PAGE_SIZE = 50
+
+#: Upper limit for page size asked in query string
+MAX_OPERATIONS_PAGE_SIZE = 200
+
+PENDING_OP_STATES = PENDING_OPERATION_STATES
+
+FINISHED_OP_STATES = (CryptoOperationState.success, CryptoOperationState.failed)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class BadCursor(Exception):
+    """Page cursor given by the client cannot be decoded."""
+
+
+def encode_operation_cursor(op: CryptoOperation) -> str:
+    """Opaque page cursor pointing after an operation in transaction history.
+
+    History is ordered by ``(created_at, id)``, so the cursor stays valid when new operations arrive.
+    """
+    micros = (op.created_at - EPOCH) // datetime.timedelta(microseconds=1)
+    return "{}-{}".format(micros, uuid_to_slug(op.id))
+
+
+def decode_operation_cursor(cursor: str) -> Tuple[datetime.datetime, UUID]:
+    """Parse page cursor to (created_at, id).
+
+    :raise BadCursor: If the cursor was not produced by :func:`encode_operation_cursor`
+    """
+    try:
+        micros, slug = cursor.split("-", 1)
+        created_at = EPOCH + datetime.timedelta(microseconds=int(micros))
+        return created_at, slug_to_uuid(slug)
+    except (ValueError, OverflowError, SlugDecodeError) as e:
+        raise BadCursor("Bad cursor {}".format(cursor)) from e
+
 
 class UserAddressAsset(Resource):
     """Asset in user wallet.
@@ -183,11 +230,14 @@ class UserAddressFolder(Resource):
     def get_title(self):
         return "Accounts"
 
+    def get_address_resource(self, addr: UserCryptoAddress) -> UserAddress:
+        ua = UserAddress(self.request, addr)
+        return Resource.make_lineage(self, ua, uuid_to_slug(addr.id))
+
     def get_addresses(self):
         addresses = self.user.owned_crypto_addresses
         for addr in addresses:
-            ua = UserAddress(self.request, addr)
-            yield Resource.make_lineage(self, ua, uuid_to_slug(addr.id))
+            yield self.get_address_resource(addr)
 
     def __getitem__(self, item):
         uuid = slug_to_uuid(item)
@@ -207,14 +257,42 @@ class UserOperationFolder(Resource):
     def get_title(self):
         return "Transactions"
 
-    def get_operations(self, state: Iterable):
+    def get_operations(self, state: Iterable, after: str=None, limit: int=None) -> Iterable[UserOperation]:
+        """Iterate user operations, newest first.
+
+        :param after: Cursor from :func:`encode_operation_cursor`. Only operations older than the cursor are returned.
+        :param limit: Max number of operations
+        :raise BadCursor: If ``after`` cannot be decoded
+        """
 
         ops = self.wallet.user.owned_crypto_operations.join(CryptoOperation).filter(CryptoOperation.state.in_(state)).order_by(
-            CryptoOperation.created_at.desc())
+            CryptoOperation.created_at.desc(), CryptoOperation.id.desc())
+
+        if after:
+            created_at, id = decode_operation_cursor(after)
+            ops = ops.filter(or_(CryptoOperation.created_at < created_at, and_(CryptoOperation.created_at == created_at, CryptoOperation.id < id)))
+
+        if limit:
+            ops = ops.limit(limit)
+
+        # Operation rows and their networks come in the same query, other row resources are resolved through the request cache
+        ops = ops.options(contains_eager(UserCryptoOperation.crypto_operation).joinedload(CryptoOperation.network))
         for op in ops:
             uo = UserOperation(self.request, op)
             yield Resource.make_lineage(self, uo, uuid_to_slug(op.id))
 
+    def get_operations_page(self, state: Iterable, after: str=None, limit: int=OPERATIONS_PAGE_SIZE) -> Tuple[List[UserOperation], Optional[str]]:
+        """Get one page of transaction history.
+
+        :return: Tuple (operations, cursor for the next page or None if this was the last page)
+        """
+        # Peek one more row to see if there is a next page
+        ops = list(self.get_operations(state, after=after, limit=limit + 1))
+        if len(ops) > limit:
+            ops = ops[0:limit]
+            return ops, encode_operation_cursor(ops[-1].op)
+        return ops, None
+
     def __getitem__(self, item):
         uuid = slug_to_uuid(item)
         uop = self.request.dbsession.query(UserCryptoOperation).get(uuid)
@@ -234,7 +312,7 @@ class UserWallet(Resource):
     @reify
     def __acl__(self) -> List[tuple]:
         """Besides users themselves, we allow admins to view user wallets to troubleshoot issues."""
-        owner_principal = "user:{}".format(self.request.user.id)
+        owner_principal = "user:{}".format(self.user.id)
         return [(Allow, owner_principal, "view"),
                 (Allow, "group:admin", "view")]
 
@@ -260,15 +338,17 @@ class UserWallet(Resource):
 
         raise KeyError()
 
+    @reify
+    def summary(self) -> UserWalletSummary:
+        return UserWalletSummary.get_for_user(self.user)
+
     def get_pending_operation_count(self):
         """Used to render the pending op number in wallet nav."""
-        state = (CryptoOperationState.waiting, CryptoOperationState.confirmation_required, CryptoOperationState.broadcasted, CryptoOperationState.pending)
-        ops = self.user.owned_crypto_operations.join(CryptoOperation).filter(CryptoOperation.state.in_(state))
-        return ops.count()
+        return self.summary.pending_operation_count
 
     def get_address_resource(self, address: UserCryptoAddress) -> UserAddress:
         assert address.user == self.user
-        return self["accounts"][uuid_to_slug(address.id)]
+        return self.address_folder.get_address_resource(address)
 
     def get_uop_resource(self, uop: UserCryptoOperation) -> UserOperation:
         assert uop.user == self.user
@@ -308,15 +388,18 @@ class WalletFolder(Resource):
         return self.get_user_wallet(user)
 
 
-def describe_address(request, ua: UserAddress) -> dict:
-    """Fetch address details and link data for rendering."""
+def describe_address(request, ua: UserAddress, creation_op: CryptoAddressCreation=None) -> dict:
+    """Fetch address details and link data for rendering.
+
+    :param creation_op: Preloaded creation operation of the address. Queried if not given.
+    """
     detail = {}
     detail["user_address"] = ua
     detail["id"] = ua.address.id
     detail["address"] = ua.address.address
     detail["network_resource"] = get_network_resource(request, ua.address.address.network)
     detail["name"] = ua.address.name
-    detail["op"] = ua.address.address.get_creation_op()
+    detail["op"] = creation_op or ua.address.address.get_creation_op()
     return detail
 
 
@@ -336,18 +419,61 @@ def describe_user_address_asset(request, uaa: UserAddressAsset) -> dict:
     return entry
 
 
-def describe_operation(request, uop: UserOperation) -> dict:
-    """Fetch operation details and link data for rendering."""
+def load_wallet_overview(wallet: UserWallet) -> Tuple[List[dict], List[dict]]:
+    """Read all data for the wallet overview page in a fixed number of queries.
+
+    Walking the resource tree does a query or several per address and per asset. Here addresses with their networks, asset accounts with their assets and networks, and address creation operations are each loaded in one query, no matter how many addresses the user has. Resources are put in the same lineage as :meth:`UserWallet.list_all_assets` and :meth:`UserWallet.list_addresses` give.
+
+    :return: Tuple (asset details, address details) as :func:`describe_user_address_asset` and :func:`describe_address` describe them
+    """
+    request = wallet.request
+    dbsession = request.dbsession
+    address_folder = wallet["accounts"]
+
+    user_addresses = dbsession.query(UserCryptoAddress).filter(UserCryptoAddress.user_id == wallet.user.id).options(joinedload(UserCryptoAddress.address).joinedload(CryptoAddress.network)).all()
+    address_ids = [uca.address_id for uca in user_addresses]
+    if not address_ids:
+        return [], []
+
+    crypto_accounts = dbsession.query(CryptoAddressAccount) \
+        .join(Account) \
+        .filter(CryptoAddressAccount.address_id.in_(address_ids)) \
+        .options(contains_eager(CryptoAddressAccount.account).joinedload(Account.asset).joinedload(Asset.network)) \
+        .order_by(Account.created_at.desc())
+
+    accounts_by_address = {}
+    for crypto_account in crypto_accounts:
+        accounts_by_address.setdefault(crypto_account.address_id, []).append(crypto_account)
+
+    creation_ops = dbsession.query(CryptoAddressCreation).filter(CryptoAddressCreation.address_id.in_(address_ids))
+    creation_ops = {op.address_id: op for op in creation_ops}
+
+    asset_details = []
+    address_details = []
+    for uca in user_addresses:
+        ua = address_folder.get_address_resource(uca)
+        for crypto_account in accounts_by_address.get(uca.address_id, []):
+            asset_details.append(describe_user_address_asset(request, ua.get_user_address_asset(crypto_account)))
+        address_details.append(describe_address(request, ua, creation_op=creation_ops.get(uca.address_id)))
+
+    return asset_details, address_details
+
+
+def describe_operation(request, uop: UserOperation, resources: bool=True) -> dict:
+    """Fetch operation details and link data for rendering.
+
+    :param resources: Resolve resources the page links to. API serialization does not link anywhere and skips these lookups.
+    """
     assert isinstance(uop, UserOperation)
     detail = {}
     op = uop.uop.crypto_operation
 
     # Link to the user asset details
     detail["op"] = op
-    if op.holding_account and op.holding_account.asset:
+    if resources and op.holding_account and op.holding_account.asset:
         detail["asset_resource"] = get_user_address_asset(request, op.address, op.holding_account.asset)
 
-    tx = op.primary_tx
+    tx = get_primary_tx(request, op)
 
     # From: and To: swap in address rendering
     detail["deposit_like"] = op.operation_type in (CryptoOperationType.deposit,)
@@ -365,7 +491,9 @@ def describe_operation(request, uop: UserOperation) -> dict:
     if op.txid:
         detail["txid"] = bin_to_txid(op.txid)
 
-    amount = op.amount
+    # Same as op.amount, without querying the transaction again
+    amount = abs(tx.amount) if tx else None
+    detail["amount_value"] = amount
 
     if amount:
         detail["amount"] = format_asset_amount(amount, op.asset.asset_class)
@@ -374,8 +502,9 @@ def describe_operation(request, uop: UserOperation) -> dict:
     detail["resource"] = uop
     detail["tx_name"] = uop.get_title()
     detail["state"] = OP_STATES[op.state]
-    detail["address_resource"] = get_user_address_resource(request, op.address)
-    detail["network_resource"] = get_network_resource(request, op.network)
+    if resources:
+        detail["address_resource"] = get_user_address_resource(request, op.address)
+        detail["network_resource"] = get_network_resource(request, op.network)
 
     detail["manual_confirmation_needed"] = op.state == CryptoOperationState.confirmation_required
 
@@ -385,17 +514,106 @@ def describe_operation(request, uop: UserOperation) -> dict:
     return detail
 
 
+def get_primary_tx(request, op: CryptoOperation) -> Optional[AccountTransaction]:
+    """Get :attr:`CryptoOperation.primary_tx`, shared within the request."""
+    return memoize_for_request(request, "primary_tx", op.id, lambda: op.primary_tx)
+
+
+def preload_operations(request, uops: List[UserOperation]):
+    """Load what :func:`describe_operation` needs for a list of operations in a fixed number of queries.
+
+    Addresses, holding accounts with their assets, primary transactions and address owners are each loaded in one query for all operations and put in the request cache. Describing the operations then does not query per row.
+    """
+    dbsession = request.dbsession
+    ops = [uop.op for uop in uops]
+    if not ops:
+        return
+
+    # Session identity map references rows weakly, keep them around for the request
+    rows = get_request_cache(request, "preloaded_rows").setdefault("rows", [])
+
+    # Operations were loaded as the base class. Load columns of all operation subclasses, like address_id, at once instead of on first access.
+    rows += dbsession.query(CryptoOperation).with_polymorphic("*").filter(CryptoOperation.id.in_([op.id for op in ops])).populate_existing().all()
+
+    crypto_account_ids = {op.crypto_account_id for op in ops if op.crypto_account_id}
+    if crypto_account_ids:
+        rows += dbsession.query(CryptoAddressAccount).filter(CryptoAddressAccount.id.in_(crypto_account_ids)).options(joinedload(CryptoAddressAccount.address), joinedload(CryptoAddressAccount.account)).all()
+
+    address_ids = {getattr(op, "address_id", None) for op in ops} - {None}
+    if address_ids:
+        rows += dbsession.query(CryptoAddress).filter(CryptoAddress.id.in_(address_ids)).all()
+
+    holding_ops = [op for op in ops if op.holding_account_id]
+    if holding_ops:
+        rows += dbsession.query(Account).filter(Account.id.in_({op.holding_account_id for op in holding_ops})).options(joinedload(Account.asset)).all()
+
+        # The earliest escrow transaction of each operation
+        primary_txs = {}
+        txs = dbsession.query(AccountTransaction).filter(AccountTransaction.operation_id.in_([op.id for op in holding_ops])).order_by(AccountTransaction.created_at)
+        holding_account_ids = {op.id: op.holding_account_id for op in holding_ops}
+        for tx in txs:
+            if tx.account_id == holding_account_ids[tx.operation_id]:
+                primary_txs.setdefault(tx.operation_id, tx)
+
+        cache = get_request_cache(request, "primary_tx")
+        for op in holding_ops:
+            cache.setdefault(op.id, primary_txs.get(op.id))
+
+    # Crypto accounts were loaded above, so this does not query
+    address_ids |= {op.crypto_account.address_id for op in ops if op.crypto_account_id}
+    user_addresses = dbsession.query(UserCryptoAddress).filter(UserCryptoAddress.address_id.in_(address_ids)).all() if address_ids else []
+    rows += user_addresses
+
+    cache = get_request_cache(request, "user_crypto_address")
+    user_addresses = {uca.address_id: uca for uca in user_addresses}
+    for address_id in address_ids:
+        cache.setdefault(address_id, user_addresses.get(address_id))
+
+    # Deposits and withdraws link to the account of their own crypto account
+    for op in ops:
+        uca = user_addresses.get(op.crypto_account.address_id) if op.crypto_account_id else None
+        if uca:
+            crypto_account = op.crypto_account
+            memoize_for_request(request, "user_address_asset", (uca.id, crypto_account.account.asset_id), lambda: get_user_address_resource(request, uca.address).get_user_address_asset(crypto_account))
+
+
 @view_config(context=UserOperationFolder, route_name="wallet", name="", renderer="wallet/ops.html")
 @wallet_view
 def operations_root(op_root: UserOperationFolder, request):
-    """When wallet folder is accessed without path key, redirect to the users own wallet."""
-    wallet = op_root.wallet
+    """Transaction history.
 
-    pending_operations= op_root.get_operations(state=[CryptoOperationState.confirmation_required, CryptoOperationState.waiting, CryptoOperationState.broadcasted, CryptoOperationState.pending])
-    pending_operations = [describe_operation(request, uop) for uop in pending_operations]
+    Pending and finished operations are paged separately. ``pending_after`` or ``finished_after`` query parameter continues the corresponding list from a cursor and shows only that list.
+    """
+    wallet = op_root.wallet
 
-    finished_operations = op_root.get_operations(state=[CryptoOperationState.success, CryptoOperationState.failed])
-    finished_operations = [describe_operation(request, uop) for uop in finished_operations]
+    try:
+        limit = int(request.params.get("limit", OPERATIONS_PAGE_SIZE))
+    except ValueError:
+        raise httpexceptions.HTTPBadRequest("Bad limit")
+    limit = max(1, min(limit, MAX_OPERATIONS_PAGE_SIZE))
+
+    pending_after = request.params.get("pending_after")
+    finished_after = request.params.get("finished_after")
+
+    pending_operations = finished_operations = []
+    next_pending_url = next_finished_url = None
+
+    try:
+        if not finished_after:
+            pending_operations, cursor = op_root.get_operations_page(PENDING_OP_STATES, after=pending_after, limit=limit)
+            preload_operations(request, pending_operations)
+            pending_operations = [describe_operation(request, uop) for uop in pending_operations]
+            if cursor:
+                next_pending_url = request.resource_url(op_root, query={"pending_after": cursor, "limit": limit})
+
+        if not pending_after:
+            finished_operations, cursor = op_root.get_operations_page(FINISHED_OP_STATES, after=finished_after, limit=limit)
+            preload_operations(request, finished_operations)
+            finished_operations = [describe_operation(request, uop) for uop in finished_operations]
+            if cursor:
+                next_finished_url = request.resource_url(op_root, query={"finished_after": cursor, "limit": limit})
+    except BadCursor:
+        raise httpexceptions.HTTPBadRequest("Bad cursor")
 
     breadcrumbs = get_breadcrumbs(op_root, request)
 
@@ -464,8 +682,7 @@ def wallet_overview(wallet: UserWallet, request: Request):
     # Set up initial addresses if user doesn't have any yet
     setup_user_account(user, request=request)
 
-    asset_details = [describe_user_address_asset(request, asset) for asset in wallet.list_all_assets()]
-    address_details = [describe_address(request, address) for address in wallet.list_addresses()]
+    asset_details, address_details = load_wallet_overview(wallet)
     breadcrumbs = get_breadcrumbs(wallet, request)
 
     return locals()
@@ -505,38 +722,55 @@ def route_factory(request):
     return Resource.make_lineage(root, wallet_root, "wallet")
 
 
+def get_wallet_folder(request) -> WalletFolder:
+    """Get the root of wallet resources, shared within the request."""
+    return memoize_for_request(request, "wallet_folder", None, lambda: route_factory(request))
+
+
+def get_user_wallet_resource(request, user: User) -> UserWallet:
+    """Get wallet resource of a user, shared within the request."""
+    return memoize_for_request(request, "user_wallet", user.id, lambda: get_wallet_folder(request).get_user_wallet(user))
+
+
+def get_user_crypto_address(request, address: CryptoAddress) -> UserCryptoAddress:
+    """Get the owner record of an address, shared within the request."""
+    return memoize_for_request(request, "user_crypto_address", address.id, lambda: UserCryptoAddress.get_by_address(address))
+
+
 def get_user_crypto_operation_resource(request, uop: UserCryptoOperation) -> UserOperation:
     assert isinstance(uop, UserCryptoOperation)
-    wallet_root = route_factory(request)
-    wallet = wallet_root[uuid_to_slug(uop.user.uuid)]
+    wallet = get_user_wallet_resource(request, uop.user)
     return wallet.get_uop_resource(uop)
 
 
 def get_user_address_resource(request, address: CryptoAddress) -> UserAddress:
-    uca = UserCryptoAddress.get_by_address(address)
+    uca = get_user_crypto_address(request, address)
     if not uca:
         return None
-    wallet_root = route_factory(request)
-    wallet = wallet_root.get_user_wallet(uca.user)
-    return wallet.get_address_resource(uca)
+
+    def resolve():
+        wallet = get_user_wallet_resource(request, uca.user)
+        return wallet.get_address_resource(uca)
+
+    return memoize_for_request(request, "user_address", uca.id, resolve)
 
 
 def get_user_address_asset(request, address: CryptoAddress, asset: Asset) -> UserAddressAsset:
     assert isinstance(asset, Asset)
-    uca = UserCryptoAddress.get_by_address(address)
+    uca = get_user_crypto_address(request, address)
     if not uca:
         return None
-    wallet_root = route_factory(request)
-    wallet = wallet_root.get_user_wallet(uca.user)
-    address = wallet.get_address_resource(uca)
-    crypto_address_account = address.address.get_crypto_account(asset)
-    asset = address.get_user_address_asset(crypto_address_account)
-    return asset
+
+    def resolve():
+        address = get_user_address_resource(request, uca.address)
+        crypto_address_account = address.address.get_crypto_account(asset)
+        return address.get_user_address_asset(crypto_address_account)
+
+    return memoize_for_request(request, "user_address_asset", (uca.id, asset.id), resolve)
 
 
 def get_user_wallet(request) -> UserWallet:
-    wallet_root = route_factory(request)
-    return wallet_root[uuid_to_slug(request.user.uuid)]
+    return get_user_wallet_resource(request, request.user)
 
 
 